@@ -0,0 +1,177 @@
+"""Benchmark suite: schedule_shutdown and the bulk fleet paths against the simulator
+
+    python benchmarks/fleet.py                                   # 100 and 500 hosts, 32 and 128 workers
+    python benchmarks/fleet.py --hosts 1000 --parallel 256 --latency 0.05 --failure-rate 0.05 --down-rate 0.02
+    python benchmarks/fleet.py --backend asyncssh --parallel 1000
+    python benchmarks/fleet.py --flaky-rate 0.1 --down-mode hang --down-rate 0.05 --no-retry
+
+For every (hosts, parallel) pair a fresh FleetSimulator is started in this process
+and turnoff is driven exactly as the web interface and the CLI do: a serial run of
+schedule_shutdown on a few hosts (first with new connections, then pooled), followed
+by the bulk scheduled shutdown, reschedule, cancel and immediate shutdown through
+fleet_operation with preflight. Each row reports throughput, p50/p99 per host,
+resident memory and the hosts whose outcome differs from what the simulator
+expected, so the run doubles as a regression check (exit code 1 on mismatches).
+Immediate shutdowns that did happen but were not acknowledged within the grace
+period are listed apart. Failed hosts are retried with the default RetryPolicy
+unless `--no-retry` is given, and "retried" counts the hosts that needed it. The
+last row, verify_off, probes the hosts that accepted the immediate shutdown until
+they stop answering and checks the result against the hosts the simulator powered
+off. The simulator shares this process and its CPU, so on small machines keep the
+fleet and `--parallel` modest or the numbers measure starvation.
+"""
+import argparse
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def rss_mb():
+    """Current resident set size of this process"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+def summarize(name, entries, wall, expected, rss_before):
+    from turnoff.metrics import percentile
+    latencies = sorted(entry["timings"]["total_ms"] for entry in entries
+                       if entry["success"] and "total_ms" in entry.get("timings", {}))
+    mismatches = [entry for entry in entries if entry["success"] != expected[entry["ip"]]]
+    return {"operation": name, "hosts": len(entries), "ok": sum(entry["success"] for entry in entries),
+            "wall_s": wall, "hosts_per_s": len(entries) / wall if wall else 0,
+            "p50_ms": percentile(latencies, 0.5), "p99_ms": percentile(latencies, 0.99),
+            "rss_mb": rss_mb(), "rss_delta_mb": rss_mb() - rss_before, "mismatches": mismatches}
+
+def single_host(fleet, count, timeout):
+    """Serial schedule_shutdown on up to `count` healthy hosts, new then pooled connections"""
+    from turnoff.power import schedule_shutdown
+    healthy = [target for target in fleet.targets()
+               if fleet.expected_success(target["IP"]) and not fleet.hosts[target["IP"]].drops][:count]
+    rows = []
+    for name in ("schedule_shutdown (nueva)", "schedule_shutdown (pool)"):
+        expected = {target["IP"]: fleet.expected_success(target["IP"]) for target in healthy}
+        entries, rss_before, started = [], rss_mb(), time.perf_counter()
+        for target in healthy:
+            trace, host_started = {}, time.perf_counter()
+            success, message = schedule_shutdown(target["IP"], "Linux", "admin", target["ssh_password"],
+                                                 shutdown_time=datetime.now() + timedelta(minutes=30),
+                                                 timeout=timeout, trace=trace)
+            entries.append({"ip": target["IP"], "success": success, "message": message,
+                            "timings": {"total_ms": (time.perf_counter() - host_started) * 1000}})
+        rows.append(summarize(name, entries, time.perf_counter() - started, expected, rss_before))
+    return rows
+
+def bulk(fleet, parallel, timeout, backend, retry):
+    """The four fleet operations in the order an operator would run them, then the shutdown check"""
+    from turnoff.fleet import (cancel_shutdown_task, fleet_operation, immediate_shutdown_task,
+                               reschedule_shutdown_task, scheduled_shutdown_task)
+    from turnoff.verify import ShutdownVerifier
+    at = datetime.now() + timedelta(minutes=30)
+    operations = [
+        ("scheduled_shutdown", scheduled_shutdown_task(at, timeout, backend=backend), "schedule"),
+        ("reschedule", reschedule_shutdown_task(at + timedelta(minutes=30), timeout, backend=backend), "schedule"),
+        ("cancel", cancel_shutdown_task(timeout, backend=backend), "cancel"),
+        ("immediate_shutdown", immediate_shutdown_task(timeout, backend=backend), "shutdown"),
+    ]
+    rows = []
+    for operation, task, agent_action in operations:
+        # Se fija antes de ejecutar: el apagado inmediato cambia el estado de los equipos
+        expected = {ip: fleet.expected_success(ip) for ip in fleet.hosts}
+        rss_before, started = rss_mb(), time.perf_counter()
+        entries = list(fleet_operation(fleet.targets(), task, operation, agent_action=agent_action,
+                                       max_workers=parallel, retry=retry))
+        row = summarize(operation, entries, time.perf_counter() - started, expected, rss_before)
+        # Apagados que llegaron a producirse aunque la confirmación no llegó dentro del margen
+        row["unconfirmed"] = [entry for entry in row["mismatches"]
+                              if not entry["success"] and fleet.hosts[entry["ip"]].powered_off]
+        row["mismatches"] = [entry for entry in row["mismatches"] if entry not in row["unconfirmed"]]
+        row["retried"] = sum(entry.get("timings", {}).get("attempts", 1) > 1 for entry in entries)
+        rows.append(row)
+    # Los equipos apagados por el simulador dejan de aceptar conexiones en cuanto cae la sesión
+    rss_before, started = rss_mb(), time.perf_counter()
+    confirmed = ShutdownVerifier(grace=0, interval=0.5, deadline=5, misses=1).confirm(entries, log=False)
+    expected = {entry["ip"]: fleet.hosts[entry["ip"]].powered_off for entry in confirmed}
+    # Latencia de la fila: lo que tardó cada equipo en dejar de responder
+    confirmed = [dict(entry, timings={"total_ms": entry["confirmation_s"] * 1000}) for entry in confirmed]
+    rows.append(summarize("verify_off", confirmed, time.perf_counter() - started, expected, rss_before))
+    return rows
+
+def print_row(row):
+    p50 = f"{row['p50_ms']:.0f}" if row["p50_ms"] is not None else "-"
+    p99 = f"{row['p99_ms']:.0f}" if row["p99_ms"] is not None else "-"
+    print(f"  {row['operation']:<27} {row['hosts']:>6} {row['ok']:>6} {row['wall_s']:>8.2f} "
+          f"{row['hosts_per_s']:>8.1f} {p50:>8} {p99:>8} {row['rss_mb']:>7.0f} {row['rss_delta_mb']:>+7.1f} "
+          f"{len(row['mismatches']):>6}")
+    for entry in row["mismatches"][:3]:
+        print(f"      ≠ {entry['ip']}: {entry['message'][:90]}")
+    if row.get("retried"):
+        print(f"      {row['retried']} hosts needed more than one attempt")
+    if row.get("unconfirmed"):
+        print(f"      {len(row['unconfirmed'])} hosts powered off without acknowledging in time "
+              f"(e.g. {row['unconfirmed'][0]['message'][:60]})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--parallel", type=int, nargs="+", default=[32, 128])
+    parser.add_argument("--backend", choices=["paramiko", "asyncssh"], default="paramiko")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per command (0.02)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds per command")
+    parser.add_argument("--auth-delay", type=float, default=0.0, help="Seconds per password check")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of hosts whose shutdown fails")
+    parser.add_argument("--down-rate", type=float, default=0.0, help="Fraction of unreachable hosts")
+    parser.add_argument("--down-mode", choices=["refuse", "hang"], default="refuse")
+    parser.add_argument("--flaky-rate", type=float, default=0.0,
+                        help="Fraction of hosts that drop their first SSH connection")
+    parser.add_argument("--stuck-rate", type=float, default=0.0,
+                        help="Fraction of hosts that accept an immediate shutdown but stay up")
+    parser.add_argument("--no-retry", action="store_true", help="One attempt per host in the bulk operations")
+    parser.add_argument("--single", type=int, default=20, help="Hosts in the serial schedule_shutdown run (20)")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="Per-host timeout in seconds (30: the simulator competes for the same CPU)")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Antes de importar turnoff: datos temporales y el puerto del simulador
+    os.environ["TURNOFF_DATA_DIR"] = tempfile.mkdtemp(prefix="turnoff-bench-")
+    os.environ["TURNOFF_SSH_PORT"] = str(args.port)
+    # Los errores de conexión ya constan en cada entrada; paramiko además los vuelca con traza
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    from simulator import FleetSimulator
+    from turnoff.retry import RetryPolicy, get_circuit_breaker
+    from turnoff.ssh import get_connection_pool
+
+    print(f"{'':2}{'operation':<27} {'hosts':>6} {'ok':>6} {'wall s':>8} {'hosts/s':>8} {'p50 ms':>8} "
+          f"{'p99 ms':>8} {'RSS MB':>7} {'ΔRSS':>7} {'≠':>6}")
+    mismatches = 0
+    for count in args.hosts:
+        for parallel in args.parallel:
+            fleet = FleetSimulator(count, port=args.port, latency=args.latency, jitter=args.jitter,
+                                   auth_delay=args.auth_delay, failure_rate=args.failure_rate,
+                                   down_rate=args.down_rate, down_mode=args.down_mode,
+                                   flaky_rate=args.flaky_rate, stuck_rate=args.stuck_rate, seed=args.seed)
+            # Cada simulador reutiliza las mismas IP: el cortocircuito empieza de cero
+            get_circuit_breaker().reset()
+            with fleet:
+                print(f"{count} hosts, {parallel} in flight, {args.backend}: "
+                      f"{sum(host.down for host in fleet.hosts.values())} down, "
+                      f"{sum(host.failing for host in fleet.hosts.values())} failing, "
+                      f"{sum(bool(host.drops) for host in fleet.hosts.values())} flaky, "
+                      f"{sum(host.stuck for host in fleet.hosts.values())} stuck")
+                rows = single_host(fleet, args.single, args.timeout) if args.single else []
+                rows += bulk(fleet, parallel, args.timeout, args.backend,
+                             False if args.no_retry else RetryPolicy())
+                for row in rows:
+                    print_row(row)
+                    mismatches += len(row["mismatches"])
+                get_connection_pool().close_all()
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
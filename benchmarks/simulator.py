@@ -0,0 +1,336 @@
+"""In-process SSH fleet simulator for benchmarks and regression runs
+
+    fleet = FleetSimulator(500, latency=0.02, auth_delay=0.01, failure_rate=0.05, down_rate=0.02)
+    fleet.start()
+    ...  # point turnoff at fleet.port (TURNOFF_SSH_PORT) and use fleet.targets()
+    fleet.stop()
+
+Every simulated host is a paramiko ServerInterface on its own loopback address
+(127.0.x.y, Linux) and a shared port. One selector thread accepts connections for all
+hosts, each connection gets a paramiko server Transport, and command replies are
+delayed by `latency` on a single timer thread instead of one thread per command.
+
+Hosts understand what turnoff sends: `whoami` (also folded as `whoami; ...`),
+`sudo -n`, `echo "<password>" | sudo -S`, `bash -c "..."`, `id`, `shutdown -h +N`,
+`shutdown now`, `shutdown -c` and the host status command. A shutdown on a
+`failing` host exits with an error; `shutdown now` powers the host off, which drops
+the connection and refuses new ones. `down` hosts either refuse connections or, with
+down_mode="hang", accept TCP but never answer the SSH banner. `flaky` hosts hang up
+on their first `flaky_drops` SSH connections (port probes do not count), the
+transient errors the retry policy exists for. `stuck` hosts accept `shutdown now`
+and stay up, like a machine whose shutdown is blocked by a hung process.
+"""
+import heapq
+import logging
+import random
+import re
+import selectors
+import socket
+import threading
+import time
+
+import paramiko
+
+PASSWORD = "pw"
+
+# Los sondeos previos abren y cierran el puerto sin hablar SSH: no son errores del servidor
+_log = logging.getLogger("turnoff.simulator")
+_log.addHandler(logging.NullHandler())
+_log.propagate = False
+
+_host_key = None
+_host_key_lock = threading.Lock()
+
+def host_key():
+    """One RSA host key per process, so known_hosts stays valid across simulators"""
+    global _host_key
+    with _host_key_lock:
+        if _host_key is None:
+            _host_key = paramiko.RSAKey.generate(2048)
+        return _host_key
+
+def addresses(count):
+    return [f"127.0.{index // 250 + 1}.{index % 250 + 1}" for index in range(count)]
+
+class SimulatedHost:
+    """State of one fake machine: behaviour flags, pending shutdown and counters"""
+
+    def __init__(self, ip, failing=False, down=False, sudo_nopasswd=False, drops=0, stuck=False):
+        self.ip = ip
+        self.mac = "52:54:00:" + ":".join(f"{int(part):02x}" for part in ip.split(".")[1:])
+        self.failing = failing
+        self.down = down
+        self.sudo_nopasswd = sudo_nopasswd
+        self.drops = drops  # Conexiones SSH que aún se cortarán nada más abrirse
+        self.stuck = stuck
+        self.powered_off = False
+        self.pending = None  # Hora (time.time()) del apagado programado
+        self.connections = 0
+        self.commands = []
+
+    @property
+    def up(self):
+        return not self.down and not self.powered_off
+
+    def execute(self, username, command):
+        """Run one command line; returns (stdout, stderr, exit status, power off)"""
+        self.commands.append(command)
+        stdout = ""
+        for prefix in ("whoami; ", "whoami & "):
+            if command.startswith(prefix):
+                stdout, command = username + "\n", command[len(prefix):]
+        out, err, status, power_off = self._run(username, command.strip(), root=False)
+        return stdout + out, err, status, power_off
+
+    def _run(self, username, command, root):
+        match = re.fullmatch(r'echo "(.*)" \| sudo -S (.+)', command)
+        if match:
+            if match.group(1) != PASSWORD:
+                return "", "Sorry, try again.\nsudo: 1 incorrect password attempt", 1, False
+            return self._run(username, match.group(2), root=True)
+        if command.startswith("sudo -n "):
+            if not self.sudo_nopasswd:
+                return "", "sudo: a password is required", 1, False
+            return self._run(username, command[len("sudo -n "):], root=True)
+        match = re.fullmatch(r'bash -c "(.+)"', command)
+        if match:
+            return self._run(username, match.group(1), root)
+        if command == "whoami":
+            return ("root" if root else username) + "\n", "", 0, False
+        if command == "id":
+            return ("uid=0(root) gid=0(root)" if root else "uid=1000(admin) gid=1000(admin)") + "\n", "", 0, False
+        if command.startswith("cat /proc/uptime"):
+            pending = "" if self.pending is None else f"USEC={int(self.pending * 1e6)}\nWARN_WALL=1\nMODE=poweroff\n"
+            return (f"4242.5 1000.0\n---\n0.10 0.20 0.30 1/100 4242\n---\n{pending}---\n---\n{self.mac}\n",
+                    "", 0, False)
+        if command.startswith("shutdown"):
+            if not root:
+                return "", "Failed to set wall message, ignoring: Interactive authentication required.", 1, False
+            if self.failing:
+                return "", "Failed to call ScheduleShutdown in logind: Access denied", 1, False
+            argument = command[len("shutdown"):].strip()
+            if argument == "-c":
+                self.pending = None
+                return "", "", 0, False
+            if argument == "now":
+                return "", "", 0, not self.stuck
+            match = re.fullmatch(r"-h \+(\d+)", argument)
+            if match:
+                self.pending = time.time() + int(match.group(1)) * 60
+                scheduled = f"Shutdown scheduled for {time.ctime(self.pending)}, use 'shutdown -c' to cancel.\n"
+                return scheduled, "", 0, False
+            return "", f"shutdown: invalid argument '{argument}'", 1, False
+        return "", f"bash: {command.split()[0]}: command not found", 127, False
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, fleet, host):
+        self.fleet = fleet
+        self.host = host
+        self.username = None
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if self.fleet.auth_delay:
+            time.sleep(self.fleet.auth_delay)
+        if password != PASSWORD:
+            return paramiko.AUTH_FAILED
+        self.username = username
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode(errors="replace")
+        self.fleet.later(self.fleet.command_delay(), self.fleet.reply, self.host, self.username, channel, command)
+        return True
+
+class FleetSimulator:
+    """`count` simulated hosts on 127.0.x.y:`port`
+
+    `latency` (seconds, plus up to `jitter`) delays every command reply and
+    `auth_delay` every password check. A `failure_rate` fraction of the hosts fails
+    shutdown commands, a `down_rate` fraction is unreachable, a `flaky_rate`
+    fraction drops its first `flaky_drops` connections and a `stuck_rate` fraction
+    never powers off; which ones is fixed by `seed`. Use as a context manager or
+    call start() and stop().
+    """
+
+    def __init__(self, count, port=2222, latency=0.02, jitter=0.0, auth_delay=0.0, failure_rate=0.0,
+                 down_rate=0.0, down_mode="refuse", flaky_rate=0.0, flaky_drops=1, stuck_rate=0.0,
+                 sudo_nopasswd=False, seed=1):
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.auth_delay = auth_delay
+        self.down_mode = down_mode
+        self._random = random.Random(seed)
+        self.hosts = {}
+        for ip in addresses(count):
+            roll = self._random.random()
+            flaky = down_rate + failure_rate <= roll < down_rate + failure_rate + flaky_rate
+            stuck = 1 - stuck_rate <= roll
+            self.hosts[ip] = SimulatedHost(ip, failing=down_rate <= roll < down_rate + failure_rate,
+                                           down=roll < down_rate, sudo_nopasswd=sudo_nopasswd,
+                                           drops=flaky_drops if flaky else 0, stuck=stuck)
+        self._selector = selectors.DefaultSelector()
+        self._listeners = {}
+        self._transports = set()
+        self._lock = threading.Lock()
+        self._timers = []
+        self._timer_ready = threading.Condition()
+        self._running = False
+
+    def targets(self, os_type="Linux"):
+        """Inventory-style rows for turnoff, with the simulator's credentials"""
+        return [{"IP": ip, "OS": os_type, "Description": "simulado", "Group": "", "Tags": "", "MAC": "",
+                 "ssh_user": "admin", "ssh_password": PASSWORD, "sudo_pass": "", "ssh_key": ""}
+                for ip in self.hosts]
+
+    def expected_success(self, ip):
+        """Whether an operation on `ip` should succeed right now (flaky hosts after a retry)"""
+        host = self.hosts[ip]
+        return host.up and not host.failing
+
+    def start(self):
+        host_key()
+        self._running = True
+        for host in self.hosts.values():
+            if host.down and self.down_mode == "refuse":
+                continue
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((host.ip, self.port))
+            listener.listen(128)
+            listener.setblocking(False)
+            self._listeners[host.ip] = listener
+            if not host.down:
+                # Un equipo "colgado" acepta TCP en el backlog pero nunca responde
+                self._selector.register(listener, selectors.EVENT_READ, host)
+        threading.Thread(target=self._accept_forever, name="sim-accept", daemon=True).start()
+        threading.Thread(target=self._timers_forever, name="sim-timers", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        with self._timer_ready:
+            self._timer_ready.notify()
+        for listener in self._listeners.values():
+            try:
+                self._selector.unregister(listener)
+            except (KeyError, ValueError):
+                pass
+            listener.close()
+        self._listeners.clear()
+        with self._lock:
+            transports = list(self._transports)
+            self._transports.clear()
+        for transport in transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def command_delay(self):
+        return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def later(self, delay, callback, *args):
+        with self._timer_ready:
+            heapq.heappush(self._timers, (time.monotonic() + delay, id(args), callback, args))
+            self._timer_ready.notify()
+
+    def reply(self, host, username, channel, command):
+        stdout, stderr, status, power_off = host.execute(username, command)
+        try:
+            if stdout:
+                channel.sendall(stdout.encode())
+            if stderr:
+                channel.sendall_stderr(stderr.encode())
+            channel.send_exit_status(status)
+            channel.close()
+        except Exception:
+            return
+        if power_off:
+            self.later(0.05, self.power_off, host, channel.get_transport())
+
+    def power_off(self, host, transport):
+        host.powered_off = True
+        host.pending = None
+        listener = self._listeners.pop(host.ip, None)
+        if listener is not None:
+            try:
+                self._selector.unregister(listener)
+            except (KeyError, ValueError):
+                pass
+            listener.close()
+        with self._lock:
+            self._transports.discard(transport)
+        transport.close()
+
+    def _accept_forever(self):
+        while self._running:
+            try:
+                events = self._selector.select(timeout=0.2)
+            except (OSError, ValueError):
+                continue
+            for key, _ in events:
+                try:
+                    sock, _ = key.fileobj.accept()
+                except (BlockingIOError, OSError):
+                    continue
+                host = key.data
+                host.connections += 1
+                if host.drops:
+                    # Se espera al saludo del cliente para distinguir una sesión SSH de un sondeo
+                    self.later(0.05, self._drop_or_serve, host, sock)
+                    continue
+                self._serve(host, sock)
+
+    def _drop_or_serve(self, host, sock):
+        try:
+            data = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            data = None
+        except OSError:
+            data = b""
+        if data and host.drops:
+            host.drops -= 1
+            sock.close()
+        elif data == b"":
+            sock.close()  # Sondeo de puerto ya cerrado
+        else:
+            self._serve(host, sock)
+
+    def _serve(self, host, sock):
+        sock.setblocking(True)
+        transport = paramiko.Transport(sock)
+        transport.set_log_channel("turnoff.simulator")
+        transport.add_server_key(host_key())
+        with self._lock:
+            self._transports.add(transport)
+        try:
+            # Con un evento, la negociación sigue en el hilo del transporte
+            transport.start_server(event=threading.Event(), server=_Server(self, host))
+        except Exception:
+            transport.close()
+
+    def _timers_forever(self):
+        while self._running:
+            with self._timer_ready:
+                while self._running and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    timeout = self._timers[0][0] - time.monotonic() if self._timers else None
+                    self._timer_ready.wait(timeout)
+                if not self._running:
+                    return
+                _, _, callback, args = heapq.heappop(self._timers)
+            try:
+                callback(*args)
+            except Exception:
+                pass
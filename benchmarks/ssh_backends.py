@@ -0,0 +1,147 @@
+"""Benchmark: paramiko thread pool vs asyncssh event loop on a simulated fleet
+
+    python benchmarks/ssh_backends.py                      # 100, 1000 and 5000 hosts
+    python benchmarks/ssh_backends.py --hosts 100 1000 --latency 0.05 --parallel 1000
+
+Every simulated host is an asyncssh server on its own loopback address (127.0.x.y,
+Linux only) in a separate process; it accepts the password "pw" and answers whoami,
+sudo shutdown and shutdown -c after `--latency` seconds. Each (backend, hosts) case
+runs a scheduled shutdown through run_fleet in a fresh process, without preflight,
+and reports wall time, throughput, per-host p50/p99, peak RSS, peak thread count and
+CPU time. Requires asyncssh and enough file descriptors (ulimit -n) for the fleet.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def addresses(count):
+    return [f"127.0.{index // 250 + 1}.{index % 250 + 1}" for index in range(count)]
+
+def serve(count, port, latency):
+    """Run `count` simulated SSH hosts until stdin closes"""
+    import asyncssh
+
+    class Server(asyncssh.SSHServer):
+        def begin_auth(self, username):
+            return True
+
+        def password_auth_supported(self):
+            return True
+
+        def validate_password(self, username, password):
+            return password == "pw"
+
+    async def handle(process):
+        await asyncio.sleep(latency)
+        if "whoami" in (process.command or ""):
+            process.stdout.write(process.get_extra_info("username") + "\n")
+        process.exit(0)
+
+    async def main():
+        key = asyncssh.generate_private_key("ssh-ed25519")
+        for address in addresses(count):
+            await asyncssh.listen(address, port, server_host_keys=[key], server_factory=Server,
+                                  process_factory=handle, backlog=1024)
+        print("ready", flush=True)
+        await asyncio.get_running_loop().run_in_executor(None, sys.stdin.read)
+
+    asyncio.run(main())
+
+def run_case(backend, count, parallel, timeout):
+    """Shut `count` simulated hosts down with `backend`; prints one JSON line"""
+    sys.path.insert(0, ROOT)
+    from turnoff.fleet import run_fleet, scheduled_shutdown_task
+    from turnoff.metrics import percentile
+
+    targets = [{"IP": ip, "OS": "Linux", "ssh_user": "admin", "ssh_password": "pw", "sudo_pass": ""}
+               for ip in addresses(count)]
+    task = scheduled_shutdown_task(datetime.now() + timedelta(minutes=30), timeout, backend=backend)
+    peak_threads = threading.active_count()
+    running = True
+
+    def sample():
+        nonlocal peak_threads
+        while running:
+            peak_threads = max(peak_threads, threading.active_count())
+            time.sleep(0.05)
+
+    threading.Thread(target=sample, daemon=True).start()
+    cpu, started = os.times(), time.perf_counter()
+    entries = list(run_fleet(targets, task, max_workers=parallel))
+    wall = time.perf_counter() - started
+    cpu_end = os.times()
+    running = False
+    latencies = sorted(entry["timings"]["total_ms"] for entry in entries
+                       if entry["success"] and "total_ms" in entry.get("timings", {}))
+    errors = {}
+    for entry in entries:
+        if not entry["success"]:
+            errors[entry["message"][:80]] = errors.get(entry["message"][:80], 0) + 1
+    print(json.dumps({
+        "backend": backend, "hosts": count, "ok": len(latencies), "wall_s": round(wall, 2),
+        "hosts_per_s": round(count / wall, 1), "p50_ms": percentile(latencies, 0.5),
+        "p99_ms": percentile(latencies, 0.99),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_threads": peak_threads,
+        "cpu_s": round(cpu_end.user + cpu_end.system - cpu.user - cpu.system, 2),
+        "errors": errors
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--backends", nargs="+", default=["paramiko", "asyncssh"])
+    parser.add_argument("--parallel", type=int, default=500, help="Hosts in flight for both backends (500)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per simulated command (0.02)")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-host timeout in seconds (60)")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--case", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve, args.port, args.latency)
+    if args.case:
+        return run_case(args.case[0], int(args.case[1]), args.parallel, args.timeout)
+
+    script = os.path.abspath(__file__)
+    server = subprocess.Popen([sys.executable, script, "--serve", str(max(args.hosts)), "--port", str(args.port),
+                               "--latency", str(args.latency)], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              text=True)
+    try:
+        if server.stdout.readline().strip() != "ready":
+            sys.exit("The simulated fleet did not start")
+        print(f"{'backend':<10} {'hosts':>6} {'ok':>6} {'wall s':>8} {'hosts/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'RSS MB':>7} {'threads':>7} {'CPU s':>6}")
+        for count in args.hosts:
+            for backend in args.backends:
+                # Directorio de datos nuevo por caso: known_hosts vacío y sin conexiones previas
+                with tempfile.TemporaryDirectory() as data_dir:
+                    env = dict(os.environ, TURNOFF_DATA_DIR=data_dir, TURNOFF_SSH_PORT=str(args.port))
+                    output = subprocess.run([sys.executable, script, "--case", backend, str(count),
+                                             "--parallel", str(args.parallel), "--timeout", str(args.timeout)],
+                                            env=env, capture_output=True, text=True)
+                if output.returncode:
+                    print(f"{backend:<10} {count:>6} failed: {output.stderr.strip().splitlines()[-1:]}")
+                    continue
+                row = json.loads(output.stdout.strip().splitlines()[-1])
+                print(f"{backend:<10} {count:>6} {row['ok']:>6} {row['wall_s']:>8} {row['hosts_per_s']:>8} "
+                      f"{row['p50_ms']:>8} {row['p99_ms']:>8} {row['peak_rss_mb']:>7} {row['peak_threads']:>7} "
+                      f"{row['cpu_s']:>6}")
+                for message, hosts in row["errors"].items():
+                    print(f"    {hosts} x {message}")
+    finally:
+        server.stdin.close()
+        server.wait(timeout=30)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,52 @@
 import streamlit as st
-import paramiko
 from datetime import datetime, timedelta
 import time
 import os
-import uuid
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Create a session state for tracking shutdown attempts if it doesn't exist
-if 'shutdown_results' not in st.session_state:
-    st.session_state.shutdown_results = []
+from turnoff.agent import get_agent_client
+from turnoff.config import SSH_PORT
+from turnoff.fleet import (RolloutPlan, cancel_shutdown_task, computer_with_credentials, fleet_operation,
+                           immediate_shutdown_task, reschedule_shutdown_task, scheduled_shutdown_task)
+from turnoff.inventory import export_inventory, get_inventory, import_inventory, normalize_mac
+from turnoff.logs import format_timings, get_activity_log, log_entry
+from turnoff.metrics import METRICS_FILE, get_metrics
+from turnoff.network import ping_host, scan_hosts
+from turnoff.power import minutes_until
+from turnoff.retry import get_circuit_breaker, get_retry_policy
+from turnoff.scheduler import WEEKDAYS, get_job_store
+from turnoff.ssh import (SSH_BACKENDS, asyncssh_available, get_connection_pool, get_ssh_auth, has_credentials,
+                         run_remote, ssh_backend, sudo_attempts)
+from turnoff.state import format_uptime, get_host_states
+from turnoff.verify import CONFIRMATION_LABELS, get_shutdown_verifier
+from turnoff.wol import get_wake_on_lan
+
+# La lógica vive en el paquete turnoff (también usado por el CLI); este script es solo la interfaz web.
+# Cada objeto compartido existe una vez por proceso, así que sobrevive a las re-ejecuciones de Streamlit.
+ssh_auth = get_ssh_auth()
+connection_pool = get_connection_pool()
+activity_log = get_activity_log()
+metrics = get_metrics()
+agent_client = get_agent_client()
+wake_on_lan = get_wake_on_lan()
+retry_policy = get_retry_policy()
+circuit_breaker = get_circuit_breaker()
+shutdown_verifier = get_shutdown_verifier()
+inventory = get_inventory()
+host_states = get_host_states()
+job_store = get_job_store()
+
+@st.cache_resource
+def serve_metrics():
+    """TURNOFF_METRICS_PORT also serves the latency metrics at /metrics"""
+    port = os.environ.get("TURNOFF_METRICS_PORT")
+    return metrics.serve(int(port)) if port else None
+
+serve_metrics()
+
+# Create session state defaults if they don't exist
 if 'ssh_user' not in st.session_state:
     st.session_state.ssh_user = "admin"  # Default user (legacy)
 if 'ssh_password' not in st.session_state:
@@ -16,206 +55,289 @@ if 'sudo_pass' not in st.session_state:
     st.session_state.sudo_pass = ""      # Default sudo password (legacy)
 if 'page' not in st.session_state:
     st.session_state.page = "dashboard"
+if 'inventory_editor_version' not in st.session_state:
+    st.session_state.inventory_editor_version = 0
+if 'exec_workers' not in st.session_state:
+    st.session_state.exec_workers = 32      # Conexiones SSH simultáneas
+if 'exec_host_timeout' not in st.session_state:
+    st.session_state.exec_host_timeout = 10  # Segundos por equipo
+if 'exec_total_timeout' not in st.session_state:
+    st.session_state.exec_total_timeout = 120  # Segundos para todo el lote
+if 'exec_preflight' not in st.session_state:
+    st.session_state.exec_preflight = True   # Sondear el puerto 22 antes de conectar
+if 'exec_preflight_timeout' not in st.session_state:
+    st.session_state.exec_preflight_timeout = 0.8  # Segundos por sondeo previo
+if 'exec_lean' not in st.session_state:
+    st.session_state.exec_lean = True  # Sin ida y vuelta whoami separada
+if 'exec_rollout' not in st.session_state:
+    st.session_state.exec_rollout = False  # Apagar por oleadas en lugar de todos a la vez
+if 'rollout_by' not in st.session_state:
+    st.session_state.rollout_by = "size"
+if 'rollout_size' not in st.session_state:
+    st.session_state.rollout_size = 50
+if 'rollout_delay' not in st.session_state:
+    st.session_state.rollout_delay = 30  # Segundos entre oleadas
+if 'rollout_jitter' not in st.session_state:
+    st.session_state.rollout_jitter = 10  # Segundos aleatorios añadidos a cada pausa
+if 'rollout_max_failure' not in st.session_state:
+    st.session_state.rollout_max_failure = 50  # % de fallos en una oleada que detiene el despliegue
+
+def session_credentials(computer):
+    """Resolve a computer's credentials against the session's global defaults"""
+    return computer_with_credentials(computer, st.session_state.ssh_user, st.session_state.ssh_password,
+                                     st.session_state.sudo_pass)
+
+# Define immediate shutdown handler function with per-computer credentials
+def handle_immediate_shutdown(ip, os_type, computer=None):
+    target = session_credentials(dict(computer or {}, IP=ip.strip(), OS=os_type))
+    if not target["IP"]:
+        activity_log.append(log_entry(False, "Unknown", os_type, "IP address is required"))
+        return
+    entries = list(fleet_operation(
+        [target],
+        immediate_shutdown_task(st.session_state.exec_host_timeout, st.session_state.exec_lean),
+        "immediate_shutdown",
+        agent_action="shutdown",
+        preflight=st.session_state.exec_preflight,
+        preflight_timeout=st.session_state.exec_preflight_timeout,
+        max_workers=1
+    ))
+    activity_log.extend(entries)
+    shutdown_verifier.watch(entries)
+    host_states.invalidate([target["IP"]])
 
-def schedule_shutdown(ip, os_type, username, password, sudo_password=None, shutdown_time=None, immediate=False):
-    """Schedule or execute immediate shutdown on remote machine"""
+def session_rollout_plan():
+    """Rollout plan from the execution options, or None when waves are disabled"""
+    if not st.session_state.exec_rollout:
+        return None
+    return RolloutPlan(by=st.session_state.rollout_by, size=st.session_state.rollout_size,
+                       delay=st.session_state.rollout_delay, jitter=st.session_state.rollout_jitter,
+                       max_failure_rate=st.session_state.rollout_max_failure / 100)
+
+def apply_inventory_edits(page_ids):
+    """data_editor callback: apply only the edited, added and deleted rows to the inventory"""
+    editor_key = f"computers_basic_editor_{st.session_state.inventory_editor_version}"
+    changes = st.session_state[editor_key]
     try:
-        # Input validation
-        if not ip or not os_type or not username or not password:
-            return False, "Missing required parameters"
-            
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        try:
-            # Use password authentication instead of key-based
-            client.connect(
-                hostname=ip,
-                username=username,
-                password=password,
-                timeout=10
-            )
-        except Exception as e:
-            return False, f"SSH connection error: {str(e)}"
-            
-        # Get sudo password if provided, otherwise use SSH password
-        sudo_pwd = sudo_password if sudo_password else password
-        
-        # First verify if SSH connection is working properly
+        for row_index, row_changes in changes["edited_rows"].items():
+            if "MAC" in row_changes:
+                row_changes = dict(row_changes, MAC=normalize_mac(row_changes["MAC"]))
+            inventory.update(page_ids[int(row_index)], row_changes)
+        for row in changes["added_rows"]:
+            if (row.get("IP") or "").strip():
+                inventory.insert(dict(row, OS=row.get("OS") or "Linux", MAC=normalize_mac(row.get("MAC")),
+                                      ssh_user=st.session_state.ssh_user))
+        if changes["deleted_rows"]:
+            inventory.delete([page_ids[row_index] for row_index in changes["deleted_rows"]])
+    except sqlite3.IntegrityError:
+        st.session_state.inventory_error = "⚠️ Ya existe un equipo con esa dirección IP"
+    except ValueError as e:
+        st.session_state.inventory_error = f"⚠️ {str(e)}"
+    # A new editor key discards the applied edits from the widget state
+    st.session_state.inventory_editor_version += 1
+
+def export_inventory_file(file_format):
+    """download_button callback: spool the export to a temporary file instead of building it in memory"""
+    # Sin búfer es un RawIOBase, que Streamlit lee de una vez
+    output = tempfile.TemporaryFile(buffering=0)
+    for chunk in export_inventory(inventory, file_format):
+        output.write(chunk.encode("utf-8"))
+    output.seek(0)
+    return output
+
+def select_targets(key_prefix):
+    """Render the target picker and return (computers, expression)
+
+    Targets are chosen with a group/tag expression (resolved from the cached
+    selector index, so a thousand hosts is one action) or from a manual list.
+    `expression` is None for manual selections.
+    """
+    mode = st.radio(
+        "Seleccionar equipos por:",
+        ["Grupos y etiquetas", "Lista manual"],
+        horizontal=True,
+        key=f"{key_prefix}_mode"
+    )
+    if mode == "Grupos y etiquetas":
+        expression = st.text_input(
+            "Expresión:",
+            placeholder="lab-3 AND linux AND NOT server",
+            help="Use grupos, etiquetas o sistema (linux/windows) con AND, OR, NOT y paréntesis. "
+                 "También group:x, tag:x, os:x, ip:192.168.3.* y * (todos).",
+            key=f"{key_prefix}_expression"
+        )
+        if not expression.strip():
+            return [], None
         try:
-            stdin, stdout, stderr = client.exec_command("whoami")
-            connected_user = stdout.read().decode().strip()
-            st.session_state.shutdown_results.append({
-                "success": True,
-                "ip": ip,
-                "os": os_type,
-                "message": f"Conectado como usuario: {connected_user}",
-                "time": datetime.now().strftime("%H:%M:%S")
-            })
-        except Exception as e:
-            return False, f"Error ejecutando comando básico: {str(e)}"
+            selected = inventory.select(expression)
+        except ValueError as e:
+            st.error(f"⚠️ {str(e)}")
+            return [], None
+        preview = ", ".join(c["IP"] for c in selected[:10]) + (" ..." if len(selected) > 10 else "")
+        st.caption(f"{len(selected)} equipos seleccionados" + (f": {preview}" if selected else ""))
+        return selected, expression.strip()
+    
+    labels = {f"{c['IP']} - {c['Description']}": c for c in inventory.all()}
+    selected_labels = st.multiselect("Equipos:", options=list(labels), key=f"{key_prefix}_manual")
+    return [labels[label] for label in selected_labels], None
 
-        # Para Linux, intentamos diferentes enfoques para el apagado
-        if os_type == "Linux":
-            # Try multiple approaches for shutdown to increase success chance
-            if immediate:
-                # Opción 1: Usar approach directo
-                command1 = f'echo "{sudo_pwd}" | sudo -S shutdown now'
-                
-                # Opción 2: Usar expect con script
-                shutdown_script = f'''
-                spawn sudo shutdown now
-                expect "password"
-                send "{sudo_pwd}\\r"
-                expect eof
-                '''
-                command2 = f'echo "{shutdown_script}" > /tmp/shutdown_script.exp && chmod +x /tmp/shutdown_script.exp && expect -f /tmp/shutdown_script.exp'
-                
-                # Opción 3: Usar approach bash -c
-                command3 = f'echo "{sudo_pwd}" | sudo -S bash -c "shutdown now"'
-                
-                # Intentar cada enfoque
-                commands = [command1, command3]  # Omitimos command2 si no hay expect instalado
-                
-                for i, cmd in enumerate(commands):
-                    try:
-                        stdin, stdout, stderr = client.exec_command(cmd)
-                        # Corto tiempo de espera ya que el apagado puede desconectar rápidamente
-                        time.sleep(2)
-                        # Si llegamos aquí sin error, probablemente funcionó
-                        return True, "Comando de apagado enviado con éxito"
-                    except Exception as e:
-                        if i == len(commands) - 1:  # Si es el último intento
-                            return False, f"Fallaron todos los intentos de apagado: {str(e)}"
-                        # Si no es el último intento, seguimos probando
-                        continue
-            else:
-                # Scheduled shutdown
-                if not shutdown_time:
-                    return False, "No shutdown time provided for scheduled shutdown"
+@st.cache_data(max_entries=256, show_spinner=False)
+def host_card_page(revision, search, os_type, group, offset, limit):
+    """Card models (no credentials) for one dashboard page, cached per inventory revision"""
+    return [{
+        "id": c["id"],
+        "ip": c["IP"],
+        "caption": f"{c['Description']} ({c['OS']})" + (f" · {c['Group']}" if c["Group"] else ""),
+        "has_credentials": has_credentials(c)
+    } for c in inventory.query(search, os_type, group, offset=offset, limit=limit)]
+
+# Los fragmentos solo vuelven a ejecutar la rejilla al interactuar con ella
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", lambda func: func)
+
+@fragment
+def render_host_grid():
+    """Paginated host grid for immediate shutdown; only the visible page is rendered"""
+    col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
+    with col1:
+        search = st.text_input("Buscar (IP o descripción):", key="grid_search")
+    with col2:
+        os_filter = st.selectbox("Sistema:", ["Todos", "Linux", "Windows"], key="grid_os")
+    with col3:
+        group_filter = st.selectbox("Grupo:", ["Todos"] + inventory.groups(), key="grid_group")
+    with col4:
+        page_size = st.selectbox("Por página:", [12, 24, 48, 96], key="grid_page_size")
+    
+    filters = {
+        "search": search.strip(),
+        "os_type": None if os_filter == "Todos" else os_filter,
+        "group": None if group_filter == "Todos" else group_filter
+    }
+    total = inventory.count(**filters)
+    page_count = max(1, (total + page_size - 1) // page_size)
+    page = 1
+    if page_count > 1:
+        page = st.number_input(f"Página (de {page_count}):", min_value=1, max_value=page_count, value=1,
+                               key="grid_page")
+    cards = host_card_page(inventory.revision(), filters["search"], filters["os_type"], filters["group"],
+                           (min(page, page_count) - 1) * page_size, page_size)
+    st.caption(f"Mostrando {len(cards)} de {total} equipos")
+    
+    # Display computers in a nice grid with action buttons
+    for i in range(0, len(cards), 3):
+        cols = st.columns(3)
+        for j, card in enumerate(cards[i:i + 3]):
+            with cols[j]:
+                # Create a card-like container for each computer
+                with st.container():
+                    st.subheader(card["ip"])
+                    st.caption(card["caption"])
+                    st.caption(host_state_caption(card["ip"]))
                     
-                now = datetime.now()
-                time_diff = shutdown_time - now
-                minutes = max(1, int(time_diff.total_seconds() // 60))  # Al menos 1 minuto
-                
-                # Usar el mismo enfoque múltiple para apagado programado
-                command = f'echo "{sudo_pwd}" | sudo -S shutdown -h +{minutes}'
-                
-                try:
-                    stdin, stdout, stderr = client.exec_command(command)
-                    exit_status = stdout.channel.recv_exit_status()
-                    error = stderr.read().decode().strip()
+                    # Show credential status
+                    if card["has_credentials"]:
+                        st.caption("✅ Credenciales configuradas")
+                    else:
+                        st.caption("⚠️ Sin credenciales específicas")
                     
-                    # Ignorar mensajes comunes de sudo que no son errores
-                    if error and ("password for" in error.lower() or "sudo" in error.lower()):
-                        error = ""
-                        
-                    if exit_status != 0 or error:
-                        return False, f"Error programando apagado: {error}"
-                        
-                    return True, f"Apagado programado para {shutdown_time.strftime('%H:%M')}"
-                except Exception as e:
-                    return False, f"Error programando apagado: {str(e)}"
-        
-        elif os_type == "Windows":
-            # Windows shutdown
-            if immediate:
-                command = 'shutdown /s /f /t 0'
-            else:
-                if not shutdown_time:
-                    return False, "No shutdown time provided for scheduled shutdown"
-                now = datetime.now()
-                time_diff = shutdown_time - now
-                seconds = int(time_diff.total_seconds())
-                if seconds <= 0:
-                    return False, "Scheduled time must be in the future"
-                command = f'shutdown /s /f /t {seconds}'
-                
-            stdin, stdout, stderr = client.exec_command(command)
-            exit_status = stdout.channel.recv_exit_status()
-            error = stderr.read().decode().strip()
-            
-            if exit_status != 0 or error:
-                return False, f"Command failed: {error}"
-            
-            return True, "Shutdown command executed successfully"
-        else:
-            return False, f"Unsupported OS type: {os_type}"
+                    if st.button("🔴 Apagar Ahora", key=f"shutdown_now_{card['id']}", use_container_width=True):
+                        # Credentials are loaded only for the clicked computer
+                        computer = inventory.get(card["id"])
+                        if computer:
+                            handle_immediate_shutdown(computer["IP"], computer["OS"], computer)
+                            st.toast(f"Orden enviada a {computer['IP']}. Consulte el registro de actividad.")
 
-    except Exception as e:
-        return False, f"Error general: {str(e)}"
-    finally:
-        if 'client' in locals() and client:
-            try:
-                client.close()
-            except:
-                pass  # Ignorar errores al cerrar conexión
+def show_fleet_progress(targets, task, operation, agent_action=None, agent_minutes=None, rollout=None,
+                        staggered=False, verify=False):
+    """Run a fleet operation showing a live progress bar and result table
 
-# Define immediate shutdown handler function with per-computer credentials
-def handle_immediate_shutdown(ip, os_type, computer=None):
-    # Use computer-specific credentials if available, otherwise fall back to global
-    username = computer.get('ssh_user', st.session_state.ssh_user) if computer else st.session_state.ssh_user
-    password = computer.get('ssh_password', st.session_state.ssh_password) if computer else st.session_state.ssh_password
-    sudo_pass = computer.get('sudo_pass', st.session_state.sudo_pass) if computer else st.session_state.sudo_pass
-    
-    if not password:
-        st.session_state.shutdown_results.append({
-            "success": False, 
-            "ip": ip, 
-            "os": os_type, 
-            "message": "No hay contraseña SSH configurada para este equipo"
-        })
-        return
-        
-    ip = ip.strip()
+    With the remote agent enabled, `agent_action` is first delivered to every Linux
+    host in one UDP pass and only the hosts that did not acknowledge it go through
+    SSH. With a `rollout` plan the targets are processed in waves (see run_rollout);
+    `staggered` operations shift each wave's shutdown time instead of pausing.
+    Results are streamed into the activity log as they arrive; with `verify`, the
+    accepted shutdowns are then confirmed in the background (see turnoff.verify).
+    Returns the number of successful hosts.
+    """
+    total = len(targets)
+    progress = st.progress(0.0, text=f"0/{total} equipos")
+    table = st.empty()
+    rows = []
+    sent = []
+    success_count = 0
+    last_render = 0.0
     
-    if not ip:
-        st.session_state.shutdown_results.append({
-            "success": False,
-            "ip": "Unknown",
-            "os": os_type,
-            "message": "IP address is required"
-        })
-        return
-        
-    success, message = schedule_shutdown(
-        ip=ip, 
-        os_type=os_type, 
-        username=username, 
-        password=password,
-        sudo_password=sudo_pass,
-        immediate=True
+    entries = fleet_operation(
+        targets,
+        task,
+        operation,
+        agent_action=agent_action,
+        agent_minutes=agent_minutes,
+        rollout=rollout,
+        staggered=staggered,
+        preflight=st.session_state.exec_preflight,
+        preflight_timeout=st.session_state.exec_preflight_timeout,
+        max_workers=st.session_state.exec_workers,
+        total_timeout=st.session_state.exec_total_timeout
     )
-    
-    # Record the result
-    st.session_state.shutdown_results.append({
-        "success": success,
-        "ip": ip,
-        "os": os_type,
-        "message": message,
-        "time": datetime.now().strftime("%H:%M:%S")
-    })
+    for entry in entries:
+        activity_log.append(entry)
+        host_states.invalidate([entry["ip"]])
+        success_count += bool(entry["success"])
+        sent.append(entry)
+        rows.append({
+            "IP": entry["ip"],
+            "Estado": "⏭️" if entry.get("skipped") else ("✅" if entry["success"] else "❌"),
+            "Mensaje": entry["message"],
+            "Hora": entry["time"]
+        })
+        # Las respuestas del agente llegan de golpe: se repinta como mucho cada 0.1 s
+        if time.monotonic() - last_render >= 0.1:
+            progress.progress(len(rows) / total, text=f"{len(rows)}/{total} equipos")
+            table.dataframe(rows, use_container_width=True, hide_index=True)
+            last_render = time.monotonic()
+    if rows:
+        progress.progress(len(rows) / total, text=f"{len(rows)}/{total} equipos")
+        table.dataframe(rows, use_container_width=True, hide_index=True)
+    if verify:
+        watched = shutdown_verifier.watch(sent)
+        if watched:
+            st.info(f"⏳ Comprobando que {watched} equipos dejan de responder; "
+                    "el registro de actividad mostrará cuáles se apagaron de verdad")
+    return success_count
+
+def show_wake_progress(targets):
+    """Send Wake-on-LAN waves showing a live progress bar; returns the number of packets sent"""
+    total = len(targets)
+    progress = st.progress(0.0, text=f"0/{total} equipos")
+    table = st.empty()
+    rows = []
+    success_count = 0
+    for entry in wake_on_lan.wake(targets):
+        activity_log.append(entry)
+        host_states.invalidate([entry["ip"]])
+        success_count += entry["success"]
+        rows.append({"IP": entry["ip"], "Estado": "✅" if entry["success"] else "❌",
+                     "Mensaje": entry["message"], "Hora": entry["time"]})
+        progress.progress(len(rows) / total, text=f"{len(rows)}/{total} equipos")
+        table.dataframe(rows, use_container_width=True, hide_index=True)
+    return success_count
 
-# Initialize default computer list with credential fields
-if 'computers' not in st.session_state:
-    st.session_state.computers = [
-        {
-            "IP": "192.168.1.100", 
-            "OS": "Linux", 
-            "Description": "Server 1",
-            "ssh_user": "admin",
-            "ssh_password": "",
-            "sudo_pass": ""
-        },
-        {
-            "IP": "192.168.1.101", 
-            "OS": "Linux", 
-            "Description": "Server 2",
-            "ssh_user": "admin",
-            "ssh_password": "",
-            "sudo_pass": ""
-        }
-    ]
+def host_state_caption(ip):
+    """One-line status for a dashboard card, read from the host state cache"""
+    state = host_states.get(ip)
+    if not state:
+        host_states.refresh_now()  # Equipo nuevo: no esperar al siguiente ciclo
+        return "⚪ Estado desconocido"
+    if not state["reachable"]:
+        return "🔴 Apagado o inaccesible"
+    parts = ["🟢 Encendido"]
+    if state.get("uptime") is not None:
+        parts.append(f"activo {format_uptime(state['uptime'])}")
+    if state.get("load"):
+        parts.append(f"carga {state['load'].split()[0]}")
+    if state.get("pending_shutdown"):
+        parts.append(f"⏱️ apagado pendiente {state['pending_shutdown']}")
+    return " · ".join(parts)
 
 # Interfaz web
 st.set_page_config(page_title="Control de Apagado Remoto", page_icon="⏰", layout="wide")
@@ -246,15 +368,19 @@ with st.sidebar:
             st.session_state.page = "computers"
         if st.button("⚙️ Configuración SSH", use_container_width=True):
             st.session_state.page = "ssh"
+        if st.button("📅 Tareas Programadas", use_container_width=True):
+            st.session_state.page = "jobs"
         if st.button("📝 Registro de Actividad", use_container_width=True):
             st.session_state.page = "logs"
+        if st.button("📈 Estadísticas", use_container_width=True):
+            st.session_state.page = "stats"
         if st.button("🛠️ Herramientas", use_container_width=True):
             st.session_state.page = "tools"
         
         # Show SSH configuration status
         st.subheader("Estado")
         
-        if st.session_state.ssh_password:
+        if st.session_state.ssh_password or ssh_auth.has_keys():
             st.success("✅ Credenciales SSH configuradas")
         else:
             st.warning("⚠️ Faltan credenciales SSH")
@@ -273,56 +399,156 @@ if authenticated:
         # Quick stats at the top
         col1, col2 = st.columns(2)
         with col1:
-            computers = st.session_state.get('computers', [
-                {"IP": "192.168.1.100", "OS": "Linux", "Description": "Server 1"},
-                {"IP": "192.168.1.101", "OS": "Linux", "Description": "Server 2"}
-            ])
-            st.metric("Total de Equipos", len(computers))
+            total_computers = inventory.count()
+            st.metric("Total de Equipos", total_computers)
         
         with col2:
-            if st.session_state.ssh_password:
+            if st.session_state.ssh_password or ssh_auth.has_keys():
                 st.success("Sistema listo para controlar equipos")
             else:
                 st.warning("Configure las credenciales SSH para continuar")
         
+        state_summary = host_states.summary()
+        st.caption(f"🟢 {state_summary['up']} encendidos · 🔴 {state_summary['down']} apagados o inaccesibles · "
+                   f"⏱️ {state_summary['pending']} con apagado pendiente")
+        
+        # Parallel execution settings shared by the fleet operations
+        with st.expander("⚙️ Opciones de ejecución en paralelo"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.session_state.exec_workers = st.number_input(
+                    "Conexiones simultáneas:", min_value=1, max_value=10000,
+                    value=st.session_state.exec_workers, key="exec_workers_input",
+                    help="Con paramiko, un hilo por conexión (hasta unas 500); con asyncssh pueden ser miles"
+                )
+            with col2:
+                st.session_state.exec_host_timeout = st.number_input(
+                    "Tiempo límite por equipo (s):", min_value=1, max_value=120,
+                    value=st.session_state.exec_host_timeout, key="exec_host_timeout_input"
+                )
+            with col3:
+                st.session_state.exec_total_timeout = st.number_input(
+                    "Tiempo límite global (s):", min_value=5, max_value=3600,
+                    value=st.session_state.exec_total_timeout, key="exec_total_timeout_input"
+                )
+            col1, col2 = st.columns(2)
+            with col1:
+                st.session_state.exec_preflight = st.checkbox(
+                    "Omitir equipos apagados (sondeo previo del puerto 22)",
+                    value=st.session_state.exec_preflight, key="exec_preflight_input"
+                )
+            with col2:
+                st.session_state.exec_preflight_timeout = st.number_input(
+                    "Tiempo límite del sondeo previo (s):", min_value=0.1, max_value=5.0, step=0.1,
+                    value=float(st.session_state.exec_preflight_timeout), key="exec_preflight_timeout_input",
+                    disabled=not st.session_state.exec_preflight
+                )
+            st.session_state.exec_lean = st.checkbox(
+                "Modo ligero: sin verificación whoami separada",
+                value=st.session_state.exec_lean, key="exec_lean_input",
+                help="La identidad remota se toma de la conexión del pool si se verificó hace poco, "
+                     "o se obtiene en el mismo comando de apagado"
+            )
+            st.session_state.exec_rollout = st.checkbox(
+                "Apagar por oleadas",
+                value=st.session_state.exec_rollout, key="exec_rollout_input",
+                help="Evita que todos los equipos vacíen discos y desmonten NFS a la vez. "
+                     "En los apagados programados cada oleada recibe una hora posterior"
+            )
+            col1, col2, col3, col4, col5 = st.columns(5)
+            with col1:
+                rollout_by_labels = {"size": "Tamaño fijo", "group": "Grupo"}
+                st.session_state.rollout_by = st.selectbox(
+                    "Oleadas por:", list(rollout_by_labels), format_func=rollout_by_labels.get,
+                    index=list(rollout_by_labels).index(st.session_state.rollout_by), key="rollout_by_input",
+                    disabled=not st.session_state.exec_rollout,
+                    help="Por grupo, los grupos más grandes que el tamaño máximo se dividen"
+                )
+            with col2:
+                st.session_state.rollout_size = st.number_input(
+                    "Equipos por oleada:", min_value=1, max_value=10000,
+                    value=st.session_state.rollout_size, key="rollout_size_input",
+                    disabled=not st.session_state.exec_rollout
+                )
+            with col3:
+                st.session_state.rollout_delay = st.number_input(
+                    "Pausa entre oleadas (s):", min_value=0, max_value=3600,
+                    value=st.session_state.rollout_delay, key="rollout_delay_input",
+                    disabled=not st.session_state.exec_rollout
+                )
+            with col4:
+                st.session_state.rollout_jitter = st.number_input(
+                    "Variación aleatoria (s):", min_value=0, max_value=3600,
+                    value=st.session_state.rollout_jitter, key="rollout_jitter_input",
+                    disabled=not st.session_state.exec_rollout
+                )
+            with col5:
+                st.session_state.rollout_max_failure = st.number_input(
+                    "Detener si fallan más del (%):", min_value=0, max_value=100,
+                    value=st.session_state.rollout_max_failure, key="rollout_max_failure_input",
+                    disabled=not st.session_state.exec_rollout,
+                    help="Porcentaje de fallos en una oleada (sin contar equipos apagados)"
+                )
+        
         # Show computers status and controls
-        if computers:
+        if total_computers:
             st.subheader("Equipos disponibles")
             
             # Two tabs for immediate and scheduled shutdown
-            tab1, tab2 = st.tabs(["🔴 Apagado Inmediato", "⏱️ Apagado Programado"])
+            tab1, tab2, tab3, tab4 = st.tabs(["🔴 Apagado Inmediato", "⏱️ Apagado Programado",
+                                              "🚫 Cancelar / Reprogramar", "⚡ Encender"])
             
             with tab1:
                 st.info("Seleccione los equipos que desea apagar inmediatamente")
                 
-                # Display computers in a nice grid with action buttons
-                for i in range(0, len(computers), 3):
-                    cols = st.columns(3)
-                    for j in range(3):
-                        idx = i + j
-                        if idx < len(computers):
-                            with cols[j]:
-                                computer = computers[idx]
-                                ip = computer["IP"]
-                                os_type = computer["OS"]
-                                description = computer.get("Description", "")
-                                has_credentials = bool(computer.get('ssh_password', ''))
-                                
-                                # Create a card-like container for each computer
-                                with st.container():
-                                    st.subheader(f"{ip}")
-                                    st.caption(f"{description} ({os_type})")
-                                    
-                                    # Show credential status
-                                    if has_credentials:
-                                        st.caption("✅ Credenciales configuradas")
-                                    else:
-                                        st.caption("⚠️ Sin credenciales específicas")
-                                    
-                                    if st.button("🔴 Apagar Ahora", key=f"shutdown_now_{ip}", use_container_width=True):
-                                        # Use computer-specific credentials when available
-                                        handle_immediate_shutdown(ip, os_type, computer)
-                                        st.rerun()
+                # Bulk immediate shutdown: all selected hosts are contacted in parallel
+                with st.expander("🔴 Apagado masivo inmediato", expanded=False):
+                    bulk_computers, _ = select_targets("bulk")
+                    confirm_bulk = st.checkbox("Confirmo que deseo apagar estos equipos ahora", key="bulk_confirm")
+                    
+                    if st.button(
+                        f"🔴 Apagar {len(bulk_computers)} equipos ahora",
+                        use_container_width=True,
+                        disabled=not bulk_computers or not confirm_bulk,
+                        key="bulk_shutdown_now"
+                    ):
+                        targets = [session_credentials(pc) for pc in bulk_computers if pc["IP"].strip()]
+                        success_count = show_fleet_progress(
+                            targets,
+                            immediate_shutdown_task(st.session_state.exec_host_timeout,
+                                                    st.session_state.exec_lean),
+                            "immediate_shutdown",
+                            agent_action="shutdown",
+                            rollout=session_rollout_plan(),
+                            verify=True
+                        )
+                        if success_count > 0:
+                            st.success(f"✅ {success_count} equipos aceptaron la orden de apagado")
+                        if success_count < len(targets):
+                            st.error(f"❌ {len(targets) - success_count} equipos fallaron")
+                            st.info("Consulte el registro de actividad para más detalles")
+                
+                # Equipos que aceptaron la orden pero siguen respondiendo (últimas 24 horas)
+                verifying = shutdown_verifier.pending()
+                if verifying:
+                    st.caption(f"⏳ Comprobando el apagado de {len(verifying)} equipos")
+                stragglers = shutdown_verifier.stragglers(time.time() - 86400)
+                if stragglers:
+                    st.warning(f"⚠️ {len(stragglers)} equipos siguen encendidos tras la orden de apagado: "
+                               + ", ".join(stragglers[:20]) + (" ..." if len(stragglers) > 20 else ""))
+                    if st.button(f"🔁 Reintentar el apagado de {len(stragglers)} equipos", key="retry_stragglers"):
+                        computers = [inventory.get_by_ip(ip) for ip in stragglers]
+                        targets = [session_credentials(pc) for pc in computers if pc and pc["IP"].strip()]
+                        show_fleet_progress(
+                            targets,
+                            immediate_shutdown_task(st.session_state.exec_host_timeout,
+                                                    st.session_state.exec_lean),
+                            "immediate_shutdown",
+                            agent_action="shutdown",
+                            verify=True
+                        )
+                
+                render_host_grid()
             
             with tab2:
                 st.subheader("Programar apagado")
@@ -369,18 +595,10 @@ if authenticated:
                 
                 # Select computers to schedule
                 st.subheader("Seleccionar equipos")
-                selected_computers = []
-                
-                for idx, computer in enumerate(computers):
-                    has_credentials = bool(computer.get('ssh_password', ''))
-                    credential_status = "✅" if has_credentials else "⚠️"
-                    
-                    selected = st.checkbox(
-                        f"{computer['IP']} - {computer.get('Description', '')} ({credential_status})", 
-                        key=f"select_computer_{idx}"
-                    )
-                    if selected:
-                        selected_computers.append(computer)
+                selected_computers, _ = select_targets("scheduled")
+                missing_credentials = sum(1 for pc in selected_computers if not has_credentials(pc))
+                if missing_credentials:
+                    st.caption(f"⚠️ {missing_credentials} de los equipos seleccionados no tienen credenciales")
                 
                 if len(selected_computers) > 0:
                     shutdown_button = st.button(
@@ -390,61 +608,100 @@ if authenticated:
                     )
                     
                     if shutdown_button:
-                        if all(not pc.get('ssh_password', '') for pc in selected_computers):
+                        if not any(has_credentials(pc) for pc in selected_computers):
                             st.error("⚠️ Ninguno de los equipos seleccionados tiene credenciales configuradas")
                         else:
-                            success_count = 0
-                            for pc in selected_computers:
-                                ip = pc["IP"].strip()
-                                os_type = pc["OS"]
-                                
-                                # Use computer-specific credentials
-                                username = pc.get('ssh_user', st.session_state.ssh_user)
-                                password = pc.get('ssh_password', st.session_state.ssh_password)
-                                sudo_pass = pc.get('sudo_pass', st.session_state.sudo_pass)
-                                
-                                # Skip computers without credentials
-                                if not password:
-                                    st.session_state.shutdown_results.append({
-                                        "success": False,
-                                        "ip": ip,
-                                        "os": os_type,
-                                        "message": "No hay credenciales configuradas para este equipo",
-                                        "time": datetime.now().strftime("%H:%M:%S")
-                                    })
-                                    continue
-                                
-                                if ip:
-                                    success, message = schedule_shutdown(
-                                        ip=ip,
-                                        os_type=os_type,
-                                        username=username,
-                                        password=password,
-                                        sudo_password=sudo_pass,
-                                        shutdown_time=shutdown_time
-                                    )
-                                    
-                                    if success:
-                                        success_count += 1
-                                    
-                                    st.session_state.shutdown_results.append({
-                                        "success": success,
-                                        "ip": ip,
-                                        "os": os_type,
-                                        "message": message if not success else f"Apagado programado: {shutdown_time.strftime('%H:%M')}",
-                                        "time": datetime.now().strftime("%H:%M:%S")
-                                    })
+                            targets = [session_credentials(pc) for pc in selected_computers
+                                       if pc["IP"].strip()]
+                            success_count = show_fleet_progress(
+                                targets,
+                                scheduled_shutdown_task(shutdown_time, st.session_state.exec_host_timeout,
+                                                        st.session_state.exec_lean),
+                                "scheduled_shutdown",
+                                agent_action="schedule",
+                                agent_minutes=minutes_until(shutdown_time),
+                                rollout=session_rollout_plan(),
+                                staggered=True
+                            )
                             
-                            st.metric("Equipos programados", f"{success_count}/{len(selected_computers)}")
+                            st.metric("Equipos programados", f"{success_count}/{len(targets)}")
                             
                             # Show recent results
                             if success_count > 0:
                                 st.success(f"✅ {success_count} equipos programados exitosamente")
-                            if success_count < len(selected_computers):
-                                st.error(f"❌ {len(selected_computers) - success_count} equipos fallaron")
+                            if success_count < len(targets):
+                                st.error(f"❌ {len(targets) - success_count} equipos fallaron")
                                 st.info("Consulte el registro de actividad para más detalles")
                 else:
                     st.warning("Seleccione al menos un equipo para programar")
+            
+            with tab3:
+                st.subheader("Cancelar o reprogramar apagados pendientes")
+                action = st.radio("Acción:", ["Cancelar", "Reprogramar"], horizontal=True, key="pending_action")
+                
+                if action == "Reprogramar":
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        new_date = st.date_input("Nueva fecha:", min_value=datetime.now().date(), key="reschedule_date")
+                    with col2:
+                        new_time = st.time_input("Nueva hora:",
+                                                 value=(datetime.now() + timedelta(minutes=60)).time(),
+                                                 key="reschedule_time")
+                    new_shutdown_time = datetime.combine(new_date, new_time)
+                    valid_time = new_shutdown_time > datetime.now()
+                    if not valid_time:
+                        st.error("⚠️ La nueva hora está en el pasado. Seleccione una hora futura.")
+                
+                pending_computers, _ = select_targets("pending")
+                
+                if action == "Cancelar":
+                    label = f"🚫 Cancelar apagado en {len(pending_computers)} equipos"
+                else:
+                    label = f"⏱️ Reprogramar {len(pending_computers)} equipos"
+                if st.button(label, use_container_width=True,
+                             disabled=not pending_computers or (action == "Reprogramar" and not valid_time),
+                             key="pending_apply"):
+                    targets = [session_credentials(pc) for pc in pending_computers if pc["IP"].strip()]
+                    if action == "Cancelar":
+                        success_count = show_fleet_progress(targets,
+                                                            cancel_shutdown_task(st.session_state.exec_host_timeout),
+                                                            "cancel", agent_action="cancel")
+                    else:
+                        # shutdown -h reemplaza el apagado pendiente, así que el agente no necesita cancelar antes
+                        success_count = show_fleet_progress(
+                            targets,
+                            reschedule_shutdown_task(new_shutdown_time, st.session_state.exec_host_timeout),
+                            "reschedule",
+                            agent_action="schedule",
+                            agent_minutes=minutes_until(new_shutdown_time),
+                            rollout=session_rollout_plan(),
+                            staggered=True
+                        )
+                    if success_count > 0:
+                        st.success(f"✅ {success_count} equipos actualizados")
+                    if success_count < len(targets):
+                        st.error(f"❌ {len(targets) - success_count} equipos fallaron")
+                        st.info("Consulte el registro de actividad para más detalles")
+            
+            with tab4:
+                st.subheader("Encender con Wake-on-LAN")
+                waves = wake_on_lan.settings
+                st.caption(f"Oleadas de {waves['wave_size']} equipos cada {waves['wave_delay']} s, "
+                           f"máximo {waves['rate']} paquetes/s (configurable en Herramientas). "
+                           "Para encender a una hora fija, cree una tarea de encendido en Tareas Programadas.")
+                wake_computers, _ = select_targets("wake")
+                without_mac = sum(1 for pc in wake_computers if not pc["MAC"])
+                if without_mac:
+                    st.caption(f"⚠️ {without_mac} de los equipos seleccionados no tienen dirección MAC")
+                if st.button(f"⚡ Encender {len(wake_computers)} equipos", use_container_width=True,
+                             disabled=not wake_computers, key="wake_now"):
+                    targets = [pc for pc in wake_computers if pc["IP"].strip()]
+                    success_count = show_wake_progress(targets)
+                    if success_count > 0:
+                        st.success(f"✅ Paquete mágico enviado a {success_count} equipos")
+                    if success_count < len(targets):
+                        st.error(f"❌ {len(targets) - success_count} equipos fallaron")
+                        st.info("Consulte el registro de actividad para más detalles")
     
     # Computer management page
     elif st.session_state.page == "computers":
@@ -457,13 +714,42 @@ if authenticated:
         tabs = st.tabs(["🖥️ Listado de Equipos", "🔑 Configurar Credenciales"])
         
         with tabs[0]:
-            # Editable table of computers (basic info)
-            computers_basic = st.data_editor(
+            # Filters and pagination: only the visible page is loaded into the editor
+            col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
+            with col1:
+                inventory_search = st.text_input("Buscar (IP o descripción):", key="inventory_search")
+            with col2:
+                inventory_os = st.selectbox("Sistema:", ["Todos", "Linux", "Windows"], key="inventory_os")
+            with col3:
+                inventory_group = st.selectbox("Grupo:", ["Todos"] + inventory.groups(), key="inventory_group")
+            with col4:
+                page_size = st.selectbox("Por página:", [25, 50, 100, 200], index=1, key="inventory_page_size")
+            
+            filters = {
+                "search": inventory_search.strip(),
+                "os_type": None if inventory_os == "Todos" else inventory_os,
+                "group": None if inventory_group == "Todos" else inventory_group
+            }
+            total = inventory.count(**filters)
+            page_count = max(1, (total + page_size - 1) // page_size)
+            page = st.number_input(f"Página (de {page_count}):", min_value=1, max_value=page_count, value=1,
+                                   key="inventory_page") if page_count > 1 else 1
+            page_rows = inventory.query(**filters, offset=(page - 1) * page_size, limit=page_size)
+            st.caption(f"Mostrando {len(page_rows)} de {total} equipos")
+            
+            if st.session_state.get('inventory_error'):
+                st.error(st.session_state.pop('inventory_error'))
+            
+            # Editable table of computers (basic info); changes are applied row by row
+            st.data_editor(
                 [{
                     "IP": c["IP"],
                     "OS": c["OS"],
-                    "Description": c.get("Description", "")
-                } for c in st.session_state.computers],
+                    "Description": c["Description"],
+                    "Group": c["Group"],
+                    "Tags": c["Tags"],
+                    "MAC": c["MAC"]
+                } for c in page_rows],
                 column_config={
                     "IP": st.column_config.TextColumn("Dirección IP", required=True, width="medium"),
                     "OS": st.column_config.SelectboxColumn(
@@ -472,116 +758,115 @@ if authenticated:
                         required=True,
                         width="small"
                     ),
-                    "Description": st.column_config.TextColumn("Descripción", width="large")
+                    "Description": st.column_config.TextColumn("Descripción", width="large"),
+                    "Group": st.column_config.TextColumn("Grupo", width="small"),
+                    "Tags": st.column_config.TextColumn("Etiquetas", help="Separadas por coma", width="medium"),
+                    "MAC": st.column_config.TextColumn(
+                        "MAC", width="small",
+                        help="Para encender con Wake-on-LAN. Se completa sola al consultar el estado del equipo"
+                    )
                 },
                 num_rows="dynamic",
                 use_container_width=True,
                 hide_index=True,
-                key="computers_basic_editor"
+                key=f"computers_basic_editor_{st.session_state.inventory_editor_version}",
+                on_change=apply_inventory_edits,
+                args=([c["id"] for c in page_rows],)
             )
-            
-            # Update session state with basic info but preserve credentials
-            updated_computers = []
-            for idx, basic in enumerate(computers_basic):
-                # Get existing credentials if any
-                existing = st.session_state.computers[idx] if idx < len(st.session_state.computers) else {}
-                updated_computer = {
-                    "IP": basic["IP"],
-                    "OS": basic["OS"],
-                    "Description": basic.get("Description", ""),
-                    "ssh_user": existing.get("ssh_user", st.session_state.ssh_user),
-                    "ssh_password": existing.get("ssh_password", ""),
-                    "sudo_pass": existing.get("sudo_pass", "")
-                }
-                updated_computers.append(updated_computer)
-            
-            # Add any new computers
-            if len(computers_basic) > len(st.session_state.computers):
-                for i in range(len(st.session_state.computers), len(computers_basic)):
-                    updated_computers[i] = {
-                        "IP": computers_basic[i]["IP"],
-                        "OS": computers_basic[i]["OS"],
-                        "Description": computers_basic[i].get("Description", ""),
-                        "ssh_user": st.session_state.ssh_user,
-                        "ssh_password": "",
-                        "sudo_pass": ""
-                    }
-            
-            st.session_state.computers = updated_computers
 
         with tabs[1]:
             st.subheader("Credenciales de acceso SSH")
             st.info("Configure las credenciales SSH específicas para cada equipo. Estos datos se utilizarán para la conexión remota.")
             
-            # Show credential editor for each computer
-            for idx, computer in enumerate(st.session_state.computers):
-                with st.expander(f"{computer['IP']} - {computer.get('Description', '')}"):
-                    # Create a form for each computer's credentials
-                    with st.form(key=f"credentials_form_{idx}"):
-                        cols = st.columns(3)
-                        with cols[0]:
-                            ssh_user = st.text_input(
-                                "Usuario SSH:", 
-                                value=computer.get("ssh_user", st.session_state.ssh_user),
-                                key=f"ssh_user_{idx}"
-                            )
-                        with cols[1]:
-                            ssh_password = st.text_input(
-                                "Contraseña SSH:", 
-                                type="password",
-                                value=computer.get("ssh_password", ""),
-                                key=f"ssh_password_{idx}"
-                            )
-                        with cols[2]:
-                            sudo_pass = st.text_input(
-                                "Contraseña sudo:", 
-                                type="password",
-                                value=computer.get("sudo_pass", ""),
-                                help="Solo para Linux, si es diferente de la SSH",
-                                key=f"sudo_pass_{idx}"
-                            )
-                            
-                        if st.form_submit_button("Guardar credenciales"):
-                            st.session_state.computers[idx]["ssh_user"] = ssh_user
-                            st.session_state.computers[idx]["ssh_password"] = ssh_password
-                            st.session_state.computers[idx]["sudo_pass"] = sudo_pass
-                            st.success("✅ Credenciales actualizadas")
+            # Only the computers of the current page are listed
+            credential_labels = {f"{c['IP']} - {c['Description']}": c for c in page_rows}
+            selected_label = st.selectbox("Equipo (de la página actual del listado):", list(credential_labels),
+                                          key="credentials_computer")
+            if selected_label:
+                computer = credential_labels[selected_label]
+                # Create a form for the computer's credentials
+                with st.form(key=f"credentials_form_{computer['id']}"):
+                    cols = st.columns(3)
+                    with cols[0]:
+                        ssh_user = st.text_input(
+                            "Usuario SSH:", 
+                            value=computer["ssh_user"] or st.session_state.ssh_user
+                        )
+                    with cols[1]:
+                        ssh_password = st.text_input(
+                            "Contraseña SSH:", 
+                            type="password",
+                            value=computer["ssh_password"]
+                        )
+                    with cols[2]:
+                        sudo_pass = st.text_input(
+                            "Contraseña sudo:", 
+                            type="password",
+                            value=computer["sudo_pass"],
+                            help="Solo para Linux, si es diferente de la SSH"
+                        )
+                    ssh_key = st.text_input(
+                        "Clave privada (ruta en el servidor):",
+                        value=computer["ssh_key"],
+                        placeholder="/home/admin/.ssh/id_ed25519",
+                        help="Si se indica, se prueba antes que la contraseña. "
+                             "Vacío: se usa la clave por defecto o el agente SSH"
+                    )
+                        
+                    if st.form_submit_button("Guardar credenciales"):
+                        inventory.update(computer["id"], {
+                            "ssh_user": ssh_user,
+                            "ssh_password": ssh_password,
+                            "sudo_pass": sudo_pass,
+                            "ssh_key": ssh_key.strip()
+                        })
+                        st.success("✅ Credenciales actualizadas")
                         
         # Add option to import/export computer list
         st.subheader("Importar/Exportar")
         col1, col2 = st.columns(2)
         
         with col1:
-            # Export only basic info (no passwords)
+            # Export only basic info (no passwords); the file is generated when clicked
+            export_format = st.radio("Formato de exportación:", ["CSV", "JSON"], horizontal=True, key="export_format")
             st.download_button(
                 "📥 Exportar lista de equipos (sin credenciales)",
-                "\n".join([f"{c['IP']},{c['OS']},{c.get('Description', '')}" for c in st.session_state.computers]),
-                file_name="computers_list.csv",
-                mime="text/csv"
+                lambda: export_inventory_file(export_format.lower()),
+                file_name=f"computers_list.{export_format.lower()}",
+                mime="text/csv" if export_format == "CSV" else "application/json"
             )
         
         with col2:
-            csv_file = st.file_uploader("Importar lista de equipos (CSV)", type="csv")
-            if csv_file:
+            import_file = st.file_uploader(
+                "Importar lista de equipos (CSV, JSON o JSON Lines)",
+                type=["csv", "json", "jsonl"],
+                help="Columnas: IP, OS, Description, Group, Tags. La IP admite rangos CIDR (p. ej. 192.168.1.0/24)."
+            )
+            import_mode = st.radio(
+                "Modo de importación:",
+                ["Combinar (actualizar por IP)", "Reemplazar inventario"],
+                key="import_mode"
+            )
+            if import_file and st.button("📤 Importar"):
+                file_format = "csv" if import_file.name.lower().endswith(".csv") else "json"
                 try:
-                    imported_computers = []
-                    content = csv_file.getvalue().decode("utf-8")
-                    for line in content.strip().split("\n"):
-                        parts = line.split(",", 2)
-                        if len(parts) >= 2:
-                            imported_computers.append({
-                                "IP": parts[0].strip(),
-                                "OS": parts[1].strip(),
-                                "Description": parts[2].strip() if len(parts) > 2 else "",
-                                "ssh_user": st.session_state.ssh_user,
-                                "ssh_password": "",
-                                "sudo_pass": ""
-                            })
-                    
-                    if imported_computers:
-                        st.session_state.computers = imported_computers
-                        st.success(f"✅ Importados {len(imported_computers)} equipos")
-                        st.rerun()
+                    with st.spinner("Importando equipos..."):
+                        inserted, updated, errors = import_inventory(
+                            inventory,
+                            import_file,
+                            file_format,
+                            replace=import_mode == "Reemplazar inventario",
+                            default_user=st.session_state.ssh_user
+                        )
+                    if errors and import_mode == "Reemplazar inventario":
+                        st.error(f"❌ {len(errors)} filas con errores: el inventario no se ha reemplazado. "
+                                 "Corrija el archivo y vuelva a importarlo.")
+                    else:
+                        st.success(f"✅ {inserted} equipos nuevos, {updated} actualizados")
+                        if errors:
+                            st.warning(f"⚠️ {len(errors)} filas con errores (no importadas)")
+                    if errors:
+                        st.dataframe(errors, use_container_width=True, hide_index=True)
                 except Exception as e:
                     st.error(f"Error al importar: {str(e)}")
     
@@ -621,17 +906,9 @@ if authenticated:
                 st.session_state.ssh_password = ssh_password
                 st.session_state.sudo_pass = sudo_pass
                 
-                # Count updated computers
-                updated_count = 0
-                total_count = len(st.session_state.computers)
-                
                 # Update computers without credentials or all if apply_to_all is checked
-                for i, computer in enumerate(st.session_state.computers):
-                    if apply_to_all or not computer.get('ssh_password'):
-                        st.session_state.computers[i]['ssh_user'] = ssh_user
-                        st.session_state.computers[i]['ssh_password'] = ssh_password
-                        st.session_state.computers[i]['sudo_pass'] = sudo_pass
-                        updated_count += 1
+                total_count = inventory.count()
+                updated_count = inventory.set_default_credentials(ssh_user, ssh_password, sudo_pass, apply_to_all)
                 
                 if ssh_password:
                     if apply_to_all:
@@ -645,17 +922,192 @@ if authenticated:
                 if updated_count > 0:
                     st.info("Los equipos actualizados se marcarán con ✅ en el Panel de Control")
         
+        # Key-based authentication, shared with the background jobs
+        with st.form("ssh_auth_form"):
+            st.subheader("Autenticación por clave")
+            default_key = st.text_input(
+                "Clave privada por defecto (ruta en el servidor):",
+                value=ssh_auth.settings["default_key"],
+                placeholder="/home/admin/.ssh/id_ed25519",
+                help="Se usa con los equipos que no tienen una clave propia"
+            )
+            passphrase = st.text_input("Frase de paso de la clave:", type="password",
+                                       value=ssh_auth.settings["passphrase"])
+            use_agent = st.checkbox("Usar las claves del agente SSH (SSH_AUTH_SOCK)",
+                                    value=ssh_auth.settings["use_agent"])
+            sudo_nopasswd = st.checkbox(
+                "sudo sin contraseña (regla NOPASSWD de setup-remote.sh)",
+                value=ssh_auth.settings["sudo_nopasswd"],
+                help="Ejecuta 'sudo -n shutdown' sin enviar la contraseña; si el equipo la pide, "
+                     "se reintenta con la contraseña sudo"
+            )
+            backend = st.radio(
+                "Motor de ejecución SSH:", SSH_BACKENDS,
+                index=SSH_BACKENDS.index(ssh_backend()), horizontal=True,
+                format_func=lambda name: {"paramiko": "paramiko (un hilo por sesión)",
+                                          "asyncssh": "asyncssh (asyncio, miles de sesiones)"}[name],
+                help=("asyncssh atiende todas las sesiones en un único bucle de eventos"
+                      if asyncssh_available() else
+                      "asyncssh atiende todas las sesiones en un único bucle de eventos; "
+                      "no está instalado: pip install asyncssh")
+            )
+            if st.form_submit_button("Guardar autenticación"):
+                try:
+                    if default_key.strip():
+                        ssh_auth.load_key(default_key.strip(), passphrase)
+                    if backend == "asyncssh" and not asyncssh_available():
+                        raise ValueError("asyncssh no está instalado (pip install asyncssh)")
+                    ssh_auth.save(default_key=default_key.strip(), passphrase=passphrase, use_agent=use_agent,
+                                  sudo_nopasswd=sudo_nopasswd, backend=backend)
+                    st.success("✅ Autenticación por clave actualizada")
+                except Exception as e:
+                    st.error(f"❌ No se pudo cargar la clave: {str(e)}")
+        
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.caption(f"{ssh_auth.known_host_count()} claves de host conocidas ({ssh_auth.known_hosts_path}). "
+                       "La primera clave de cada equipo se acepta y se recuerda; una clave distinta se rechaza.")
+        with col2:
+            forget_ip = st.text_input("Olvidar clave de host:", placeholder="192.168.1.100", key="forget_host_ip")
+            if forget_ip and st.button("🗑️ Olvidar"):
+                if ssh_auth.forget_host(forget_ip.strip()):
+                    connection_pool.discard(forget_ip.strip(), st.session_state.ssh_user)
+                    st.success(f"Clave de {forget_ip} olvidada")
+                else:
+                    st.info(f"No hay clave guardada para {forget_ip}")
+        
         # Add a utility to see which computers currently have no credentials
         st.subheader("Estado de Credenciales")
-        no_creds = [c for c in st.session_state.computers if not c.get('ssh_password')]
+        no_creds_total, no_creds = inventory.without_credentials(limit=50)
         
-        if no_creds:
-            st.warning(f"Hay {len(no_creds)} equipos sin credenciales configuradas:")
+        if no_creds_total:
+            st.warning(f"Hay {no_creds_total} equipos sin credenciales configuradas:")
             for comp in no_creds:
                 st.markdown(f"• {comp['IP']} - {comp.get('Description', '')}")
+            if no_creds_total > len(no_creds):
+                st.caption(f"... y {no_creds_total - len(no_creds)} más")
         else:
             st.success("✅ Todos los equipos tienen credenciales configuradas")
                 
+        # Background host state monitoring
+        st.subheader("Monitoreo de estado de los equipos")
+        with st.form("host_state_form"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                monitor_enabled = st.checkbox("Monitoreo activo", value=host_states.enabled)
+            with col2:
+                monitor_interval = st.number_input("Intervalo de revisión (s):", min_value=10, max_value=3600,
+                                                   value=int(host_states.interval))
+            with col3:
+                monitor_ttl = st.number_input("Validez del estado (s):", min_value=10, max_value=86400,
+                                              value=int(host_states.ttl))
+            if st.form_submit_button("Guardar"):
+                host_states.enabled = monitor_enabled
+                host_states.interval = monitor_interval
+                host_states.ttl = monitor_ttl
+                host_states.refresh_now()
+                st.success("✅ Configuración de monitoreo actualizada")
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            if host_states.last_cycle:
+                st.caption(f"Última revisión: {datetime.fromtimestamp(host_states.last_cycle).strftime('%H:%M:%S')}")
+        with col2:
+            if st.button("🔄 Revisar ahora"):
+                host_states.invalidate([c["IP"].strip() for c in inventory.iter_rows()])
+                host_states.refresh_now()
+                st.toast("Revisión en curso")
+        
+        # Pooled connections shared by every fleet operation
+        st.subheader("Conexiones SSH activas")
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.metric("Conexiones reutilizables en el pool", connection_pool.size())
+        with col2:
+            if st.button("🔌 Cerrar conexiones"):
+                connection_pool.close_all()
+                st.rerun()
+        
+        # Reintentos de las operaciones masivas y cortocircuito de equipos que no responden
+        st.subheader("Reintentos")
+        with st.form("retry_form"):
+            retry_enabled = st.checkbox(
+                "Reintentar los equipos que fallan", value=retry_policy.settings["enabled"],
+                help="Los reintentos esperan fuera de los hilos de trabajo: el resto del lote sigue avanzando"
+            )
+            col1, col2, col3 = st.columns(3)
+            retry_values = {}
+            for column, failure, label in ((col1, "connect", "conexión"), (col2, "auth", "autenticación"),
+                                           (col3, "command", "comando")):
+                with column:
+                    retry_values[f"{failure}_retries"] = int(st.number_input(
+                        f"Reintentos por fallo de {label}:", min_value=0, max_value=10,
+                        value=int(retry_policy.settings[f"{failure}_retries"]), key=f"retry_{failure}_retries"))
+                    retry_values[f"{failure}_delay"] = float(st.number_input(
+                        "Espera inicial (s):", min_value=0.0, max_value=600.0, step=1.0,
+                        value=float(retry_policy.settings[f"{failure}_delay"]), key=f"retry_{failure}_delay",
+                        help="Se duplica en cada reintento"))
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                retry_max_delay = st.number_input("Espera máxima (s):", min_value=1.0, max_value=3600.0, step=5.0,
+                                                  value=float(retry_policy.settings["max_delay"]))
+            with col2:
+                retry_jitter = st.slider("Variación aleatoria:", 0.0, 1.0, float(retry_policy.settings["jitter"]),
+                                         help="Fracción de la espera que se recorta al azar")
+            with col3:
+                breaker_threshold = st.number_input(
+                    "Fallos de conexión para omitir:", min_value=1, max_value=100,
+                    value=int(retry_policy.settings["breaker_threshold"]),
+                    help="Tras tantos fallos de conexión seguidos, el equipo se omite en las operaciones")
+            with col4:
+                breaker_cooldown = st.number_input("Omitir durante (s):", min_value=0, max_value=86400,
+                                                   value=int(retry_policy.settings["breaker_cooldown"]))
+            if st.form_submit_button("Guardar"):
+                retry_policy.save(enabled=retry_enabled, max_delay=float(retry_max_delay),
+                                  jitter=float(retry_jitter), breaker_threshold=int(breaker_threshold),
+                                  breaker_cooldown=int(breaker_cooldown), **retry_values)
+                st.success("✅ Configuración de reintentos actualizada")
+        open_circuits = circuit_breaker.open_circuits(retry_policy.settings["breaker_cooldown"])
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            if open_circuits:
+                st.warning(f"{len(open_circuits)} equipos omitidos por fallos de conexión repetidos: " +
+                           ", ".join(f"{ip} (hasta {datetime.fromtimestamp(until).strftime('%H:%M')})"
+                                     for ip, _, until in open_circuits[:20]) +
+                           (" ..." if len(open_circuits) > 20 else ""))
+            else:
+                st.caption("Ningún equipo omitido por fallos de conexión repetidos")
+        with col2:
+            if open_circuits and st.button("♻️ Volver a intentar todos"):
+                circuit_breaker.reset()
+                st.rerun()
+        
+        # Confirmación de que los equipos se apagan de verdad tras un apagado inmediato
+        st.subheader("Verificación de apagados")
+        with st.form("verify_form"):
+            verify_enabled = st.checkbox(
+                "Comprobar que los equipos dejan de responder tras un apagado inmediato",
+                value=shutdown_verifier.settings["enabled"],
+                help="Cada entrada del registro pasa de 'sin confirmar' a 'apagado confirmado' o 'sigue encendido'"
+            )
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                verify_grace = st.number_input("Espera inicial (s):", min_value=0, max_value=600,
+                                               value=int(shutdown_verifier.settings["grace"]), key="verify_grace")
+            with col2:
+                verify_interval = st.number_input("Intervalo entre sondeos (s):", min_value=1, max_value=300,
+                                                  value=int(shutdown_verifier.settings["interval"]))
+            with col3:
+                verify_deadline = st.number_input("Plazo máximo (s):", min_value=10, max_value=3600,
+                                                  value=int(shutdown_verifier.settings["deadline"]),
+                                                  help="Después, los equipos que responden quedan como encendidos")
+            with col4:
+                verify_misses = st.number_input("Sondeos sin respuesta para confirmar:", min_value=1, max_value=10,
+                                                value=int(shutdown_verifier.settings["misses"]))
+            if st.form_submit_button("Guardar"):
+                shutdown_verifier.save(enabled=verify_enabled, grace=int(verify_grace), interval=int(verify_interval),
+                                       deadline=int(verify_deadline), misses=int(verify_misses))
+                st.success("✅ Configuración de verificación actualizada")
+        
         # SSH testing section
         st.subheader("Probar conexión SSH")
         
@@ -665,92 +1117,272 @@ if authenticated:
         if st.button("🔄 Probar conexión"):
             if not test_ip:
                 st.error("Ingrese una dirección IP")
-            elif not st.session_state.ssh_password:
-                st.error("Debe configurar una contraseña SSH primero")
+            elif not (st.session_state.ssh_password or ssh_auth.has_keys()):
+                st.error("Debe configurar una contraseña SSH o una clave primero")
             else:
                 with st.spinner("Probando conexión..."):
+                    transport = None
                     try:
-                        client = paramiko.SSHClient()
-                        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                        
                         st.info(f"Conectando a {test_ip} como {st.session_state.ssh_user}...")
                         
-                        client.connect(
-                            hostname=test_ip,
-                            username=st.session_state.ssh_user,
-                            password=st.session_state.ssh_password,
-                            timeout=5
+                        test_trace = {}
+                        transport = connection_pool.acquire(
+                            test_ip,
+                            st.session_state.ssh_user,
+                            st.session_state.ssh_password,
+                            timeout=5,
+                            trace=test_trace
                         )
+                        if test_trace.get("auth_method"):
+                            st.caption(f"Autenticado por {test_trace['auth_method']} en {test_trace['auth_ms']:.0f} ms")
                         
                         # Test a simple command
                         cmd = "whoami" if test_os == "Linux" else "whoami"
-                        stdin, stdout, stderr = client.exec_command(cmd)
-                        output = stdout.read().decode().strip()
-                        error = stderr.read().decode().strip()
+                        result = run_remote(transport, cmd, timeout=5)
                         
-                        if error:
-                            st.warning(f"Advertencia: {error}")
+                        if result.stderr:
+                            st.warning(f"Advertencia: {result.stderr}")
                         
                         # Probar que podamos obtener privilegios sudo (solo Linux)
                         if test_os == "Linux":
                             sudo_pwd = st.session_state.sudo_pass if st.session_state.sudo_pass else st.session_state.ssh_password
-                            cmd = f'echo "{sudo_pwd}" | sudo -S id'
-                            stdin, stdout, stderr = client.exec_command(cmd)
-                            sudo_output = stdout.read().decode().strip()
-                            sudo_error = stderr.read().decode().strip()
+                            for label, cmd in sudo_attempts("id", sudo_pwd):
+                                sudo_result = run_remote(transport, cmd, timeout=5, label=label)
+                                if "uid=0" in sudo_result.stdout:
+                                    break
                             
-                            if "uid=0" in sudo_output:
-                                st.success("✅ Acceso sudo verificado")
+                            if "uid=0" in sudo_result.stdout:
+                                st.success(f"✅ Acceso sudo verificado ({sudo_result.label})")
                             else:
-                                st.warning(f"⚠️ Posible problema con acceso sudo: {sudo_error}")
+                                st.warning(f"⚠️ Posible problema con acceso sudo: {sudo_result.stderr}")
                         
                         st.success(f"✅ Conexión exitosa a {test_ip}")
-                        st.code(f"Usuario: {output}")
-                        
-                        client.close()
+                        st.code(f"Usuario: {result.stdout}")
                     except Exception as e:
                         st.error(f"❌ Error de conexión: {str(e)}")
                         st.info("Revise que los datos sean correctos y el equipo esté encendido y accesible.")
+                    finally:
+                        if transport is not None:
+                            connection_pool.release(test_ip, st.session_state.ssh_user, transport)
+
+    # Central scheduled jobs page
+    elif st.session_state.page == "jobs":
+        st.title("Tareas Programadas")
+        
+        st.info("""
+        Las tareas programadas las ejecuta el servicio `turnoff scheduler` en el servidor, aunque se
+        cierre el navegador o se reinicie esta aplicación. En la hora indicada se apagan todos los equipos de la tarea en paralelo, o se encienden
+        por oleadas con Wake-on-LAN si la tarea es de encendido.
+        Las tareas recurrentes se repiten los días seleccionados (por ejemplo, de lunes a viernes a las 22:00).
+        """)
+        service = job_store.service_status()
+        if service:
+            st.caption(f"🟢 Planificador activo en {service['host']} (PID {service['pid']})")
+        else:
+            st.warning("⚠️ El servicio planificador no está en ejecución: las tareas no se ejecutarán. "
+                       "Inícielo con `turnoff scheduler` o instale `turnoff-scheduler.service` (ver README).")
+        
+        st.subheader("Nueva tarea")
+        job_computers, job_selector = select_targets("job")
+        if job_selector:
+            st.caption("La expresión se evalúa al ejecutar la tarea, con el inventario de ese momento.")
+        
+        with st.form("new_job_form"):
+            job_name = st.text_input("Nombre:", placeholder="Laboratorio 3 - noches")
+            job_action = st.radio("Acción:", ["Apagar", "Encender (Wake-on-LAN)"], horizontal=True)
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                job_time = st.time_input("Hora:", value=datetime.strptime("22:00", "%H:%M").time())
+                job_recurring = st.checkbox("Recurrente", value=True)
+            with col2:
+                job_days = st.multiselect("Días (si es recurrente):", options=WEEKDAYS, default=WEEKDAYS[:5])
+                job_date = st.date_input("Fecha (si es una sola vez):", value=datetime.now().date(),
+                                         min_value=datetime.now().date())
+            
+            if st.form_submit_button("➕ Crear tarea"):
+                # Solo se guardan IP y sistema: las credenciales se leen del inventario al ejecutar
+                targets = [{"IP": pc["IP"], "OS": pc["OS"]} for pc in job_computers]
+                if not job_name or not targets:
+                    st.error("Indique un nombre y al menos un equipo")
+                elif job_recurring and not job_days:
+                    st.error("Seleccione al menos un día para la tarea recurrente")
+                else:
+                    try:
+                        job_store.add_job(
+                            job_name,
+                            targets,
+                            job_time,
+                            days=[WEEKDAYS.index(day) for day in job_days] if job_recurring else None,
+                            run_date=job_date,
+                            selector=job_selector,
+                            options={
+                                "workers": st.session_state.exec_workers,
+                                "host_timeout": st.session_state.exec_host_timeout,
+                                "total_timeout": st.session_state.exec_total_timeout,
+                                "preflight": st.session_state.exec_preflight,
+                                "preflight_timeout": st.session_state.exec_preflight_timeout,
+                                "lean": st.session_state.exec_lean,
+                                "rollout": (session_rollout_plan().as_options()
+                                            if st.session_state.exec_rollout else None)
+                            },
+                            action="shutdown" if job_action == "Apagar" else "wake"
+                        )
+                        st.success(f"✅ Tarea '{job_name}' creada")
+                    except ValueError as e:
+                        st.error(f"⚠️ {str(e)}")
+        
+        st.subheader("Tareas")
+        jobs = job_store.jobs()
+        if jobs:
+            for job in jobs:
+                if job["days"]:
+                    recurrence = ", ".join(WEEKDAYS[day][:3] for day in job["days"])
+                else:
+                    recurrence = "Una vez"
+                next_run = datetime.fromisoformat(job["next_run"]).strftime('%d/%m/%Y %H:%M') if job["next_run"] else "—"
+                
+                with st.container():
+                    col1, col2, col3 = st.columns([3, 1, 1])
+                    with col1:
+                        job_targets = f"`{job['selector']}`" if job.get("selector") else f"{len(job['targets'])} equipos"
+                        icon = "⚡" if job.get("action") == "wake" else "🔴"
+                        st.markdown(f"{icon} **{job['name']}** — {job['time']} ({recurrence}) · {job_targets}")
+                        last_run = ""
+                        if job["last_run"]:
+                            last_run = f" · Última: {datetime.fromisoformat(job['last_run']).strftime('%d/%m/%Y %H:%M')} ({job['last_result']})"
+                        elif job["last_result"]:
+                            last_run = f" · {job['last_result']}"
+                        st.caption(f"Próxima ejecución: {next_run}{last_run}")
+                    with col2:
+                        if st.button("▶️ Ejecutar ahora", key=f"run_job_{job['id']}", use_container_width=True):
+                            job_store.run_now(job["id"])
+                            st.success("Tarea enviada al planificador, consulte el registro de actividad")
+                    with col3:
+                        if st.button("🗑️ Eliminar", key=f"delete_job_{job['id']}", use_container_width=True):
+                            job_store.remove_job(job["id"])
+                            st.rerun()
+        else:
+            st.info("No hay tareas programadas")
 
     # Logs page
     elif st.session_state.page == "logs":
         st.title("Registro de Actividad")
         
         # Controls to filter/clear logs
-        col1, col2 = st.columns([3, 1])
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            host_filter = st.text_input("Equipo (IP):", key="log_host_filter")
+        with col2:
+            filter_type = st.selectbox("Filtrar por:", ["Todo", "Exitosos", "Errores", "Omitidos",
+                                                        "Siguen encendidos"])
+        with col3:
+            date_range = st.date_input("Fechas:", value=(), key="log_date_range")
+        
+        col1, col2, col3 = st.columns([1, 1, 2])
         with col1:
-            filter_type = st.selectbox("Filtrar por:", ["Todo", "Exitosos", "Errores"])
+            page_size = st.selectbox("Por página:", [25, 50, 100], index=1, key="log_page_size")
+        
+        since = until = None
+        if len(date_range) >= 1:
+            since = datetime.combine(date_range[0], datetime.min.time()).timestamp()
+            until = datetime.combine(date_range[-1] + timedelta(days=1), datetime.min.time()).timestamp()
+        status = {"Exitosos": "success", "Errores": "error", "Omitidos": "skipped",
+                  "Siguen encendidos": "still_up"}.get(filter_type)
+        total, _ = activity_log.query(host_filter.strip(), status, since, until, limit=0)
+        page_count = max(1, (total + page_size - 1) // page_size)
         with col2:
-            if st.button("🗑️ Limpiar registro"):
-                st.session_state.shutdown_results = []
+            page = st.number_input(f"Página (de {page_count}):", min_value=1, max_value=page_count, value=1,
+                                   key="log_page")
+        with col3:
+            if st.button("🗑️ Limpiar registro", help="Vacía la vista; el historial en disco se conserva"):
+                activity_log.clear()
                 st.rerun()
         
-        # Display filtered logs
-        if st.session_state.shutdown_results:
-            for result in st.session_state.shutdown_results[::-1]:  # Show newest first
+        # Display only the visible page of the filtered logs (newest first)
+        _, results = activity_log.query(host_filter.strip(), status, since, until,
+                                        offset=(min(page, page_count) - 1) * page_size, limit=page_size)
+        if results:
+            st.caption(f"{total} entradas")
+            for result in results:
                 try:
                     ip = result.get("ip", "Unknown")
                     os_type = result.get("os", "Unknown")
                     message = result.get("message", "No message")
-                    time_str = result.get("time", datetime.now().strftime("%H:%M:%S"))
+                    time_str = datetime.fromtimestamp(result["ts"]).strftime("%d/%m %H:%M:%S") if "ts" in result \
+                        else result.get("time", "")
                     success = result.get("success", False)
                     
-                    # Apply filter
-                    if filter_type == "Exitosos" and not success:
-                        continue
-                    if filter_type == "Errores" and success:
-                        continue
-                    
                     # Create a card-like display for each log entry
                     with st.container():
-                        if success:
+                        if result.get("skipped"):
+                            st.warning(f"⏭️ [{time_str}] {ip} ({os_type}) - {message}")
+                        elif success:
                             st.success(f"✅ [{time_str}] {ip} ({os_type}) - {message}")
                         else:
                             st.error(f"❌ [{time_str}] {ip} ({os_type}) - {message}")
+                        details = ([CONFIRMATION_LABELS[result["confirmation"]]]
+                                   if result.get("confirmation") in CONFIRMATION_LABELS else []) + \
+                            ([f"👤 {result['user']}"] if result.get("user") else []) + \
+                            ([format_timings(result["timings"])] if result.get("timings") else [])
+                        if details:
+                            st.caption(" · ".join(details))
                 except Exception as e:
                     st.warning(f"Error al mostrar entrada de registro: {str(e)}")
         else:
             st.info("No hay registros de actividad")
+        
+        # Download the on-disk journal, which also holds entries older than the view
+        with st.expander("📁 Historial en disco"):
+            for path in activity_log.journal_files():
+                st.download_button(
+                    f"📥 {os.path.basename(path)} ({os.path.getsize(path) // 1024} KB)",
+                    lambda path=path: open(path, "rb").read(),
+                    file_name=os.path.basename(path),
+                    mime="application/json",
+                    key=f"journal_{os.path.basename(path)}"
+                )
+
+    # Latency statistics page
+    elif st.session_state.page == "stats":
+        st.title("Estadísticas de Latencia")
+        
+        st.info("""
+        Tiempo de cada fase (DNS, conexión TCP, handshake SSH, autenticación y cada comando remoto)
+        de las operaciones sobre los equipos desde que se inició el servidor. La fase **batch** es la
+        duración total de cada lote en paralelo. Las conexiones reutilizadas del pool no tienen fases
+        de conexión.
+        """)
+        
+        rows = metrics.summary()
+        if rows:
+            st.subheader("Por operación y fase")
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+            
+            st.subheader("Equipos más lentos")
+            st.dataframe(metrics.slowest_hosts(), use_container_width=True, hide_index=True)
+            
+            st.subheader("Últimos lotes")
+            st.dataframe([{
+                "Hora": datetime.fromtimestamp(batch["ts"]).strftime("%d/%m %H:%M:%S"),
+                "Operación": batch["operation"],
+                "Equipos": batch["hosts"],
+                "Exitosos": batch["succeeded"],
+                "Duración (s)": round(batch["wall_ms"] / 1000, 2)
+            } for batch in metrics.batches()], use_container_width=True, hide_index=True)
+        else:
+            st.info("Aún no hay mediciones")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("📥 Descargar métricas (Prometheus)", metrics.prometheus,
+                               file_name="metrics.prom", mime="text/plain")
+        with col2:
+            if st.button("🗑️ Reiniciar estadísticas"):
+                metrics.reset()
+                st.rerun()
+        st.caption(f"Las métricas se escriben en {METRICS_FILE} tras cada lote (textfile collector de "
+                   "node_exporter). Defina TURNOFF_METRICS_PORT para servirlas en /metrics por HTTP.")
 
     # Tools page - Additional utilities
     elif st.session_state.page == "tools":
@@ -808,34 +1440,138 @@ if authenticated:
                 
         except FileNotFoundError:
             st.error("⚠️ El script de configuración no está disponible. Contacte al administrador.")
+        
+        # Agente remoto opcional: órdenes firmadas por UDP con SSH como respaldo
+        st.header("Agente Remoto")
+        st.info("""
+        El script puede instalar un agente ligero (servicio systemd) que recibe las órdenes de
+        apagado, cancelación y estado en un solo datagrama UDP firmado con la clave de abajo.
+        Con el agente activado, las operaciones masivas se envían primero a todos los equipos Linux
+        a la vez y solo los que no respondan se procesan por SSH.
+        """)
+        with st.form("agent_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                agent_enabled = st.checkbox("Usar el agente remoto", value=agent_client.enabled)
+            with col2:
+                agent_port = st.number_input("Puerto UDP:", min_value=1, max_value=65535,
+                                             value=int(agent_client.settings["port"]))
+            if st.form_submit_button("Guardar"):
+                agent_client.save(enabled=agent_enabled, port=int(agent_port))
+                st.success("✅ Configuración del agente actualizada")
+        with st.expander("🔑 Clave del agente"):
+            st.warning("Quien tenga esta clave puede apagar los equipos con agente. No la comparta.")
+            st.code(agent_client.key)
+            st.markdown("Instalación desatendida en cada equipo (la clave se lee de un fichero 0600, "
+                        "no de la línea de órdenes):")
+            st.code("(umask 077; cat > agent.key)   # pegue la clave y pulse Ctrl+D\n"
+                    f"sudo INSTALL_AGENT=s TURNOFF_AGENT_KEY_FILE=agent.key "
+                    f"TURNOFF_AGENT_PORT={agent_client.settings['port']} bash setup-remote.sh && rm agent.key",
+                    language="bash")
+            if st.button("🔄 Generar nueva clave", help="Los equipos deberán configurarse de nuevo"):
+                agent_client.regenerate_key()
+                st.rerun()
+            
+        # Wake-on-LAN: parámetros de envío de paquetes mágicos
+        st.header("Wake-on-LAN")
+        st.info("""
+        Para encender equipos, la BIOS/UEFI y la tarjeta de red deben tener Wake-on-LAN activado.
+        Las direcciones MAC se guardan solas al consultar el estado de los equipos encendidos,
+        o pueden indicarse en el listado de equipos.
+        """)
+        with st.form("wol_form"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                wol_broadcast = st.text_input("Dirección de difusión:", value=wake_on_lan.settings["broadcast"])
+                wol_port = st.number_input("Puerto UDP:", min_value=1, max_value=65535,
+                                           value=int(wake_on_lan.settings["port"]))
+            with col2:
+                wol_directed = st.checkbox("Difusión dirigida a la subred de cada equipo",
+                                           value=wake_on_lan.settings["directed"],
+                                           help="Necesaria si los equipos están en otra VLAN y el router la permite")
+                wol_prefix = st.number_input("Prefijo de la subred:", min_value=8, max_value=30,
+                                             value=int(wake_on_lan.settings["prefix"]))
+            with col3:
+                wol_rate = st.number_input("Paquetes por segundo:", min_value=1, max_value=10000,
+                                           value=int(wake_on_lan.settings["rate"]))
+                wol_repeats = st.number_input("Repeticiones por equipo:", min_value=1, max_value=10,
+                                              value=int(wake_on_lan.settings["repeats"]))
+            col1, col2 = st.columns(2)
+            with col1:
+                wol_wave_size = st.number_input("Equipos por oleada:", min_value=1, max_value=10000,
+                                                value=int(wake_on_lan.settings["wave_size"]))
+            with col2:
+                wol_wave_delay = st.number_input("Pausa entre oleadas (s):", min_value=0, max_value=3600,
+                                                 value=int(wake_on_lan.settings["wave_delay"]),
+                                                 help="Evita picos de consumo y de peticiones DHCP")
+            if st.form_submit_button("Guardar"):
+                wake_on_lan.save(broadcast=wol_broadcast.strip() or "255.255.255.255", port=int(wol_port),
+                                 directed=wol_directed, prefix=int(wol_prefix), rate=int(wol_rate),
+                                 repeats=int(wol_repeats), wave_size=int(wol_wave_size),
+                                 wave_delay=int(wol_wave_delay))
+                st.success("✅ Configuración de Wake-on-LAN actualizada")
             
         # Otras herramientas útiles
         st.header("Otras Herramientas")
         
-        # Herramienta de ping
-        st.subheader("Verificar conectividad (ping)")
+        # Escáner de conectividad de toda la flota
+        st.subheader("Verificar conectividad de los equipos")
+        st.caption(f"Prueba el puerto SSH ({SSH_PORT}) de todos los equipos en paralelo y, opcionalmente, ICMP (ping).")
         
-        ping_ip = st.text_input("Dirección IP:", placeholder="192.168.1.100", key="ping_ip")
-        if st.button("Verificar conectividad"):
-            if ping_ip:
-                with st.spinner(f"Verificando conectividad con {ping_ip}..."):
-                    import subprocess
-                    try:
-                        # Intentar hacer ping (diferente comando según sistema operativo)
-                        param = '-n' if os.name == 'nt' else '-c'
-                        command = ['ping', param, '4', ping_ip]
-                        result = subprocess.run(command, capture_output=True, text=True)
-                        
-                        if result.returncode == 0:
-                            st.success(f"✅ {ping_ip} está accesible")
-                            st.code(result.stdout)
-                        else:
-                            st.error(f"❌ {ping_ip} no responde")
-                            st.code(result.stderr)
-                    except Exception as e:
-                        st.error(f"Error al verificar conectividad: {str(e)}")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            scan_concurrency = st.number_input("Sondeos simultáneos:", min_value=1, max_value=2048, value=256, key="scan_concurrency")
+        with col2:
+            scan_timeout_ms = st.number_input("Tiempo límite por sondeo (ms):", min_value=100, max_value=10000, value=1000, step=100, key="scan_timeout")
+        with col3:
+            scan_icmp = st.checkbox("Incluir ICMP (ping)", key="scan_icmp")
+        extra_ips = st.text_input("IPs adicionales (separadas por coma):", placeholder="192.168.1.100, 192.168.1.101", key="ping_ip")
+        
+        if st.button("📡 Escanear equipos"):
+            hosts = []
+            for host in [c["IP"].strip() for c in inventory.all()] + [ip.strip() for ip in extra_ips.split(",")]:
+                if host and host not in hosts:
+                    hosts.append(host)
+            
+            if hosts:
+                timeout = scan_timeout_ms / 1000
+                rows = {host: {"IP": host, f"SSH ({SSH_PORT})": "⏳", "Latencia (ms)": None} for host in hosts}
+                if scan_icmp:
+                    for row in rows.values():
+                        row["ICMP"] = "⏳"
+                progress = st.progress(0.0, text=f"0/{len(hosts)} equipos")
+                table = st.empty()
+                
+                icmp_executor = ThreadPoolExecutor(max_workers=min(int(scan_concurrency), 64)) if scan_icmp else None
+                icmp_futures = {icmp_executor.submit(ping_host, host, timeout): host for host in hosts} if scan_icmp else {}
+                
+                done = 0
+                last_render = 0
+                for host, reachable, latency, error in scan_hosts(hosts, SSH_PORT, timeout, int(scan_concurrency)):
+                    rows[host][f"SSH ({SSH_PORT})"] = "🟢 Accesible" if reachable else f"🔴 {error}"
+                    rows[host]["Latencia (ms)"] = latency
+                    done += 1
+                    # Limitamos el redibujado de la tabla para no saturar el navegador
+                    if time.monotonic() - last_render > 0.25 or done == len(hosts):
+                        progress.progress(done / len(hosts), text=f"{done}/{len(hosts)} equipos")
+                        table.dataframe(list(rows.values()), use_container_width=True, hide_index=True)
+                        last_render = time.monotonic()
+                
+                if icmp_executor:
+                    for future in as_completed(icmp_futures):
+                        reachable, latency = future.result()
+                        rows[icmp_futures[future]]["ICMP"] = f"🟢 {latency} ms" if reachable else "🔴 Sin respuesta"
+                    icmp_executor.shutdown()
+                
+                st.session_state.scan_results = list(rows.values())
+                st.rerun()
             else:
-                st.warning("Ingrese una dirección IP para verificar")
+                st.warning("No hay equipos para verificar")
+        
+        if st.session_state.get('scan_results'):
+            up_count = sum(1 for row in st.session_state.scan_results if row[f"SSH ({SSH_PORT})"].startswith("🟢"))
+            st.metric("Equipos accesibles por SSH", f"{up_count}/{len(st.session_state.scan_results)}")
+            st.dataframe(st.session_state.scan_results, use_container_width=True, hide_index=True)
 
 else:
     # Show login screen when not authenticated
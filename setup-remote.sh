@@ -152,6 +152,216 @@ EOF
 chmod 440 "$SUDO_FILE"
 echo "✅ Configuración NOPASSWD para shutdown completada"
 
+# Autorizar la clave pública del servidor de control (opcional)
+echo ""
+echo "🔑 Autenticación por clave (opcional)"
+if [ -z "$SSH_PUBLIC_KEY" ]; then
+    read -p "Pegue la clave pública del servidor de control (Enter para omitir): " SSH_PUBLIC_KEY
+fi
+
+if [ -n "$SSH_PUBLIC_KEY" ]; then
+    if [ -z "$KEY_USER" ]; then
+        read -p "Usuario que recibirá la clave: " KEY_USER
+    fi
+    if id "$KEY_USER" &>/dev/null; then
+        KEY_HOME=$(getent passwd "$KEY_USER" | cut -d: -f6)
+        mkdir -p "$KEY_HOME/.ssh"
+        if ! grep -qF "$SSH_PUBLIC_KEY" "$KEY_HOME/.ssh/authorized_keys" 2>/dev/null; then
+            echo "$SSH_PUBLIC_KEY" >> "$KEY_HOME/.ssh/authorized_keys"
+        fi
+        chown -R "$KEY_USER": "$KEY_HOME/.ssh"
+        chmod 700 "$KEY_HOME/.ssh"
+        chmod 600 "$KEY_HOME/.ssh/authorized_keys"
+        echo "✅ Clave pública autorizada para $KEY_USER"
+    else
+        echo "❌ El usuario $KEY_USER no existe; se omite la clave pública"
+    fi
+else
+    echo "⏭️  Sin clave pública: se usará la contraseña"
+fi
+
+# Instalar el agente remoto (opcional): recibe órdenes firmadas por UDP sin abrir una sesión SSH
+echo ""
+echo "⚡ Agente remoto de apagado rápido (opcional)"
+if [ -z "$INSTALL_AGENT" ]; then
+    read -p "¿Instalar el agente remoto? (s/N): " INSTALL_AGENT
+fi
+
+if [[ "$INSTALL_AGENT" =~ ^([sSyY1]) ]]; then
+    if ! command -v python3 &>/dev/null; then
+        echo "❌ El agente necesita python3; se omite la instalación"
+    else
+        # La clave nunca va en la línea de órdenes (historial, ps): fichero 0600 o entrada oculta
+        if [ -n "$TURNOFF_AGENT_KEY_FILE" ]; then
+            AGENT_KEY=$(cat "$TURNOFF_AGENT_KEY_FILE")
+        else
+            read -r -s -p "Clave del agente (se muestra en Herramientas del panel): " AGENT_KEY
+            echo ""
+        fi
+        if [ -z "$AGENT_KEY" ]; then
+            echo "❌ No se indicó la clave del agente"
+            exit 1
+        fi
+        AGENT_PORT="${TURNOFF_AGENT_PORT:-47474}"
+
+        mkdir -p /etc/turnoff /usr/local/lib/turnoff
+        (umask 077; printf '%s\n' "$AGENT_KEY" > /etc/turnoff/agent.key)
+        unset AGENT_KEY
+
+        cat > /usr/local/lib/turnoff/agent.py <<'AGENT'
+#!/usr/bin/env python3
+"""Agente de apagado remoto: acepta órdenes firmadas con HMAC-SHA256 por UDP"""
+import hashlib
+import hmac
+import json
+import os
+import socket
+import subprocess
+import time
+
+KEY_FILE = "/etc/turnoff/agent.key"
+KEY = b""  # Se lee en main()
+PORT = int(os.environ.get("TURNOFF_AGENT_PORT", "47474"))
+WINDOW = 30  # Segundos de validez de cada orden
+ADDRESSES = set()
+ADDRESSES_AT = float("-inf")
+
+def sign(body):
+    return hmac.new(KEY, body.encode(), hashlib.sha256).hexdigest()
+
+def addressed_here(address):
+    """True si la orden va dirigida a una dirección de este equipo (se releen cada 10 s como mucho)"""
+    global ADDRESSES, ADDRESSES_AT
+    if address not in ADDRESSES and time.monotonic() - ADDRESSES_AT > 10:
+        output = subprocess.run(["ip", "-o", "addr", "show"], capture_output=True, text=True, timeout=5).stdout
+        ADDRESSES = {line.split()[3].split("/")[0] for line in output.splitlines() if len(line.split()) > 3}
+        ADDRESSES_AT = time.monotonic()
+    return address in ADDRESSES
+
+def status():
+    uptime = float(open("/proc/uptime").read().split()[0])
+    load = " ".join(open("/proc/loadavg").read().split()[:3])
+    pending = None
+    try:
+        scheduled = dict(line.strip().split("=", 1) for line in open("/run/systemd/shutdown/scheduled") if "=" in line)
+        if scheduled.get("USEC"):
+            when = time.localtime(int(scheduled["USEC"]) / 1000000)
+            pending = time.strftime("%d/%m %H:%M", when) + f" ({scheduled.get('MODE', 'poweroff')})"
+    except OSError:
+        pass
+    mac = None
+    try:
+        # Interfaz de la ruta por defecto: su MAC es la que sirve para Wake-on-LAN
+        for line in open("/proc/net/route").readlines()[1:]:
+            fields = line.split()
+            if fields[1] == "00000000":
+                mac = open(f"/sys/class/net/{fields[0]}/address").read().strip()
+                break
+    except (OSError, IndexError):
+        pass
+    return {"uptime": uptime, "load": load, "pending": pending, "mac": mac}
+
+def run(command):
+    result = subprocess.run(command, capture_output=True, text=True, timeout=10)
+    return result.returncode == 0, (result.stderr or result.stdout).strip()
+
+def handle(message):
+    """Return (reply fields, action to run after replying)"""
+    action = message.get("action")
+    if action == "shutdown":
+        # Se responde antes de apagar: la orden ya fue aceptada
+        return {"ok": True, "detail": "comando aceptado"}, lambda: subprocess.Popen(["shutdown", "now"])
+    if action == "schedule":
+        ok, detail = run(["shutdown", "-h", f"+{int(message['minutes'])}"])
+        return {"ok": ok, "detail": detail}, None
+    if action == "cancel":
+        ok, detail = run(["shutdown", "-c"])
+        return {"ok": ok, "detail": detail}, None
+    if action == "status":
+        return dict(status(), ok=True, detail=""), None
+    return {"ok": False, "detail": f"acción desconocida: {action}"}, None
+
+def accept(data, seen, now):
+    """(respuesta, acción a ejecutar tras responder) para un datagrama; respuesta None si se ignora
+
+    `seen` guarda nonce -> (ts, respuesta): los duplicados reciben la misma respuesta sin repetir la acción.
+    """
+    packet = json.loads(data)
+    if not hmac.compare_digest(sign(packet["body"]), packet["sig"]):
+        return None, None
+    message = json.loads(packet["body"])
+    if abs(now - message["ts"]) > WINDOW:
+        return None, None
+    # Una orden firmada para otro equipo no se acepta aquí aunque la firma sea válida
+    if not addressed_here(message.get("to")):
+        return None, None
+    nonce = message["nonce"]
+    if nonce in seen:
+        return seen[nonce][1], None
+    fields, after = handle(message)
+    body = json.dumps(dict(fields, nonce=nonce))
+    reply = json.dumps({"body": body, "sig": sign(body)}).encode()
+    for old in [n for n, (ts, _) in seen.items() if now - ts > 2 * WINDOW]:
+        del seen[old]
+    seen[nonce] = (now, reply)
+    return reply, after
+
+def main():
+    global KEY
+    KEY = open(KEY_FILE).read().strip().encode()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind(("", PORT))
+    seen = {}
+    while True:
+        data, address = sock.recvfrom(65536)
+        try:
+            reply, after = accept(data, seen, time.time())
+            if reply:
+                sock.sendto(reply, address)
+            if after:
+                after()
+        except Exception:
+            continue
+
+if __name__ == "__main__":
+    main()
+AGENT
+        chmod 755 /usr/local/lib/turnoff/agent.py
+
+        cat > /etc/systemd/system/turnoff-agent.service <<EOF
+[Unit]
+Description=Agente de apagado remoto
+After=network-online.target
+
+[Service]
+Environment=TURNOFF_AGENT_PORT=$AGENT_PORT
+ExecStart=/usr/bin/env python3 /usr/local/lib/turnoff/agent.py
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+EOF
+        systemctl daemon-reload
+        systemctl enable --now turnoff-agent
+
+        if command -v ufw &>/dev/null; then
+            ufw allow "$AGENT_PORT"/udp
+        elif command -v firewall-cmd &>/dev/null; then
+            firewall-cmd --permanent --add-port="$AGENT_PORT"/udp
+            firewall-cmd --reload
+        fi
+
+        if systemctl is-active --quiet turnoff-agent; then
+            echo "✅ Agente remoto activo en el puerto UDP $AGENT_PORT"
+        else
+            echo "❌ El agente remoto no se pudo iniciar (journalctl -u turnoff-agent)"
+        fi
+    fi
+else
+    echo "⏭️  Sin agente remoto: se usará solo SSH"
+fi
+
 # Obtener la dirección IP
 echo ""
 echo "🌐 Información de red:"
@@ -191,7 +401,7 @@ echo "Ahora puede conectarse remotamente y apagar este equipo usando:"
 echo ""
 echo "1. Dirección IP: Una de las mostradas arriba"
 echo "2. Usuario SSH: Un usuario con permisos sudo"
-echo "3. Contraseña: La contraseña del usuario seleccionado"
+echo "3. Contraseña: La contraseña del usuario seleccionado (o la clave privada del servidor de control)"
 echo ""
 echo "Para probar el apagado, intente ejecutar:"
 echo "   ssh [usuario]@[ip] 'sudo shutdown now'"
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# turnoff.config crea el directorio de datos al importarse: las pruebas no tocan data/
+os.environ.setdefault("TURNOFF_DATA_DIR", tempfile.mkdtemp(prefix="turnoff-tests-"))
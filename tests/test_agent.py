@@ -0,0 +1,120 @@
+import json
+import os
+import time
+
+import pytest
+
+from turnoff.agent import AgentClient, agent_stage, resolve
+
+SETUP_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "setup-remote.sh")
+HERE = "10.0.0.5"
+
+def embedded_agent():
+    """The agent that setup-remote.sh installs, loaded from the script itself"""
+    with open(SETUP_SCRIPT) as file:
+        source = file.read().split("<<'AGENT'\n", 1)[1].split("\nAGENT\n", 1)[0]
+    namespace = {"__name__": "turnoff_agent"}
+    exec(compile(source, "agent.py", "exec"), namespace)
+    return namespace
+
+@pytest.fixture
+def client(tmp_path):
+    return AgentClient(str(tmp_path))
+
+@pytest.fixture
+def agent(client):
+    agent = embedded_agent()
+    agent["KEY"] = client.key.encode()
+    # Direcciones de "este equipo" sin consultar `ip addr`, y acciones registradas en lugar de ejecutadas
+    agent["ADDRESSES"] = {HERE, "127.0.0.1"}
+    agent["ADDRESSES_AT"] = float("inf")
+    agent["handled"] = []
+    agent["handle"] = lambda message: (agent["handled"].append(message["action"]) or {"ok": True, "detail": ""},
+                                       None)
+    return agent
+
+def order(action="shutdown", to=HERE, age=0, nonce="n1", **fields):
+    return dict({"action": action, "to": to, "ts": time.time() - age, "nonce": nonce}, **fields)
+
+def deliver(agent, packet, seen=None):
+    reply, _ = agent["accept"](packet, {} if seen is None else seen, time.time())
+    return reply
+
+def test_signed_order_is_accepted_and_reply_verifies(client, agent):
+    reply = deliver(agent, client._packet(order()))
+    assert agent["handled"] == ["shutdown"]
+    assert client._reply(reply) == {"ok": True, "detail": "", "nonce": "n1"}
+
+@pytest.mark.parametrize("message", [
+    order(to="10.9.9.9"),  # Firmada para otro equipo
+    {key: value for key, value in order().items() if key != "to"},
+    order(age=31),
+    order(age=-31),
+])
+def test_misaddressed_and_stale_orders_are_ignored(client, agent, message):
+    assert deliver(agent, client._packet(message)) is None
+    assert agent["handled"] == []
+
+def test_forged_orders_are_ignored(client, agent, tmp_path_factory):
+    other = AgentClient(str(tmp_path_factory.mktemp("otra")))  # Otra clave
+    assert deliver(agent, other._packet(order())) is None
+    tampered = json.loads(client._packet(order()))
+    tampered["body"] = tampered["body"].replace("shutdown", "cancel")
+    assert deliver(agent, json.dumps(tampered).encode()) is None
+    assert agent["handled"] == []
+
+def test_replayed_nonce_gets_cached_reply_without_running_again(client, agent):
+    seen = {}
+    packet = client._packet(order())
+    first = deliver(agent, packet, seen)
+    assert deliver(agent, packet, seen) == first
+    assert deliver(agent, client._packet(order(action="cancel")), seen) == first  # Mismo nonce
+    assert agent["handled"] == ["shutdown"]
+    deliver(agent, client._packet(order(nonce="n2")), seen)
+    assert agent["handled"] == ["shutdown", "shutdown"]
+
+def test_replay_cache_forgets_old_nonces(client, agent):
+    seen = {"viejo": (time.time() - 61, b"{}")}
+    deliver(agent, client._packet(order()), seen)
+    assert sorted(seen) == ["n1"]
+
+def test_addresses_are_refreshed_for_unknown_destinations(client, agent, monkeypatch):
+    agent["ADDRESSES_AT"] = float("-inf")
+    monkeypatch.setattr(agent["subprocess"], "run", lambda *args, **kwargs: type("Result", (), {"stdout": (
+        "1: lo    inet 127.0.0.1/8 scope host lo\n"
+        "2: eth0    inet 10.0.0.7/24 brd 10.0.0.255 scope global eth0\n")})())
+    assert deliver(agent, client._packet(order(to="10.0.0.7"))) is not None
+    assert deliver(agent, client._packet(order(to=HERE, nonce="n2"))) is None
+
+def test_client_rejects_unsigned_replies(client):
+    body = json.dumps({"ok": True, "nonce": "n1"})
+    assert client._reply(json.dumps({"body": body, "sig": "0" * 64}).encode()) is None
+    assert client._reply(b"no es json") is None
+    assert client._reply(json.dumps({"body": body}).encode()) is None
+
+def test_key_file_is_private(client):
+    assert os.stat(client.key_path).st_mode & 0o777 == 0o600
+    old_key = client.key
+    client.regenerate_key()
+    assert client.key != old_key and len(client.key) == 64
+
+def test_resolve(monkeypatch):
+    assert resolve("10.0.0.5") == "10.0.0.5"
+
+    def gethostbyname(host):
+        if host == "pc-01":
+            return "10.0.3.1"
+        raise OSError("no existe")
+    monkeypatch.setattr("socket.gethostbyname", gethostbyname)
+    assert resolve("pc-01") == "10.0.3.1"
+    assert resolve("pc-99") is None
+
+def test_agent_stage_leaves_unanswered_hosts_for_ssh(monkeypatch):
+    replies = {"10.0.0.1": {"ok": True, "rtt_ms": 2.0}, "10.0.0.2": {"ok": False, "detail": "error"}}
+    monkeypatch.setattr(AgentClient, "send", lambda self, hosts, action, minutes=None: replies)
+    targets = [{"IP": ip, "OS": "Linux"} for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3")]
+    targets.append({"IP": "10.0.0.4", "OS": "Windows"})
+    entries, remaining = agent_stage(targets, "shutdown", "immediate_shutdown")
+    assert [entry["ip"] for entry in entries] == ["10.0.0.1"]
+    assert entries[0]["confirmation"] == "sent" and entries[0]["timings"]["transport"] == "agent"
+    assert [target["IP"] for target in remaining] == ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
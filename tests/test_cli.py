@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pytest
+
+from turnoff.cli import build_parser, main, parse_when, selector_from_args
+
+NOW = datetime(2026, 10, 17, 21, 30)
+
+@pytest.mark.parametrize("value, now, expected", [
+    ("+0", NOW, NOW),
+    ("+45", NOW, datetime(2026, 10, 17, 22, 15)),
+    (" +180 ", NOW, datetime(2026, 10, 18, 0, 30)),
+    ("+1", datetime(2026, 12, 31, 23, 59), datetime(2027, 1, 1, 0, 0)),
+    ("22:00", NOW, datetime(2026, 10, 17, 22, 0)),
+    ("21:30", NOW, datetime(2026, 10, 18, 21, 30)),
+    ("07:00", NOW, datetime(2026, 10, 18, 7, 0)),
+    ("00:00", datetime(2026, 12, 31, 23, 0), datetime(2027, 1, 1, 0, 0)),
+    ("06:00", datetime(2028, 2, 28, 22, 0), datetime(2028, 2, 29, 6, 0)),
+    ("2026-10-20 08:15", NOW, datetime(2026, 10, 20, 8, 15)),
+    ("2026-10-20T08:15", NOW, datetime(2026, 10, 20, 8, 15)),
+])
+def test_parse_when(value, now, expected):
+    assert parse_when(value, now) == expected
+
+@pytest.mark.parametrize("value", ["", "+", "+diez", "+-5", "+ 5", "24:00", "22h", "2026-13-01 10:00", "mañana"])
+def test_parse_when_errors(value):
+    with pytest.raises(ValueError, match=r"Hora no válida: .*\+N .*HH:MM"):
+        parse_when(value, NOW)
+
+def test_bad_at_exits_with_usage_hint(capsys):
+    assert main(["shutdown", "--all", "--at", "22h"]) == 2
+    assert capsys.readouterr().err == ("turnoff: Hora no válida: '22h'. Use +N (minutos desde ahora), HH:MM "
+                                       "o 'AAAA-MM-DD HH:MM'\n")
+
+def selector(*argv):
+    return selector_from_args(build_parser().parse_args(["list", *argv]))
+
+@pytest.mark.parametrize("argv, expression", [
+    (["--select", "lab3 AND NOT server"], "lab3 AND NOT server"),
+    (["--select", "a OR b", "--os", "linux"], "(a OR b) AND os:linux"),
+    (["--group", "lab3", "--group", "lab4", "--tag", "aula"], "(group:lab3 OR group:lab4) AND (tag:aula)"),
+    (["--all", "--group", "lab3"], "*"),
+])
+def test_selector_from_args(argv, expression):
+    assert selector(*argv) == expression
+
+@pytest.mark.parametrize("argv, error", [
+    (["--select", "lab3 AND"], "incompleta"),
+    (["--select", "a) OR (b"], "Símbolo inesperado: \\)"),
+    (["--select", "a) OR (b", "--os", "linux"], "Símbolo inesperado"),
+    ([], "Indique los equipos"),
+])
+def test_selector_from_args_errors(argv, error):
+    with pytest.raises(ValueError, match=error):
+        selector(*argv)
@@ -0,0 +1,63 @@
+import pytest
+
+from turnoff.fleet import RolloutPlan, run_rollout
+from turnoff.logs import log_entry
+
+def targets(groups):
+    return [{"IP": f"10.0.0.{number}", "OS": "Linux", "Group": group}
+            for number, group in enumerate(groups, 1)]
+
+@pytest.mark.parametrize("by, size, groups, waves", [
+    ("size", 2, "aaaaa", [2, 2, 1]),
+    ("size", 5, "aaaaa", [5]),
+    ("size", 10, "aaa", [3]),
+    ("size", 0, "aa", [1, 1]),
+    ("group", 10, "aabab", [3, 2]),
+    ("group", 2, "aaabb", [2, 1, 2]),
+    ("group", 3, ["", "a", "", ""], [3, 1]),
+    ("size", 3, "", []),
+])
+def test_rollout_waves(by, size, groups, waves):
+    hosts = targets(groups)
+    planned = RolloutPlan(by=by, size=size).waves(hosts)
+    assert [len(wave) for wave in planned] == waves
+    assert sorted(target["IP"] for wave in planned for target in wave) == sorted(t["IP"] for t in hosts)
+    if by == "group":
+        assert all(len({target["Group"] for target in wave}) == 1 for wave in planned)
+
+def run(plan, hosts, failing=(), offline=(), staggered=True):
+    offsets = []
+
+    def run_wave(wave, offset):
+        offsets.append(offset)
+        for target in wave:
+            entry = log_entry(target["IP"] not in failing, target["IP"], target["OS"], "")
+            if target["IP"] in offline:
+                entry["skipped"] = True
+            yield entry
+
+    return list(run_rollout(hosts, plan, run_wave, staggered=staggered)), offsets
+
+def test_rollout_staggered_offsets():
+    entries, offsets = run(RolloutPlan(size=2, delay=30, jitter=0), targets("aaaaa"))
+    assert offsets == [0, 30, 60]
+    assert len(entries) == 5 and all(entry["success"] for entry in entries)
+
+def test_rollout_stops_after_failed_wave():
+    hosts = targets("aaaaaa")
+    entries, offsets = run(RolloutPlan(size=2, delay=0, jitter=0, max_failure_rate=0.5), hosts,
+                           failing={"10.0.0.3", "10.0.0.4"})
+    assert len(offsets) == 2
+    skipped = [entry for entry in entries if entry.get("skipped")]
+    assert [entry["ip"] for entry in skipped] == ["10.0.0.5", "10.0.0.6"]
+    assert all("oleada 2/3" in entry["message"] for entry in skipped)
+
+def test_rollout_ignores_offline_hosts_in_failure_rate():
+    # Un equipo apagado (omitido por la comprobación previa) no cuenta como fallo
+    entries, offsets = run(RolloutPlan(size=2, delay=0, jitter=0, max_failure_rate=0.4), targets("aaaa"),
+                           failing={"10.0.0.1"}, offline={"10.0.0.1"})
+    assert len(offsets) == 2 and len(entries) == 4
+
+def test_rollout_last_wave_failing_does_not_skip():
+    entries, offsets = run(RolloutPlan(size=2, delay=0, jitter=0), targets("aaa"), failing={"10.0.0.3"})
+    assert len(offsets) == 2 and not any(entry.get("skipped") for entry in entries)
@@ -0,0 +1,157 @@
+import io
+import json
+
+import pytest
+
+from turnoff.inventory import (InventoryStore, evaluate_selector, export_inventory, import_inventory,
+                               iter_json_records, parse_selector)
+
+RECORDS = [
+    {"IP": "10.0.0.1", "OS": "Linux", "Description": "Aula [3]"},
+    {"IP": "10.0.0.2", "OS": "Windows", "Description": "llaves {}, comas, \"comillas\" y ]"},
+    {"IP": "10.0.0.3", "OS": "Linux", "Tags": ["a", "b]"]},
+]
+
+ARRAY_TEXTS = {
+    "compact": json.dumps(RECORDS),
+    "indented": json.dumps(RECORDS, indent=2),
+    "leading whitespace": "\n\n   " + json.dumps(RECORDS) + "\n",
+}
+
+JSONL_TEXT = "\n".join(json.dumps(record) for record in RECORDS) + "\n"
+
+def records(text, chunk_size):
+    return list(iter_json_records(io.StringIO(text), chunk_size))
+
+@pytest.mark.parametrize("name", sorted(ARRAY_TEXTS))
+def test_json_array_any_chunk_size(name):
+    text = ARRAY_TEXTS[name]
+    for chunk_size in range(1, len(text) + 2):
+        assert records(text, chunk_size) == list(enumerate(RECORDS, 1)), chunk_size
+
+def test_json_lines_any_chunk_size():
+    for chunk_size in range(1, len(JSONL_TEXT) + 2):
+        assert records(JSONL_TEXT, chunk_size) == list(enumerate(RECORDS, 1)), chunk_size
+
+def test_json_lines_keep_line_numbers():
+    text = "\n\n" + json.dumps(RECORDS[0]) + "\n\n{malo\n" + json.dumps(RECORDS[1])
+    for chunk_size in (1, 2, 7, 4096):
+        result = records(text, chunk_size)
+        assert [number for number, _ in result] == [3, 5, 6]
+        assert result[0][1] == RECORDS[0] and result[2][1] == RECORDS[1]
+        assert isinstance(result[1][1], ValueError)
+
+def test_json_array_numbers_are_not_split():
+    for chunk_size in range(1, 8):
+        assert records("[12345, 6]", chunk_size) == [(1, 12345), (2, 6)]
+
+@pytest.mark.parametrize("text", ['[{"IP": "10.0.0.1"}', '[{"IP": "10.0.0.1"', '[{"IP": ]'])
+def test_json_array_malformed(text):
+    for chunk_size in (1, 3, 4096):
+        with pytest.raises(ValueError):
+            records(text, chunk_size)
+
+@pytest.mark.parametrize("text", ["", "[]", "  [ ]  "])
+def test_json_empty(text):
+    for chunk_size in (1, 4096):
+        assert records(text, chunk_size) == []
+
+@pytest.fixture
+def store(tmp_path):
+    store = InventoryStore(str(tmp_path / "inventory.db"))
+    store.upsert_many([{"IP": "10.0.0.1", "OS": "Linux"}, {"IP": "10.0.0.2", "OS": "Windows"}])
+    store.update(store.get_by_ip("10.0.0.1")["id"], {"ssh_password": "secreto"})
+    return store
+
+def import_text(store, text, file_format="csv", replace=True):
+    return import_inventory(store, io.BytesIO(text.encode()), file_format, replace=replace)
+
+def test_replace_with_only_invalid_rows_keeps_inventory(store):
+    inserted, updated, errors = import_text(store, "IP;OS\n10.0.0.1;Linux\n")
+    assert (inserted, updated, len(errors)) == (0, 0, 2)
+    assert [computer["IP"] for computer in store.all()] == ["10.0.0.1", "10.0.0.2"]
+    assert store.get_by_ip("10.0.0.1")["ssh_password"] == "secreto"
+
+def test_replace_with_some_invalid_rows_changes_nothing(store):
+    inserted, updated, errors = import_text(store, "IP,OS\n10.0.0.9,Linux\n10.0.0.1,Solaris\n")
+    assert (inserted, updated) == (0, 0) and [error["Línea"] for error in errors] == [3]
+    assert [computer["IP"] for computer in store.all()] == ["10.0.0.1", "10.0.0.2"]
+
+@pytest.mark.parametrize("text, file_format", [("", "csv"), ("IP,OS\n", "csv"), ("[]", "json")])
+def test_replace_with_no_rows_is_refused(store, text, file_format):
+    with pytest.raises(ValueError, match="no se ha reemplazado"):
+        import_text(store, text, file_format)
+    assert len(store.all()) == 2
+
+def test_replace_keeps_credentials_of_listed_hosts(store):
+    assert import_text(store, "IP,OS,Group\n10.0.0.1,Linux,lab3\n10.0.0.3,Linux,lab3\n") == (1, 1, [])
+    assert [computer["IP"] for computer in store.all()] == ["10.0.0.1", "10.0.0.3"]
+    assert store.get_by_ip("10.0.0.1")["ssh_password"] == "secreto"
+
+def test_merge_imports_valid_rows_despite_errors(store):
+    inserted, updated, errors = import_text(store, "10.0.0.3,Linux\n10.0.0.300,Linux\n", replace=False)
+    assert (inserted, updated, len(errors)) == (1, 0, 1)
+    assert len(store.all()) == 3
+
+@pytest.mark.parametrize("file_format", ["csv", "json"])
+def test_export_in_chunks_round_trips(store, tmp_path, file_format):
+    import_text(store, "IP,OS,Description,Group,Tags\n" + "".join(
+        f'10.0.1.{number},Linux,"Aula ""{number}"", fila",lab,"a, b"\n' for number in range(1, 8)))
+    chunks = list(export_inventory(store, file_format, batch_size=3))
+    assert len(chunks) == 3
+    copy = InventoryStore(str(tmp_path / "copy.db"))
+    assert import_text(copy, "".join(chunks), file_format) == (7, 0, [])
+    assert [computer["Description"] for computer in copy.all()] == [c["Description"] for c in store.all()]
+
+@pytest.mark.parametrize("expression, tree", [
+    ("lab3", ("atom", "lab3")),
+    ("a b", ("and", ("atom", "a"), ("atom", "b"))),
+    ("a AND b OR c", ("or", ("and", ("atom", "a"), ("atom", "b")), ("atom", "c"))),
+    ("a or b and c", ("or", ("atom", "a"), ("and", ("atom", "b"), ("atom", "c")))),
+    ("NOT a AND b", ("and", ("not", ("atom", "a")), ("atom", "b"))),
+    ("NOT NOT a", ("not", ("not", ("atom", "a")))),
+    ("(a OR b) c", ("and", ("or", ("atom", "a"), ("atom", "b")), ("atom", "c"))),
+    ("NOT (group:x)", ("not", ("atom", "group:x"))),
+    ("ip:10.0.*", ("atom", "ip:10.0.*")),
+])
+def test_parse_selector(expression, tree):
+    assert parse_selector(expression) == tree
+
+@pytest.mark.parametrize("expression, error", [
+    ("", "vacía"),
+    ("   ", "vacía"),
+    ("NOT", "incompleta"),
+    ("a AND", "incompleta"),
+    ("a OR", "incompleta"),
+    ("(a", "Falta cerrar"),
+    ("((a) OR b", "Falta cerrar"),
+    ("a)", "Símbolo inesperado"),
+    ("()", "Operador inesperado"),
+    ("AND a", "Operador inesperado"),
+    ("a OR OR b", "Operador inesperado"),
+])
+def test_parse_selector_errors(expression, error):
+    with pytest.raises(ValueError, match=error):
+        parse_selector(expression)
+
+INDEX = {
+    "all": {1, 2, 3, 4},
+    "group": {"lab3": {1, 2}, "lab4": {3}},
+    "tag": {"server": {2, 4}},
+    "os": {"linux": {1, 2, 4}, "windows": {3}},
+    "ip": {"10.0.3.1": 1, "10.0.3.2": 2, "10.0.4.1": 3, "10.0.9.9": 4},
+}
+
+@pytest.mark.parametrize("expression, ids", [
+    ("*", {1, 2, 3, 4}),
+    ("lab3", {1, 2}),
+    ("LINUX", {1, 2, 4}),
+    ("group:lab3 AND NOT server", {1}),
+    ("tag:server OR os:windows", {2, 3, 4}),
+    ("ip:10.0.3.*", {1, 2}),
+    ("NOT (lab3 OR lab4)", {4}),
+    ("group:server", set()),
+    ("nada", set()),
+])
+def test_evaluate_selector(expression, ids):
+    assert evaluate_selector(parse_selector(expression), INDEX) == ids
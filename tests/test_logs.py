@@ -0,0 +1,97 @@
+import json
+import os
+from datetime import timedelta
+
+from turnoff.logs import ActivityLog, log_entry
+
+def entries(count, start=0):
+    return [log_entry(number % 2 == 0, f"10.0.0.{number}", "Linux", f"equipo {number}") for number in range(start, start + count)]
+
+def messages(log, **filters):
+    return [entry["message"] for entry in log.query(limit=100, **filters)[1]]
+
+def test_ring_buffer_keeps_newest(tmp_path):
+    log = ActivityLog(str(tmp_path), capacity=3)
+    log.extend(entries(5))
+    total, page = log.query()
+    assert total == 3 and [entry["message"] for entry in page] == ["equipo 4", "equipo 3", "equipo 2"]
+    # El diario conserva todo aunque el búfer esté lleno
+    with open(log.path) as file:
+        assert len(file.readlines()) == 5
+
+def test_query_filters_and_pages(tmp_path):
+    log = ActivityLog(str(tmp_path))
+    log.extend(entries(6))
+    skipped = dict(log_entry(False, "10.0.1.1", "Linux", "omitido"), skipped=True)
+    log.append(skipped)
+    assert messages(log, status="success") == ["equipo 4", "equipo 2", "equipo 0"]
+    assert messages(log, status="error") == ["equipo 5", "equipo 3", "equipo 1"]
+    assert messages(log, status="skipped") == ["omitido"]
+    assert messages(log, host="10.0.1.") == ["omitido"]
+    total, page = log.query(offset=2, limit=2)
+    assert total == 7 and [entry["message"] for entry in page] == ["equipo 4", "equipo 3"]
+    ts = log.query(limit=7)[1][3]["ts"]
+    assert all(entry["ts"] >= ts for entry in log.query(since=ts, limit=100)[1])
+
+def test_rotates_by_size_and_keeps_backups(tmp_path):
+    log = ActivityLog(str(tmp_path), max_bytes=400, backups=2)
+    log.extend(entries(30))
+    files = log.journal_files()
+    assert [os.path.basename(path) for path in files] == ["activity.jsonl", "activity.jsonl.1", "activity.jsonl.2"]
+    assert all(os.path.getsize(path) < 400 + 200 for path in files)
+    # Lo más reciente está en el archivo actual y lo más antiguo se ha descartado
+    with open(files[0]) as file:
+        assert json.loads(file.readlines()[-1])["message"] == "equipo 29"
+    assert len(log.query()[1]) == 30
+
+def test_rotates_when_the_day_changes(tmp_path):
+    log = ActivityLog(str(tmp_path))
+    log.extend(entries(2))
+    log._day -= timedelta(days=1)
+    log.extend(entries(1, start=2))
+    assert len(log.journal_files()) == 2
+    with open(log.path) as file:
+        assert [json.loads(line)["message"] for line in file] == ["equipo 2"]
+
+def test_restart_refills_from_journal_tail(tmp_path):
+    log = ActivityLog(str(tmp_path))
+    log.extend(entries(5))
+    with open(log.path, "a") as file:
+        file.write('{"truncado": ')  # Parada brusca a mitad de línea
+    restarted = ActivityLog(str(tmp_path), capacity=3)
+    total, page = restarted.query()
+    assert total == 3 and [entry["message"] for entry in page] == ["equipo 4", "equipo 3", "equipo 2"]
+
+def test_entry_after_truncated_line_is_kept(tmp_path):
+    log = ActivityLog(str(tmp_path))
+    log.extend(entries(1))
+    with open(log.path, "a") as file:
+        file.write('{"truncado": ')
+    ActivityLog(str(tmp_path)).extend(entries(1, start=1))
+    assert messages(ActivityLog(str(tmp_path))) == ["equipo 1", "equipo 0"]
+
+def test_sees_entries_from_other_processes(tmp_path):
+    web, cli = ActivityLog(str(tmp_path)), ActivityLog(str(tmp_path))
+    web.extend(entries(1))
+    cli.extend(entries(2, start=1))
+    cli.update(cli.query()[1][0]["id"], confirmation="up")
+    assert messages(web) == ["equipo 2", "equipo 1", "equipo 0"]
+    assert messages(web, status="still_up") == ["equipo 2"]
+
+def test_follows_rotation_by_another_process(tmp_path):
+    # El diario nuevo mide lo mismo que lo ya leído del anterior: el tamaño no delata la rotación
+    web, cli = ActivityLog(str(tmp_path)), ActivityLog(str(tmp_path), max_bytes=1)
+    web.extend(entries(1))
+    cli.extend(entries(2, start=1))
+    web.extend(entries(1, start=3))
+    assert messages(web) == ["equipo 3", "equipo 2", "equipo 1", "equipo 0"]
+    assert messages(cli) == ["equipo 3", "equipo 2", "equipo 1", "equipo 0"]
+    with open(web.path) as file:
+        assert [json.loads(line)["message"] for line in file] == ["equipo 2", "equipo 3"]
+
+def test_follows_several_rotations_between_reads(tmp_path):
+    web, cli = ActivityLog(str(tmp_path)), ActivityLog(str(tmp_path), max_bytes=1)
+    web.extend(entries(1))
+    cli.extend(entries(4, start=1))
+    assert len(cli.journal_files()) == 5
+    assert messages(web) == ["equipo 4", "equipo 3", "equipo 2", "equipo 1", "equipo 0"]
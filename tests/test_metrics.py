@@ -0,0 +1,110 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from turnoff.metrics import LATENCY_BUCKETS, LatencyMetrics, command_phase, percentile
+
+def trace(ip, total_ms, operation="immediate_shutdown", **phases):
+    return {"ip": ip, "timings": dict({"operation": operation, "total_ms": total_ms}, **phases)}
+
+def series(text, name):
+    """{labels: value} of one metric in Prometheus text format"""
+    values = {}
+    for line in text.splitlines():
+        if line.startswith(name + "{"):
+            labels, value = line[len(name) + 1:].rsplit("} ", 1)
+            values[labels] = float(value)
+    return values
+
+@pytest.mark.parametrize("samples, fraction, expected", [
+    ([], 0.5, None),
+    ([7], 0.99, 7),
+    ([1, 2, 3, 4], 0.5, 2),
+    ([1, 2, 3, 4], 0.95, 4),
+    (list(range(1, 101)), 0.99, 99),
+])
+def test_percentile(samples, fraction, expected):
+    assert percentile(samples, fraction) == expected
+
+@pytest.mark.parametrize("label, phase", [
+    ("whoami", "whoami"),
+    ("sudo shutdown -c", "cancel"),
+    ("shutdown /a", "cancel"),
+    ("sudo shutdown -h +5", "shutdown"),
+])
+def test_command_phase(label, phase):
+    assert command_phase(label) == phase
+
+def test_prometheus_histogram():
+    metrics = LatencyMetrics()
+    for value in (3, 40, 40, 700, 500000):
+        metrics.observe("cancel", "connect", value)
+    text = metrics.prometheus()
+    assert "# TYPE turnoff_phase_duration_seconds histogram" in text
+    buckets = series(text, "turnoff_phase_duration_seconds_bucket")
+    labels = 'operation="cancel",phase="connect"'
+    counts = [buckets[f'{labels},le="{bound / 1000:g}"'] for bound in LATENCY_BUCKETS]
+    assert counts == sorted(counts)  # Acumulativos
+    assert buckets[f'{labels},le="0.005"'] == 1
+    assert buckets[f'{labels},le="0.05"'] == 3
+    assert buckets[f'{labels},le="1"'] == 4
+    assert buckets[f'{labels},le="300"'] == 4
+    assert buckets[f'{labels},le="+Inf"'] == 5
+    assert series(text, "turnoff_phase_duration_seconds_count") == {labels: 5}
+    assert series(text, "turnoff_phase_duration_seconds_sum") == {labels: pytest.approx(500.783)}
+    assert text.endswith("\n")
+
+def test_prometheus_last_batch_gauges():
+    metrics = LatencyMetrics()
+    metrics.observe_batch("immediate_shutdown", hosts=10, succeeded=7, wall_ms=2500)
+    metrics.observe_batch("immediate_shutdown", hosts=4, succeeded=4, wall_ms=800)
+    text = metrics.prometheus()
+    assert series(text, "turnoff_last_batch_seconds") == {'operation="immediate_shutdown"': 0.8}
+    assert series(text, "turnoff_last_batch_failed_hosts") == {'operation="immediate_shutdown"': 0}
+    assert series(text, "turnoff_phase_duration_seconds_count") == {'operation="immediate_shutdown",phase="batch"': 2}
+
+def test_observe_entry_records_every_phase():
+    metrics = LatencyMetrics()
+    metrics.observe_entry(trace("10.0.0.1", 95, connect_ms=3, auth_ms=40,
+                                commands=[{"command": "whoami", "exec_ms": 10},
+                                          {"command": "sudo shutdown -h now", "exec_ms": 20}]))
+    metrics.observe_entry({"ip": "10.0.0.2", "timings": {"total_ms": 5}})  # Sin operación: se ignora
+    rows = {(row["Operación"], row["Fase"]): row["Muestras"] for row in metrics.summary()}
+    assert rows == {("immediate_shutdown", phase): 1 for phase in ("connect", "auth", "whoami", "shutdown", "total")}
+
+def test_slowest_hosts_are_bounded():
+    metrics = LatencyMetrics(host_window=2, max_hosts=2)
+    for ip, total in (("10.0.0.1", 10), ("10.0.0.1", 20), ("10.0.0.1", 900), ("10.0.0.2", 50), ("10.0.0.3", 5)):
+        metrics.observe_entry(trace(ip, total))
+    rows = metrics.slowest_hosts()
+    assert [row["Equipo"] for row in rows] == ["10.0.0.2", "10.0.0.3"]
+    metrics.observe_entry(trace("10.0.0.3", 1000))
+    assert metrics.slowest_hosts(limit=1)[0] == {"Equipo": "10.0.0.3", "Operaciones": 2, "p50 (ms)": 5,
+                                                 "p95 (ms)": 1000, "Máx (ms)": 1000}
+    # Los equipos no se exportan a Prometheus
+    assert "10.0.0.3" not in metrics.prometheus()
+
+def test_flush_writes_textfile(tmp_path):
+    path = tmp_path / "metrics.prom"
+    metrics = LatencyMetrics(path=str(path))
+    metrics.observe("wake", "total", 12)
+    metrics.flush()
+    assert path.read_text() == metrics.prometheus()
+    assert not (tmp_path / "metrics.prom.tmp").exists()
+
+def test_serve_metrics_over_http():
+    metrics = LatencyMetrics()
+    metrics.observe("wake", "total", 12)
+    server = metrics.serve(0, host="127.0.0.1")
+    try:
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{base}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert response.read().decode() == metrics.prometheus()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{base}/otra")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
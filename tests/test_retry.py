@@ -0,0 +1,107 @@
+import pytest
+
+from turnoff.logs import log_entry
+from turnoff.retry import CircuitBreaker, RetryPolicy, RetryRun
+
+class Clock:
+    """Stand-in for time.time() that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("turnoff.retry.time.time", clock)
+    return clock
+
+def failed(failure, ip="10.0.0.1"):
+    return dict(log_entry(False, ip, "Linux", "Error"), timings={"failure": failure})
+
+@pytest.mark.parametrize("failure, retry, expected", [
+    ("connect", 1, 2.0),
+    ("connect", 2, 4.0),
+    ("connect", 3, None),
+    ("auth", 1, 10.0),
+    ("command", 1, 5.0),
+    ("command", 2, None),
+    ("hostkey", 1, None),
+    (None, 1, None),
+])
+def test_backoff_without_jitter(failure, retry, expected):
+    assert RetryPolicy(jitter=0).delay(failure, retry) == expected
+
+def test_backoff_is_capped():
+    policy = RetryPolicy(jitter=0, connect_retries=10, max_delay=30)
+    assert [policy.delay("connect", retry) for retry in range(1, 7)] == [2, 4, 8, 16, 30, 30]
+
+def test_jitter_only_shortens_the_wait():
+    policy = RetryPolicy(jitter=0.5, connect_retries=3)
+    delays = [policy.delay("connect", 3) for _ in range(200)]
+    assert all(4.0 <= delay <= 8.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+def test_settings_file_and_overrides(tmp_path):
+    RetryPolicy(str(tmp_path)).save(connect_retries=5)
+    assert RetryPolicy(str(tmp_path)).settings["connect_retries"] == 5
+    assert RetryPolicy(str(tmp_path), connect_retries=0).delay("connect", 1) is None
+
+def test_breaker_opens_after_consecutive_connect_failures(clock):
+    breaker = CircuitBreaker()
+    assert [breaker.record("10.0.0.1", "connect", 3) for _ in range(3)] == [False, False, True]
+    allowed, state = breaker.allow("10.0.0.1", cooldown=600)
+    assert not allowed and state["failures"] == 3
+    assert breaker.open_circuits(600) == [("10.0.0.1", 3, clock.now + 600)]
+    assert breaker.allow("10.0.0.2", cooldown=600) == (True, None)
+
+def test_breaker_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker()
+    for _ in range(3):
+        breaker.record("10.0.0.1", "connect", 3)
+    clock.now += 601
+    assert breaker.allow("10.0.0.1", cooldown=600)[0]
+    assert not breaker.allow("10.0.0.1", cooldown=600)[0]  # Solo una prueba
+    # La prueba falla: otro periodo completo cerrado
+    assert breaker.record("10.0.0.1", "connect", 3)
+    clock.now += 599
+    assert not breaker.allow("10.0.0.1", cooldown=600)[0]
+    clock.now += 2
+    assert breaker.allow("10.0.0.1", cooldown=600)[0]
+    # Cualquier respuesta del equipo cierra el circuito
+    assert not breaker.record("10.0.0.1", "auth", 3)
+    assert breaker.allow("10.0.0.1", cooldown=600) == (True, None)
+    assert breaker.open_circuits(600) == []
+
+def test_success_resets_the_count(clock):
+    breaker = CircuitBreaker()
+    breaker.record("10.0.0.1", "connect", 3)
+    breaker.record("10.0.0.1", "connect", 3)
+    breaker.record("10.0.0.1", None, 3)
+    assert not breaker.record("10.0.0.1", "connect", 3)
+
+def test_retry_run_plans_until_retries_run_out(clock):
+    run = RetryRun(RetryPolicy(jitter=0), CircuitBreaker())
+    target = {"IP": "10.0.0.1", "OS": "Linux"}
+    assert run.after(target, failed("auth")) == 10.0
+    last = failed("auth")
+    assert run.after(target, last) is None
+    assert last["message"] == "Error (2 intentos)" and last["timings"]["attempts"] == 2
+    assert run.after({"IP": "10.0.0.2", "OS": "Linux"}, failed("hostkey", "10.0.0.2")) is None
+
+def test_retry_run_stops_when_the_circuit_opens(clock):
+    run = RetryRun(RetryPolicy(jitter=0, connect_retries=5, breaker_threshold=2), CircuitBreaker())
+    target = {"IP": "10.0.0.1", "OS": "Linux"}
+    assert run.after(target, failed("connect")) == 2.0
+    assert run.after(target, failed("connect")) is None
+    allowed, skipped = run.admit([target, {"IP": "10.0.0.2", "OS": "Linux"}])
+    assert [t["IP"] for t in allowed] == ["10.0.0.2"]
+    assert skipped[0]["skipped"] and skipped[0]["message"].startswith("Omitido: 2 fallos de conexión seguidos")
+
+def test_retry_run_respects_the_deadline(clock):
+    run = RetryRun(RetryPolicy(jitter=0), CircuitBreaker(), total_timeout=3)
+    target = {"IP": "10.0.0.1", "OS": "Linux"}
+    assert run.after(target, failed("connect")) == 2.0
+    assert run.after(target, failed("connect")) is None  # 4 s más allá del límite
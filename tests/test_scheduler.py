@@ -0,0 +1,118 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from turnoff.scheduler import JobStore, ShutdownScheduler, next_occurrence
+
+AT = datetime(2026, 10, 17, 22, 0).time()
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "scheduled_jobs.json"))
+
+class Recorder(ShutdownScheduler):
+    """Scheduler that records the jobs it would dispatch instead of running them"""
+
+    def __init__(self, store, **options):
+        super().__init__(store, inventory=None, **options)
+        self.dispatched = []
+
+    def _dispatch(self, job):
+        self.dispatched.append(job["name"])
+
+def make_due(store, name, seconds_late=1):
+    with store.change() as jobs:
+        job = next(job for job in jobs.values() if job["name"] == name)
+        job["next_run"] = (datetime.now() - timedelta(seconds=seconds_late)).isoformat()
+
+def add(store, name, days=None):
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    return store.add_job(name, [{"IP": "10.0.0.1", "OS": "Linux"}], AT, days=days, run_date=tomorrow)
+
+@pytest.mark.parametrize("after, days, expected", [
+    (datetime(2026, 10, 16, 21, 0), [4], datetime(2026, 10, 16, 22, 0)),  # viernes, antes de la hora
+    (datetime(2026, 10, 16, 22, 0), [4], datetime(2026, 10, 23, 22, 0)),  # justo a la hora: la semana siguiente
+    (datetime(2026, 10, 16, 23, 0), [0, 4], datetime(2026, 10, 19, 22, 0)),
+    (datetime(2026, 10, 16, 23, 0), [], None),
+])
+def test_next_occurrence(after, days, expected):
+    assert next_occurrence(AT, days, after) == expected
+
+def test_store_is_shared_between_instances(store):
+    job = add(store, "noche", days=[0, 1, 2])
+    other = JobStore(store.path)
+    assert [j["name"] for j in other.jobs()] == ["noche"]
+    other.run_now(job["id"])
+    assert store.load()[job["id"]]["run_requested"]
+    store.remove_job(job["id"])
+    assert other.jobs() == []
+
+def test_add_job_in_the_past_is_rejected(store):
+    with pytest.raises(ValueError, match="pasado"):
+        store.add_job("ayer", [], AT, run_date=datetime.now().date() - timedelta(days=1))
+
+def test_due_jobs_run_once_and_advance(store):
+    add(store, "una vez")
+    add(store, "recurrente", days=list(range(7)))
+    add(store, "mañana")
+    scheduler = Recorder(store)
+    assert scheduler.run_pending() > 0 and scheduler.dispatched == []
+    make_due(store, "una vez")
+    make_due(store, "recurrente")
+    scheduler.run_pending()
+    scheduler.run_pending()
+    assert sorted(scheduler.dispatched) == ["recurrente", "una vez"]
+    jobs = {job["name"]: job for job in store.jobs()}
+    assert not jobs["una vez"]["enabled"] and jobs["una vez"]["next_run"] is None
+    assert datetime.fromisoformat(jobs["recurrente"]["next_run"]) > datetime.now()
+    assert jobs["mañana"]["enabled"]
+
+def test_two_services_never_run_a_job_twice(store):
+    add(store, "noche")
+    first, second = Recorder(store), Recorder(JobStore(store.path))
+    first.run_pending()
+    second.run_pending()
+    make_due(store, "noche")
+    first.run_pending()
+    second.run_pending()
+    assert first.dispatched + second.dispatched == ["noche"]
+
+def test_missed_runs_are_skipped(store):
+    add(store, "una vez")
+    add(store, "recurrente", days=list(range(7)))
+    make_due(store, "una vez", seconds_late=3600)
+    make_due(store, "recurrente", seconds_late=3600)
+    scheduler = Recorder(store, misfire_grace=600)
+    scheduler.run_pending()
+    assert scheduler.dispatched == []
+    jobs = {job["name"]: job for job in store.jobs()}
+    assert jobs["una vez"]["last_result"] == "No ejecutada (planificador detenido)"
+    assert not jobs["una vez"]["enabled"]
+    assert datetime.fromisoformat(jobs["recurrente"]["next_run"]) > datetime.now()
+
+def test_run_now_is_picked_up_once(store):
+    job = add(store, "manual")
+    scheduler = Recorder(store)
+    scheduler.run_pending()
+    JobStore(store.path).run_now(job["id"])
+    scheduler.run_pending()
+    scheduler.run_pending()
+    assert scheduler.dispatched == ["manual"]
+    assert "run_requested" not in store.load()[job["id"]]
+    assert store.load()[job["id"]]["enabled"]
+
+def test_removed_job_does_not_run(store):
+    job = add(store, "borrada")
+    scheduler = Recorder(store)
+    scheduler.run_pending()
+    make_due(store, "borrada")
+    store.remove_job(job["id"])
+    scheduler.run_pending()
+    assert scheduler.dispatched == []
+
+def test_heartbeat(store):
+    assert store.service_status() is None
+    store.beat()
+    assert store.service_status()["ts"] == pytest.approx(time.time(), abs=5)
+    assert store.service_status(max_age=-1) is None
@@ -0,0 +1,82 @@
+import pytest
+
+from turnoff.logs import ActivityLog, log_entry
+from turnoff.verify import ShutdownVerifier
+
+class Network:
+    """Fake SSH probes on a fake clock: each host answers while its uptime lasts"""
+
+    def __init__(self, monkeypatch, uptime):
+        self.uptime = uptime  # ip -> segundos que sigue respondiendo (None: no se apaga)
+        self.now = 0.0
+        self.rounds = 0
+        monkeypatch.setattr("turnoff.verify.time.monotonic", lambda: self.now)
+        monkeypatch.setattr("turnoff.verify.time.sleep", self.sleep)
+        monkeypatch.setattr("turnoff.verify.scan_hosts", self.scan_hosts)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def scan_hosts(self, hosts, port, timeout, concurrency):
+        self.rounds += 1
+        for host in hosts:
+            uptime = self.uptime[host]
+            yield host, uptime is None or self.now < uptime, 1.0, None
+
+def sent(ip, message="Apagado enviado"):
+    return dict(log_entry(True, ip, "Linux", message), confirmation="sent")
+
+def test_probe_outcomes(monkeypatch):
+    network = Network(monkeypatch, {"10.0.0.1": 0, "10.0.0.2": 12, "10.0.0.3": None})
+    verifier = ShutdownVerifier(grace=5, interval=5, deadline=30, misses=2)
+    outcomes = list(verifier.probe_until_off(["10.0.0.1", "10.0.0.2", "10.0.0.3"]))
+    # Dos sondeos fallidos seguidos: 5 y 10 s para el primero, 15 y 20 s para el segundo
+    assert outcomes == [("10.0.0.1", True, 10), ("10.0.0.2", True, 20), ("10.0.0.3", False, 30)]
+    assert network.rounds == 6
+
+def test_a_single_missed_probe_is_not_enough(monkeypatch):
+    answers = iter([False, True, False, False])
+    Network(monkeypatch, {})
+    monkeypatch.setattr("turnoff.verify.scan_hosts",
+                        lambda hosts, *args: [(host, next(answers), 1.0, None) for host in hosts])
+    verifier = ShutdownVerifier(grace=0, interval=1, deadline=60, misses=2)
+    assert list(verifier.probe_until_off(["10.0.0.1"])) == [("10.0.0.1", True, 3)]
+
+def test_confirm_updates_entries_and_log(monkeypatch, tmp_path):
+    Network(monkeypatch, {"10.0.0.1": 0, "10.0.0.2": None})
+    log = ActivityLog(str(tmp_path))
+    entries = [sent("10.0.0.1"), sent("10.0.0.2"), log_entry(False, "10.0.0.3", "Linux", "Error")]
+    log.extend(entries)
+    verifier = ShutdownVerifier(activity_log=log, grace=0, interval=5, deadline=20, misses=1)
+    confirmed = verifier.confirm(entries)
+    assert [entry["ip"] for entry in confirmed] == ["10.0.0.1", "10.0.0.2"]
+    off, up = confirmed
+    assert off["confirmation"] == "off" and off["success"]
+    assert off["message"] == "Apagado enviado · apagado confirmado a los 0 s"
+    assert up["confirmation"] == "up" and not up["success"] and up["confirmation_s"] == 20
+    assert "sigue encendido tras 20 s" in up["message"]
+    # El cambio está en el diario: otra instancia lo ve al releerlo
+    reloaded = {entry["ip"]: entry for entry in ActivityLog(str(tmp_path)).query()[1]}
+    assert reloaded["10.0.0.1"]["confirmation"] == "off" and reloaded["10.0.0.2"]["confirmation"] == "up"
+    assert "confirmation" not in reloaded["10.0.0.3"]
+    assert verifier.stragglers(since=0) == ["10.0.0.2"]
+    assert verifier.pending() == []
+
+def test_nothing_to_confirm(monkeypatch):
+    network = Network(monkeypatch, {})
+    verifier = ShutdownVerifier()
+    assert verifier.confirm([log_entry(True, "10.0.0.1", "Linux", "Cancelado")]) == []
+    assert verifier.watch([log_entry(True, "10.0.0.1", "Linux", "Cancelado")]) == 0
+    assert ShutdownVerifier(enabled=False).watch([sent("10.0.0.1")]) == 0
+    assert network.rounds == 0
+
+@pytest.mark.parametrize("confirmations, expected", [
+    (["up"], ["10.0.0.1"]),
+    (["up", "off"], []),  # Un apagado posterior confirmado
+    (["off", "up"], ["10.0.0.1"]),
+])
+def test_stragglers_use_the_latest_verification(tmp_path, confirmations, expected):
+    log = ActivityLog(str(tmp_path))
+    for confirmation in confirmations:
+        log.append(dict(sent("10.0.0.1"), confirmation=confirmation))
+    assert ShutdownVerifier(activity_log=log).stragglers(since=0) == expected
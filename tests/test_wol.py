@@ -0,0 +1,57 @@
+import socket
+
+import pytest
+
+from turnoff.wol import WakeOnLan
+
+MAC = "aa:bb:cc:dd:ee:01"
+
+@pytest.fixture
+def wol(tmp_path):
+    return WakeOnLan(str(tmp_path))
+
+@pytest.mark.parametrize("mac", ["aa:bb:cc:dd:ee:01", "AA-BB-CC-DD-EE-01", "aabb.ccdd.ee01", " aabbccddee01 "])
+def test_magic_packet_layout(mac):
+    packet = WakeOnLan.magic_packet(mac)
+    assert len(packet) == 102
+    assert packet[:6] == b"\xff" * 6
+    assert [packet[start:start + 6] for start in range(6, 102, 6)] == [bytes.fromhex("aabbccddee01")] * 16
+
+@pytest.mark.parametrize("mac", ["", "aa:bb:cc:dd:ee", "aa:bb:cc:dd:ee:zz"])
+def test_magic_packet_rejects_bad_mac(mac):
+    with pytest.raises(ValueError):
+        WakeOnLan.magic_packet(mac)
+
+def test_destinations(wol, tmp_path):
+    assert wol.destinations("10.0.3.7") == ["255.255.255.255"]
+    wol.save(directed=True, prefix=22)
+    assert wol.destinations("10.0.3.7") == ["255.255.255.255", "10.0.3.255"]
+    assert wol.destinations("10.0.5.7") == ["255.255.255.255", "10.0.7.255"]
+    assert wol.destinations("pc-01") == ["255.255.255.255"]
+    assert WakeOnLan(str(tmp_path)).settings["prefix"] == 22  # Guardado en wol.json
+
+def test_waves(wol):
+    wol.save(wave_size=2)
+    assert wol.waves([1, 2, 3, 4, 5]) == [[1, 2], [3, 4], [5]]
+
+def test_wake_sends_packets_in_waves(wol, monkeypatch):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(2)
+    waits = []
+    monkeypatch.setattr("turnoff.wol.time.sleep", waits.append)
+    wol.save(broadcast="127.0.0.1", port=receiver.getsockname()[1], repeats=2, wave_size=1, wave_delay=30,
+             rate=1000000)
+    targets = [{"IP": "10.0.0.1", "OS": "Linux", "MAC": MAC},
+               {"IP": "10.0.0.2", "OS": "Windows", "MAC": ""},
+               {"IP": "10.0.0.3", "OS": "Linux", "MAC": "aa:bb:cc:dd:ee:03"}]
+    try:
+        entries = list(wol.wake(targets))
+        packets = [receiver.recv(200) for _ in range(4)]
+    finally:
+        receiver.close()
+    assert [(entry["ip"], entry["success"]) for entry in entries] == [
+        ("10.0.0.2", False), ("10.0.0.1", True), ("10.0.0.3", True)]
+    assert "oleada 2/2" in entries[2]["message"] and entries[2]["timings"]["transport"] == "wol"
+    assert packets == [WakeOnLan.magic_packet(MAC)] * 2 + [WakeOnLan.magic_packet("aa:bb:cc:dd:ee:03")] * 2
+    assert 30 in waits  # Pausa entre oleadas
@@ -0,0 +1,19 @@
+"""Remote shutdown and power-on of computer fleets over SSH, a UDP agent and Wake-on-LAN
+
+The Python API lives in turnoff.api; its functions are also available here and are
+imported on first use, so `import turnoff` (and the CLI) start without loading SSH.
+
+    import turnoff
+    result = turnoff.shutdown("lab-3 AND linux", parallel=64)
+    print(result.as_dict())
+"""
+
+__version__ = "0.2.0"
+
+API = ("OperationResult", "RolloutPlan", "RetryPolicy", "select", "shutdown", "cancel", "reschedule", "wake", "status")
+
+def __getattr__(name):
+    if name in API:
+        from . import api
+        return getattr(api, name)
+    raise AttributeError(f"module 'turnoff' has no attribute {name!r}")
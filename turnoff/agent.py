@@ -0,0 +1,190 @@
+"""Client for the optional signed UDP agent installed by setup-remote.sh"""
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import selectors
+import socket
+import time
+from functools import lru_cache
+
+from .config import DATA_DIR
+from .logs import log_entry
+from .metrics import elapsed_ms, get_metrics
+
+class AgentClient:
+    """Client for the optional UDP agent that setup-remote.sh installs on Linux hosts
+
+    Every request is one datagram {"body", "sig"} where `sig` is the HMAC-SHA256 of
+    `body` with the fleet's shared key; the body carries the action, the destination
+    address, a timestamp and a nonce, so the agent rejects forged, stale and replayed
+    messages as well as messages signed for another host. Replies are
+    signed the same way. One socket sends to the whole fleet and collects the
+    acknowledgements; hosts that do not answer are left for the SSH path.
+    The key and settings live in data/agent.key and data/agent.json.
+    """
+
+    def __init__(self, directory, port=47474):
+        self.key_path = os.path.join(directory, "agent.key")
+        self.settings_path = os.path.join(directory, "agent.json")
+        self.settings = {"enabled": False, "port": port}
+        if os.path.exists(self.settings_path):
+            with open(self.settings_path) as f:
+                self.settings.update(json.load(f))
+        if not os.path.exists(self.key_path):
+            self.regenerate_key()
+        with open(self.key_path) as f:
+            self.key = f.read().strip()
+
+    @property
+    def enabled(self):
+        return self.settings["enabled"]
+
+    def save(self, **changes):
+        self.settings.update(changes)
+        with open(self.settings_path, "w") as f:
+            json.dump(self.settings, f, indent=2)
+
+    def regenerate_key(self):
+        """Create a new shared key; hosts must be set up again with it"""
+        self.key = secrets.token_hex(32)
+        with open(os.open(self.key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write(self.key)
+
+    def _sign(self, body):
+        return hmac.new(self.key.encode(), body.encode(), hashlib.sha256).hexdigest()
+
+    def _packet(self, message):
+        body = json.dumps(message)
+        return json.dumps({"body": body, "sig": self._sign(body)}).encode()
+
+    def _reply(self, data):
+        """Verified reply body, or None for anything not signed with our key"""
+        try:
+            packet = json.loads(data)
+            if not hmac.compare_digest(self._sign(packet["body"]), packet["sig"]):
+                return None
+            return json.loads(packet["body"])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def send(self, hosts, action, minutes=None, timeout=0.3, retries=2):
+        """Send `action` to every host and return {ip: reply} for those that acknowledged
+
+        Each reply has "ok", "detail", "rtt_ms" and any extra fields the action returns
+        (uptime, load, pending for "status"). Unanswered hosts get the same nonce again
+        up to `retries` times; the agent answers duplicates from its reply cache
+        instead of running the action twice.
+        """
+        port = self.settings["port"]
+        pending = {}
+        for ip in hosts:
+            address = resolve(ip)
+            if address is None:
+                continue  # Se queda para el camino SSH
+            # El destino va firmado: la orden capturada no sirve para apagar otro equipo
+            message = {"action": action, "to": address, "ts": time.time(), "nonce": secrets.token_hex(12)}
+            if minutes is not None:
+                message["minutes"] = int(minutes)
+            pending[ip] = (message["nonce"], address, self._packet(message))
+        # Las respuestas se asocian por nonce: un equipo con varias interfaces puede
+        # contestar desde una dirección distinta de la que se usó para enviarle
+        by_nonce = {nonce: ip for ip, (nonce, _, _) in pending.items()}
+        replies = {}
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Miles de respuestas llegan casi a la vez: búfer de recepción amplio
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        sock.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        try:
+            for attempt in range(retries + 1):
+                if not pending:
+                    break
+                sent_at = {}
+                for ip, (_, address, packet) in list(pending.items()):
+                    while True:
+                        try:
+                            sock.sendto(packet, (address, port))
+                            break
+                        except BlockingIOError:
+                            # Búfer de envío lleno: esperar a que se vacíe
+                            select_write = selectors.DefaultSelector()
+                            select_write.register(sock, selectors.EVENT_WRITE)
+                            select_write.select(timeout)
+                            select_write.close()
+                        except OSError:
+                            break
+                    sent_at[ip] = time.perf_counter()
+                # Cada reintento espera más: un equipo ocupado también responde tarde
+                deadline = time.monotonic() + timeout * (attempt + 1)
+                while pending and time.monotonic() < deadline:
+                    if not selector.select(max(0, deadline - time.monotonic())):
+                        continue
+                    while True:
+                        try:
+                            data, _ = sock.recvfrom(65536)
+                        except (BlockingIOError, ConnectionRefusedError):
+                            break
+                        reply = self._reply(data)
+                        ip = by_nonce.get(reply.get("nonce")) if reply else None
+                        if ip in pending:
+                            reply["rtt_ms"] = elapsed_ms(sent_at[ip])
+                            replies[ip] = reply
+                            del pending[ip]
+        finally:
+            selector.close()
+            sock.close()
+        return replies
+
+def resolve(host):
+    """IPv4 address of an inventory host (IP or hostname), None if it does not resolve"""
+    try:
+        return str(ipaddress.IPv4Address(host))
+    except ValueError:
+        pass
+    try:
+        return socket.gethostbyname(host)
+    except OSError:
+        return None
+
+@lru_cache(maxsize=None)
+def get_agent_client():
+    """Shared remote agent client"""
+    return AgentClient(DATA_DIR)
+
+AGENT_MESSAGES = {
+    "shutdown": "Comando de apagado enviado con éxito (agente)",
+    "schedule": "Apagado programado (agente)",
+    "cancel": "Apagado pendiente cancelado (agente)"
+}
+
+def agent_stage(targets, action, operation, minutes=None):
+    """Deliver `action` through the remote agent to the Linux targets that run it
+
+    Returns (entries, remaining): log entries for the hosts that answered and the
+    targets that still need the SSH path (no agent, Windows, or a failed action).
+    """
+    linux = [target for target in targets if target["OS"] == "Linux"]
+    started = time.perf_counter()
+    replies = get_agent_client().send([target["IP"].strip() for target in linux], action, minutes) if linux else {}
+    if linux:
+        get_metrics().observe(operation, "agent_batch", elapsed_ms(started))
+    entries, remaining = [], []
+    for target in targets:
+        ip = target["IP"].strip()
+        reply = replies.get(ip)
+        if not reply or not reply.get("ok"):
+            remaining.append(target)
+            continue
+        timings = {"operation": operation, "transport": "agent", "agent_ms": reply["rtt_ms"],
+                   "total_ms": reply["rtt_ms"]}
+        entry = log_entry(True, ip, target["OS"], AGENT_MESSAGES.get(action, reply.get("detail", "")),
+                          timings=timings)
+        if action == "shutdown":
+            entry["confirmation"] = "sent"  # Pendiente de turnoff.verify
+        get_metrics().observe_entry(entry)
+        entries.append(entry)
+    return entries, remaining
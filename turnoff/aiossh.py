@@ -0,0 +1,342 @@
+"""asyncio SSH backend built on asyncssh: thousands of sessions on one event loop
+
+schedule_shutdown() and cancel_shutdown() run the step sequences of turnoff.power
+(same arguments, same (success, message) results and traces) as coroutines through an
+AsyncSession, and run_tasks() drives a
+coroutine task over a whole fleet from synchronous code. Connections are pooled for the
+duration of one run_tasks() call only. asyncssh is optional: `pip install turnoff[async]`.
+"""
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import os
+import queue
+import threading
+import time
+
+import asyncssh
+
+from .config import SSH_PORT
+from .logs import log_entry
+from .metrics import elapsed_ms
+from .power import UNCONFIRMED, cancel_steps, schedule_steps
+from .ssh import MAX_OUTPUT, CommandResult, get_ssh_auth
+
+_keys = {}  # (path, mtime, passphrase hash) -> SSHKey
+_keys_lock = threading.Lock()
+
+def load_key(path):
+    """Private key at `path` for asyncssh, decrypted once (passphrase from the SSH settings)"""
+    path = os.path.expanduser(path)
+    passphrase = get_ssh_auth().settings["passphrase"]
+    cache_key = (path, os.path.getmtime(path), hashlib.sha256((passphrase or "").encode()).hexdigest())
+    with _keys_lock:
+        key = _keys.get(cache_key)
+    if key is None:
+        key = asyncssh.read_private_key(path, passphrase or None)
+        with _keys_lock:
+            _keys[cache_key] = key
+    return key
+
+class _Client(asyncssh.SSHClient):
+    """Host keys are checked against the same trust-on-first-use store as the paramiko backend"""
+
+    def validate_host_public_key(self, host, addr, port, key):
+        import paramiko
+        try:
+            get_ssh_auth().check_host_key(host, paramiko.PKey.from_type_string(key.get_algorithm(),
+                                                                                 key.public_data))
+            return True
+        except Exception:
+            return False
+
+def connect_failure(error):
+    """Retry class of a connection error, like turnoff.ssh.connect_failure"""
+    if isinstance(error, asyncssh.HostKeyNotVerifiable):
+        return "hostkey"
+    if isinstance(error, asyncssh.PermissionDenied):
+        return "auth"
+    return "connect"
+
+class AsyncConnectionPool:
+    """Authenticated asyncssh connections keyed by (ip, user), shared by the tasks of one run"""
+
+    def __init__(self):
+        self._connections = {}
+        self._locks = {}
+        self._identities = {}  # (ip, user) -> (whoami, monotonic time)
+        self._agent = None
+        self._agent_keys = None
+        self._agent_lock = asyncio.Lock()
+
+    async def agent_keys(self):
+        """The ssh-agent's keys, listed once per run (SSHAuth.agent_keys for asyncssh)"""
+        if not get_ssh_auth().settings["use_agent"] or not os.environ.get("SSH_AUTH_SOCK"):
+            return []
+        async with self._agent_lock:
+            if self._agent_keys is None:
+                try:
+                    self._agent = await asyncssh.connect_agent(os.environ["SSH_AUTH_SOCK"])
+                    self._agent_keys = list(await self._agent.get_keys())
+                except Exception:
+                    self._agent_keys = []
+            return list(self._agent_keys)
+
+    async def keys_for(self, key_path=""):
+        """Keys to offer, as SSHAuth.keys_for: the host's key (or the default one), then the agent's"""
+        path = key_path or get_ssh_auth().settings["default_key"]
+        keys = []
+        if path:
+            try:
+                keys.append(load_key(path))
+            except Exception:
+                pass  # Como con paramiko, una clave ilegible no impide probar el agente y la contraseña
+        return keys + await self.agent_keys()
+
+    async def acquire(self, ip, username, password, timeout=10, trace=None, key_path=""):
+        """Return a connection, opening it on first use; `trace` gets `reused` and `connect_ms`"""
+        trace = {} if trace is None else trace
+        key = (ip, username, hashlib.sha256(f"{password}\0{key_path}".encode()).hexdigest())
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            connection = self._connections.get(key)
+            if connection is not None:
+                trace["reused"] = True
+                return connection
+            trace["reused"] = False
+            keys = await self.keys_for(key_path)
+            started = time.perf_counter()
+            # Las mismas claves que ofrece paramiko, y solo esas: con client_keys vacío ([] o ())
+            # asyncssh cargaría las de ~/.ssh, y el agente ya va en la lista (agent_path=None)
+            connection = await asyncssh.connect(
+                ip, port=SSH_PORT, username=username, password=password or None,
+                client_keys=keys or None, agent_path=None,
+                known_hosts=([], [], []), client_factory=_Client, config=None,
+                connect_timeout=timeout, login_timeout=timeout)
+            # TCP, negociación y autenticación van en una sola espera
+            trace["connect_ms"] = elapsed_ms(started)
+            self._connections[key] = connection
+            return connection
+
+    def identity(self, ip, username, max_age=300):
+        """Remote identity learned on this run's connection within `max_age` seconds"""
+        identity, at = self._identities.get((ip, username), (None, 0))
+        return identity if identity and time.monotonic() - at <= max_age else None
+
+    def remember_identity(self, ip, username, identity):
+        self._identities[(ip, username)] = (identity, time.monotonic())
+
+    def discard(self, ip, username):
+        self._identities.pop((ip, username), None)
+        for key in [key for key in self._connections if key[:2] == (ip, username)]:
+            self._connections.pop(key).close()
+
+    async def close_all(self):
+        connections = list(self._connections.values())
+        self._connections.clear()
+        for connection in connections:
+            connection.close()
+        await asyncio.gather(*(connection.wait_closed() for connection in connections), return_exceptions=True)
+        if self._agent is not None:
+            self._agent.close()
+            await self._agent.wait_closed()
+            self._agent, self._agent_keys = None, None
+
+_pool = contextvars.ContextVar("turnoff_async_pool", default=None)
+
+@contextlib.asynccontextmanager
+async def _connection_pool():
+    """The pool of the current run_tasks() call, or a temporary one for a standalone call"""
+    pool = _pool.get()
+    if pool is not None:
+        yield pool
+        return
+    pool = AsyncConnectionPool()
+    try:
+        yield pool
+    finally:
+        await pool.close_all()
+
+async def run_remote(connection, command, timeout=10, label=None):
+    """Run a command on `connection` and return a CommandResult with bounded output"""
+    started = time.perf_counter()
+    result = await asyncio.wait_for(connection.run(command, check=False, errors="replace"), timeout)
+    exit_status = result.exit_status if result.exit_status is not None else -1
+    return CommandResult(label or command, exit_status, (result.stdout or "")[:MAX_OUTPUT].strip(),
+                         (result.stderr or "")[:MAX_OUTPUT].strip(), elapsed_ms(started))
+
+async def run_shutdown_command(connection, command, grace, label):
+    """Start a shutdown command and wait up to `grace` for it to be accepted
+
+    Returns (accepted, attempt, output) like turnoff.power.run_shutdown_command.
+    """
+    started = time.perf_counter()
+    output = ""
+    try:
+        process = await connection.create_process(command, errors="replace")
+        try:
+            completed = await asyncio.wait_for(process.wait(), grace)
+        except asyncio.TimeoutError:
+            process.close()
+            accepted, detail = False, UNCONFIRMED
+        else:
+            output = completed.stdout or ""
+            # Sin código de salida: el equipo cerró la conexión al apagarse
+            if completed.exit_status in (0, -1, None):
+                accepted = True
+                detail = "comando aceptado" if completed.exit_status == 0 else "conexión cerrada por el equipo"
+            else:
+                accepted = False
+                detail = f"código de salida {completed.exit_status}: {(completed.stderr or '').strip()}"
+    except (asyncssh.ConnectionLost, asyncssh.DisconnectError, ConnectionError):
+        accepted, detail = True, "conexión cerrada por el equipo"
+    except Exception as e:
+        accepted, detail = False, str(e)
+    attempt = {"command": label, "accepted": accepted, "exec_ms": elapsed_ms(started), "detail": detail}
+    return accepted, attempt, output
+
+async def drive(steps, perform):
+    """turnoff.power.drive for coroutine `perform` functions"""
+    reply, error = None, None
+    while True:
+        try:
+            step = steps.throw(error) if error is not None else steps.send(reply)
+        except StopIteration as done:
+            return done.value
+        reply, error = None, None
+        try:
+            reply = await perform(*step)
+        except Exception as e:
+            error = e
+
+class AsyncSession:
+    """turnoff.power.PooledSession for asyncssh: the steps of one host on the run's pool"""
+
+    def __init__(self, pool, ip, username, password, key_path="", timeout=10, grace=2.0, trace=None):
+        self.pool = pool
+        self.ip = ip
+        self.username = username
+        self.password = password
+        self.key_path = key_path
+        self.timeout = timeout
+        self.grace = grace
+        self.trace = {} if trace is None else trace
+        self.trace["backend"] = "asyncssh"
+        self.connection = None
+
+    async def perform(self, step, *args):
+        return await getattr(self, step)(*args)
+
+    async def connect(self):
+        self.connection = await self.pool.acquire(self.ip, self.username, self.password, timeout=self.timeout,
+                                                  trace=self.trace, key_path=self.key_path)
+
+    async def run(self, command, label):
+        return await run_remote(self.connection, command, timeout=self.timeout, label=label)
+
+    async def shutdown(self, command, label):
+        return await run_shutdown_command(self.connection, command, self.grace, label)
+
+    @staticmethod
+    def connect_failure(error):
+        return connect_failure(error)
+
+    def identity(self, max_age):
+        return self.pool.identity(self.ip, self.username, max_age)
+
+    def remember_identity(self, identity):
+        self.pool.remember_identity(self.ip, self.username, identity)
+
+    def discard(self):
+        self.pool.discard(self.ip, self.username)
+
+    def release(self):
+        pass  # Las conexiones duran hasta el final de la ejecución
+
+async def schedule_shutdown(ip, os_type, username, password, sudo_password=None, shutdown_time=None,
+                            immediate=False, timeout=10, grace=2.0, trace=None, lean=True, identity_max_age=300,
+                            key_path=""):
+    """Coroutine version of turnoff.power.schedule_shutdown
+
+    Connections only live for one run, and so does the remembered identity: in `lean`
+    mode `whoami` travels in the first shutdown command sent to each host of a run.
+    """
+    async with _connection_pool() as pool:
+        session = AsyncSession(pool, ip, username, password, key_path, timeout, grace, trace)
+        return await drive(schedule_steps(session, os_type, sudo_password, shutdown_time, immediate, lean,
+                                          identity_max_age), session.perform)
+
+async def cancel_shutdown(ip, os_type, username, password, sudo_password=None, timeout=10, trace=None,
+                          key_path=""):
+    """Coroutine version of turnoff.power.cancel_shutdown"""
+    async with _connection_pool() as pool:
+        session = AsyncSession(pool, ip, username, password, key_path, timeout, trace=trace)
+        return await drive(cancel_steps(session, os_type, sudo_password), session.perform)
+
+async def _run_all(targets, task, concurrency, total_timeout, results, stop, retries):
+    pool = AsyncConnectionPool()
+    _pool.set(pool)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(target):
+        while True:
+            async with semaphore:
+                try:
+                    entry = await task(target)
+                except Exception as e:
+                    entry = log_entry(False, target["IP"].strip(), target["OS"], f"Error general: {str(e)}")
+            delay = retries.after(target, entry) if retries else None
+            if delay is None:
+                break
+            # La espera no ocupa un puesto del semáforo
+            await asyncio.sleep(delay)
+        results.put(entry)
+
+    tasks = {asyncio.ensure_future(run_one(target)): target for target in targets}
+    try:
+        deadline = time.monotonic() + total_timeout if total_timeout else None
+        pending = set(tasks)
+        while pending and not stop.is_set():
+            remaining = deadline - time.monotonic() if deadline else None
+            if remaining is not None and remaining <= 0:
+                break
+            _, pending = await asyncio.wait(pending, timeout=min(0.5, remaining) if remaining else 0.5)
+        for future in pending:
+            future.cancel()
+            target = tasks[future]
+            if not stop.is_set():
+                results.put(log_entry(False, target["IP"].strip(), target["OS"],
+                                      f"Tiempo límite global agotado ({total_timeout}s)"))
+        await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        await pool.close_all()
+
+def run_tasks(targets, task, concurrency=1000, total_timeout=None, retries=None):
+    """Run the coroutine `task(target)` over all targets on one event loop
+
+    The loop runs in a background thread, so this generator can be consumed from
+    Streamlit or any other synchronous code; it yields each log entry as soon as its
+    task completes. At most `concurrency` hosts are in flight; hosts waiting for a
+    retry (`retries`, a turnoff.retry.RetryRun) do not count. Closing the generator
+    early cancels the remaining tasks.
+    """
+    results = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def main():
+        try:
+            asyncio.run(_run_all(targets, task, concurrency, total_timeout, results, stop, retries))
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=main, name="ssh-asyncio", daemon=True)
+    thread.start()
+    try:
+        while True:
+            entry = results.get()
+            if entry is done:
+                return
+            yield entry
+    finally:
+        stop.set()
@@ -0,0 +1,145 @@
+"""Python API for fleet operations, independent of any user interface
+
+Every operation takes its targets as a selector expression ("lab-3 AND linux"), a
+list of IPs or a list of inventory rows, and returns an OperationResult with the
+log entry of each host. Entries are also appended to the shared activity log, so
+runs from scripts and cron show up in the web interface.
+"""
+import time
+
+from .config import SSH_PORT
+from .fleet import (RolloutPlan, cancel_shutdown_task, computer_with_credentials, fleet_operation,
+                    immediate_shutdown_task, reschedule_shutdown_task, scheduled_shutdown_task)
+from .inventory import get_inventory
+from .logs import get_activity_log, log_entry
+from .metrics import elapsed_ms
+from .network import scan_hosts
+from .power import minutes_until
+from .retry import RetryPolicy
+from .verify import get_shutdown_verifier
+from .wol import get_wake_on_lan
+
+# RolloutPlan y RetryPolicy se reexportan para quien usa la API sin conocer el paquete
+__all__ = ["OperationResult", "RetryPolicy", "RolloutPlan", "cancel", "reschedule", "select", "shutdown", "status",
+           "wake"]
+
+class OperationResult:
+    """Outcome of one fleet operation: one log entry per host plus the wall-clock time"""
+
+    def __init__(self, operation, entries, wall_ms):
+        self.operation = operation
+        self.entries = entries
+        self.wall_ms = wall_ms
+
+    @property
+    def succeeded(self):
+        return [entry for entry in self.entries if entry["success"]]
+
+    @property
+    def failed(self):
+        return [entry for entry in self.entries if not entry["success"] and not entry.get("skipped")]
+
+    @property
+    def skipped(self):
+        return [entry for entry in self.entries if entry.get("skipped")]
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def as_dict(self):
+        return {"operation": self.operation, "hosts": len(self.entries), "succeeded": len(self.succeeded),
+                "failed": len(self.failed), "skipped": len(self.skipped), "wall_ms": self.wall_ms,
+                "entries": self.entries}
+
+def select(targets):
+    """Resolve a selector expression, IPs or inventory rows into inventory rows; raises ValueError"""
+    inventory = get_inventory()
+    if isinstance(targets, str):
+        return inventory.select(targets)
+    computers = []
+    for target in targets:
+        if isinstance(target, dict):
+            computers.append(target)
+            continue
+        computer = inventory.get_by_ip(target)
+        if not computer:
+            raise ValueError(f"El equipo {target} no está en el inventario")
+        computers.append(computer)
+    return computers
+
+def _collect(operation, entries, started, log):
+    result = []
+    activity_log = get_activity_log() if log else None
+    for entry in entries:
+        if log:
+            activity_log.append(entry)
+        result.append(entry)
+    return OperationResult(operation, result, elapsed_ms(started))
+
+def _run(targets, task, operation, credentials, log, parallel=32, total_timeout=None,
+         preflight=True, preflight_timeout=0.8, rollout=None, agent_action=None, agent_minutes=None,
+         staggered=False, retry=None):
+    started = time.perf_counter()
+    computers = [computer_with_credentials(computer, *(credentials or ()))
+                 for computer in select(targets) if computer["IP"].strip()]
+    entries = fleet_operation(computers, task, operation, agent_action=agent_action, agent_minutes=agent_minutes,
+                              rollout=rollout, staggered=staggered, preflight=preflight,
+                              preflight_timeout=preflight_timeout, max_workers=parallel,
+                              total_timeout=total_timeout, retry=retry)
+    return _collect(operation, entries, started, log)
+
+def shutdown(targets, at=None, parallel=32, host_timeout=10, total_timeout=None, preflight=True,
+             preflight_timeout=0.8, lean=True, rollout=None, credentials=None, backend=None, retry=None,
+             verify=None, log=True):
+    """Shut the targets down now, or at the datetime `at`
+
+    `rollout` is a RolloutPlan; `credentials` is (ssh_user, ssh_password, sudo_pass)
+    used for computers that have none of their own; `backend` ("paramiko" or
+    "asyncssh") overrides the configured SSH backend; `retry` is a RetryPolicy, None
+    for the configured one or False to try each host once. An immediate shutdown
+    then waits until the hosts stop answering (see turnoff.verify) unless `verify`
+    is False; None follows the configured setting.
+    """
+    options = {"parallel": parallel, "total_timeout": total_timeout, "preflight": preflight,
+               "preflight_timeout": preflight_timeout, "rollout": rollout, "retry": retry}
+    if at is None:
+        result = _run(targets, immediate_shutdown_task(host_timeout, lean, backend), "immediate_shutdown",
+                      credentials, log, agent_action="shutdown", **options)
+        verifier = get_shutdown_verifier()
+        if verify or (verify is None and verifier.settings["enabled"]):
+            verifier.confirm(result.entries, log=log)
+        return result
+    return _run(targets, scheduled_shutdown_task(at, host_timeout, lean, backend), "scheduled_shutdown", credentials, log,
+                agent_action="schedule", agent_minutes=minutes_until(at), staggered=True, **options)
+
+def cancel(targets, parallel=32, host_timeout=10, total_timeout=None, preflight=True, preflight_timeout=0.8,
+           credentials=None, backend=None, retry=None, log=True):
+    """Cancel the pending shutdown of the targets"""
+    return _run(targets, cancel_shutdown_task(host_timeout, backend), "cancel", credentials, log, parallel=parallel,
+                total_timeout=total_timeout, preflight=preflight, preflight_timeout=preflight_timeout,
+                agent_action="cancel", retry=retry)
+
+def reschedule(targets, at, parallel=32, host_timeout=10, total_timeout=None, preflight=True,
+               preflight_timeout=0.8, rollout=None, credentials=None, backend=None, retry=None, log=True):
+    """Move the pending shutdown of the targets to the datetime `at`"""
+    return _run(targets, reschedule_shutdown_task(at, host_timeout, backend), "reschedule", credentials, log,
+                parallel=parallel, total_timeout=total_timeout, preflight=preflight,
+                preflight_timeout=preflight_timeout, rollout=rollout, agent_action="schedule",
+                agent_minutes=minutes_until(at), staggered=True, retry=retry)
+
+def wake(targets, log=True):
+    """Power the targets on with Wake-on-LAN, in the configured waves"""
+    started = time.perf_counter()
+    computers = [computer for computer in select(targets) if computer["IP"].strip()]
+    return _collect("wake", get_wake_on_lan().wake(computers), started, log)
+
+def status(targets, timeout=1.0, concurrency=256):
+    """Probe the SSH port of the targets; entries succeed for hosts that are up (not logged)"""
+    started = time.perf_counter()
+    computers = {computer["IP"].strip(): computer for computer in select(targets) if computer["IP"].strip()}
+    entries = []
+    for ip, up, latency, error in scan_hosts(list(computers), SSH_PORT, timeout, concurrency):
+        message = f"Encendido ({latency:.0f} ms)" if up else f"Apagado o inaccesible ({error})"
+        entries.append(log_entry(up, ip, computers[ip]["OS"], message))
+    return OperationResult("status", entries, elapsed_ms(started))
@@ -0,0 +1,200 @@
+"""turnoff command line: fleet operations from scripts and cron, without the web interface
+
+    turnoff shutdown --group lab3 --at 22:00 --parallel 64
+    turnoff cancel --tag aulas
+    turnoff wake --select "lab-3 AND NOT server"
+    turnoff status --all --json
+    turnoff scheduler
+
+Modules are imported per command so that short runs start in milliseconds.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+def parse_when(value, now=None):
+    """'22:00' (next occurrence), '2026-10-18 22:00' or '+N' minutes; raises ValueError"""
+    now = now or datetime.now()
+    value = value.strip()
+    if value.startswith("+") and value[1:].isdigit():
+        return now + timedelta(minutes=int(value[1:]))
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    try:
+        at = datetime.combine(now.date(), datetime.strptime(value, "%H:%M").time())
+    except ValueError:
+        # El mensaje de strptime no dice qué formatos se aceptan
+        raise ValueError(f"Hora no válida: '{value}'. Use +N (minutos desde ahora), HH:MM "
+                         "o 'AAAA-MM-DD HH:MM'") from None
+    return at if at > now else at + timedelta(days=1)
+
+def selector_from_args(args):
+    """Build a selector expression from --select, --group, --tag, --os, --ip and --all"""
+    if args.all:
+        return "*"
+    clauses = []
+    if args.select:
+        from .inventory import parse_selector
+        # Se valida tal como se escribió, para que los errores señalen la expresión del usuario
+        parse_selector(args.select)
+        clauses.append(f"({args.select})")
+    for prefix, values in (("group", args.group), ("tag", args.tag), ("ip", args.ip)):
+        if values:
+            clauses.append("(" + " OR ".join(f"{prefix}:{value}" for value in values) + ")")
+    if args.os:
+        clauses.append(f"os:{args.os}")
+    if not clauses:
+        raise ValueError("Indique los equipos con --group, --tag, --ip, --os, --select o --all")
+    if clauses == [f"({args.select})"]:
+        return args.select
+    return " AND ".join(clauses)
+
+def add_target_arguments(parser):
+    group = parser.add_argument_group("equipos")
+    group.add_argument("--group", "-g", action="append", help="Grupo del inventario (repetible)")
+    group.add_argument("--tag", "-t", action="append", help="Etiqueta (repetible)")
+    group.add_argument("--ip", action="append", help="IP o patrón, p. ej. 192.168.3.* (repetible)")
+    group.add_argument("--os", choices=["linux", "windows"], help="Solo equipos de este sistema")
+    group.add_argument("--select", "-s", help='Expresión completa, p. ej. "lab-3 AND linux AND NOT server"')
+    group.add_argument("--all", action="store_true", help="Todos los equipos del inventario")
+
+def add_fleet_arguments(parser, rollout=True):
+    parser.add_argument("--parallel", "-p", type=int, default=32, help="Conexiones SSH simultáneas (32)")
+    parser.add_argument("--timeout", type=float, default=10, help="Segundos por equipo (10)")
+    parser.add_argument("--total-timeout", type=float, default=None, help="Segundos para todo el lote")
+    parser.add_argument("--no-preflight", action="store_true", help="No sondear el puerto 22 antes de conectar")
+    parser.add_argument("--backend", choices=["paramiko", "asyncssh"],
+                        help="Motor SSH (por defecto el configurado); asyncssh admite miles de conexiones")
+    parser.add_argument("--no-retry", action="store_true",
+                        help="Un solo intento por equipo, sin reintentos ni cortocircuito (data/retry.json)")
+    parser.add_argument("--user", default=os.environ.get("TURNOFF_SSH_USER", "admin"),
+                        help="Usuario SSH para equipos sin credenciales propias (TURNOFF_SSH_USER)")
+    if rollout:
+        parser.add_argument("--waves", type=int, default=0, metavar="N",
+                            help="Apagar por oleadas de N equipos (0: todos a la vez)")
+        parser.add_argument("--wave-by", choices=["size", "group"], default="size")
+        parser.add_argument("--wave-delay", type=float, default=30, help="Segundos entre oleadas (30)")
+        parser.add_argument("--wave-jitter", type=float, default=10, help="Segundos aleatorios añadidos (10)")
+        parser.add_argument("--max-failure", type=float, default=50,
+                            help="Detener si falla más de este %% de una oleada (50)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="turnoff", description="Apagado y encendido remoto de equipos")
+    parser.add_argument("--data-dir", help="Directorio de datos (TURNOFF_DATA_DIR); el mismo que usa la web")
+    parser.add_argument("--json", action="store_true", help="Resultado en JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("list", help="Listar equipos del inventario")
+    add_target_arguments(command)
+
+    command = commands.add_parser("status", help="Comprobar qué equipos están encendidos")
+    add_target_arguments(command)
+    command.add_argument("--timeout", type=float, default=1.0, help="Segundos por sondeo (1)")
+
+    command = commands.add_parser("shutdown", help="Apagar ahora o a una hora")
+    add_target_arguments(command)
+    add_fleet_arguments(command)
+    command.add_argument("--at", help="Hora: 22:00, '2026-10-18 22:00' o +N minutos (sin ella, ahora)")
+    command.add_argument("--full", action="store_true", help="Verificar whoami en una ida y vuelta propia")
+    command.add_argument("--no-verify", action="store_true",
+                         help="No esperar a que los equipos dejen de responder tras un apagado inmediato")
+
+    command = commands.add_parser("cancel", help="Cancelar el apagado pendiente")
+    add_target_arguments(command)
+    add_fleet_arguments(command, rollout=False)
+
+    command = commands.add_parser("reschedule", help="Mover el apagado pendiente a otra hora")
+    add_target_arguments(command)
+    add_fleet_arguments(command)
+    command.add_argument("--at", required=True, help="Nueva hora: 22:00, '2026-10-18 22:00' o +N minutos")
+
+    command = commands.add_parser("wake", help="Encender con Wake-on-LAN")
+    add_target_arguments(command)
+
+    command = commands.add_parser("scheduler", help="Ejecutar las tareas programadas (servicio, en primer plano)")
+    command.add_argument("--misfire-grace", type=float, default=600,
+                         help="Segundos de retraso tolerados; una ejecución más atrasada se omite (600)")
+    return parser
+
+def print_result(result, as_json):
+    if as_json:
+        print(json.dumps(result.as_dict(), ensure_ascii=False, indent=1))
+        return
+    for entry in result.entries:
+        mark = "⏭️" if entry.get("skipped") else ("✅" if entry["success"] else "❌")
+        print(f"{mark} {entry['ip']:<15} {entry['message']}")
+    print(f"{len(result.succeeded)}/{len(result.entries)} equipos correctos, {len(result.failed)} fallidos, "
+          f"{len(result.skipped)} omitidos en {result.wall_ms:.0f} ms")
+
+def serve_scheduler(args):
+    """Run the scheduled jobs in the foreground until SIGTERM or Ctrl+C"""
+    import signal
+    from .inventory import get_inventory
+    from .scheduler import ShutdownScheduler, get_job_store
+    store = get_job_store()
+    scheduler = ShutdownScheduler(store, get_inventory(), misfire_grace=args.misfire_grace)
+    signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+    print(f"turnoff: planificador en ejecución, {len(store.load())} tareas en {store.path}", file=sys.stderr)
+    try:
+        scheduler.serve()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.data_dir:
+        os.environ["TURNOFF_DATA_DIR"] = os.path.abspath(args.data_dir)
+    if args.command == "scheduler":
+        return serve_scheduler(args)
+    try:
+        expression = selector_from_args(args)
+        if args.command == "list":
+            from .inventory import get_inventory
+            computers = get_inventory().select(expression)
+            if args.json:
+                fields = ["IP", "OS", "Description", "Group", "Tags", "MAC"]
+                print(json.dumps([{field: c[field] for field in fields} for c in computers], ensure_ascii=False))
+            else:
+                for c in computers:
+                    print(f"{c['IP']:<15} {c['OS']:<8} {c['Group']:<12} {c['Description']}")
+            return 0
+
+        from . import api
+        if args.command == "status":
+            result = api.status(expression, timeout=args.timeout)
+        elif args.command == "wake":
+            result = api.wake(expression)
+        else:
+            options = {
+                "parallel": args.parallel,
+                "host_timeout": args.timeout,
+                "total_timeout": args.total_timeout,
+                "preflight": not args.no_preflight,
+                "backend": args.backend,
+                "retry": False if args.no_retry else None,
+                "credentials": (args.user, os.environ.get("TURNOFF_SSH_PASSWORD", ""),
+                                os.environ.get("TURNOFF_SUDO_PASSWORD", ""))
+            }
+            if args.command != "cancel" and args.waves:
+                options["rollout"] = api.RolloutPlan(by=args.wave_by, size=args.waves, delay=args.wave_delay,
+                                                     jitter=args.wave_jitter,
+                                                     max_failure_rate=args.max_failure / 100)
+            if args.command == "shutdown":
+                at = parse_when(args.at) if args.at else None
+                result = api.shutdown(expression, at=at, lean=not args.full,
+                                      verify=False if args.no_verify else None, **options)
+            elif args.command == "cancel":
+                result = api.cancel(expression, **options)
+            else:
+                result = api.reschedule(expression, parse_when(args.at), **options)
+    except ValueError as e:
+        print(f"turnoff: {e}", file=sys.stderr)
+        return 2
+    print_result(result, args.json)
+    return 0 if result.ok else 1
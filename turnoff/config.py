@@ -0,0 +1,11 @@
+"""Where turnoff keeps its state: inventory, activity log, jobs, keys and settings"""
+import os
+
+# Directorio para los datos persistentes (tareas programadas, etc.)
+DATA_DIR = os.environ.get("TURNOFF_DATA_DIR",
+                          os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+# Solo para el usuario del servicio: guarda contraseñas, claves y la clave del agente
+os.makedirs(DATA_DIR, mode=0o700, exist_ok=True)
+
+# Puerto SSH de todos los equipos (el simulador de las pruebas de rendimiento usa otro)
+SSH_PORT = int(os.environ.get("TURNOFF_SSH_PORT", "22"))
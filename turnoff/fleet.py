@@ -0,0 +1,321 @@
+"""Fleet fan-out: bounded parallel execution, rollout waves and the per-host tasks"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from .agent import agent_stage, get_agent_client
+from .logs import log_entry
+from .metrics import elapsed_ms, get_metrics
+from .network import preflight_filter
+from .power import cancel_shutdown, drive, schedule_shutdown
+from .retry import retry_run
+from .ssh import has_credentials, ssh_backend
+
+def computer_with_credentials(computer, ssh_user="", ssh_password="", sudo_pass=""):
+    """Return a copy of the computer with credentials resolved against the given defaults"""
+    resolved = dict(computer)
+    resolved['ssh_user'] = computer.get('ssh_user') or ssh_user
+    resolved['ssh_password'] = computer.get('ssh_password', ssh_password)
+    resolved['sudo_pass'] = computer.get('sudo_pass', sudo_pass)
+    return resolved
+
+def _run_threads(targets, task, max_workers, total_timeout, retries=None):
+    """Yield task(target) for every target from a thread pool, as each one completes
+
+    Hosts that `retries` sends back wait in a timer heap rather than in a worker
+    thread and are resubmitted when due, so a backoff never holds up the batch.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets))))
+    futures = {executor.submit(task, target): target for target in targets}
+    waiting = []  # (due, order, target, last entry)
+    order = itertools.count()
+    deadline = time.monotonic() + total_timeout if total_timeout else None
+    try:
+        while futures or waiting:
+            now = time.monotonic()
+            while waiting and waiting[0][0] <= now:
+                target = heapq.heappop(waiting)[2]
+                futures[executor.submit(task, target)] = target
+            if deadline is not None and now >= deadline:
+                break
+            wake_at = [at for at in (waiting[0][0] if waiting else None, deadline) if at is not None]
+            timeout = max(0, min(wake_at) - now) if wake_at else None
+            if not futures:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                target = futures.pop(future)
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    entry = log_entry(False, target["IP"].strip(), target["OS"], f"Error general: {str(e)}")
+                delay = retries.after(target, entry) if retries else None
+                if delay is None:
+                    yield entry
+                else:
+                    heapq.heappush(waiting, (time.monotonic() + delay, next(order), target, entry))
+        for future, target in futures.items():
+            future.cancel()
+            yield log_entry(False, target["IP"].strip(), target["OS"],
+                            f"Tiempo límite global agotado ({total_timeout}s)")
+        for _, _, _, entry in waiting:
+            yield entry
+    finally:
+        # No esperamos a los hilos colgados: sus resultados se descartan
+        # (cancel_futures de shutdown() no existe en Python 3.8)
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+def run_fleet(targets, task, max_workers=32, total_timeout=None, operation=None, retry=None):
+    """Run task(target) over all targets with bounded concurrency
+
+    Yields the log entry returned by each task as soon as it completes. Hosts still
+    pending when the global budget `total_timeout` expires are reported as failed.
+    Tasks run in worker threads, so they must not touch UI state; coroutine tasks
+    (the asyncssh backend) all run on one event loop instead, `max_workers` hosts at a
+    time. Every entry's trace feeds the latency metrics and, when `operation` is
+    given, so does the batch wall-clock time.
+
+    Failed hosts are retried with backoff and hosts with an open circuit are skipped
+    according to `retry`: a turnoff.retry.RetryPolicy, None for the configured one
+    or False for a single attempt per host. Only each host's final entry is yielded.
+    """
+    if not targets:
+        return
+    retries = retry_run(retry, total_timeout)
+    if retries:
+        targets, skipped = retries.admit(targets)
+        yield from skipped
+        if not targets:
+            return
+    started = time.perf_counter()
+    succeeded = 0
+    if asyncio.iscoroutinefunction(task):
+        from .aiossh import run_tasks
+        entries = run_tasks(targets, task, max_workers, total_timeout, retries)
+    else:
+        entries = _run_threads(targets, task, max_workers, total_timeout, retries)
+    try:
+        for entry in entries:
+            get_metrics().observe_entry(entry)
+            succeeded += bool(entry["success"])
+            yield entry
+    finally:
+        entries.close()
+        if operation:
+            metrics = get_metrics()
+            metrics.observe_batch(operation, len(targets), succeeded, elapsed_ms(started))
+            metrics.flush()
+
+def fleet_wave(targets, task, operation, agent_action=None, agent_minutes=None, preflight=True,
+               preflight_timeout=0.8, max_workers=32, total_timeout=None, retry=None):
+    """Yield the log entries of one fleet operation: agent, then preflight, then SSH
+
+    With the remote agent enabled, `agent_action` is first delivered to every Linux
+    host in one UDP pass; only the hosts that did not acknowledge it are probed and,
+    if reachable, handed to run_fleet. Safe to call from worker threads.
+    """
+    if agent_action and get_agent_client().enabled and targets:
+        entries, targets = agent_stage(targets, agent_action, operation, agent_minutes)
+        yield from entries
+    if preflight and targets:
+        targets, skipped = preflight_filter(targets, preflight_timeout)
+        yield from skipped
+    yield from run_fleet(targets, task, max_workers=max_workers, total_timeout=total_timeout, operation=operation,
+                         retry=retry)
+
+class RolloutPlan:
+    """How a mass operation is split into waves
+
+    Targets are grouped by inventory group (`by="group"`, groups larger than `size`
+    are split) or in fixed chunks of `size`. Waves are separated by `delay` seconds
+    plus a random 0..`jitter`, and the rollout stops once a wave's failure rate
+    (offline hosts excluded) exceeds `max_failure_rate`. The number of SSH sessions in
+    flight is still capped by the fan-out's `max_workers`, wave after wave.
+    """
+
+    def __init__(self, by="size", size=50, delay=30, jitter=10, max_failure_rate=0.5):
+        self.by = by
+        self.size = max(1, int(size))
+        self.delay = delay
+        self.jitter = jitter
+        self.max_failure_rate = max_failure_rate
+
+    def as_options(self):
+        return {"by": self.by, "size": self.size, "delay": self.delay, "jitter": self.jitter,
+                "max_failure_rate": self.max_failure_rate}
+
+    def waves(self, targets):
+        if self.by == "group":
+            groups = OrderedDict()
+            for target in targets:
+                groups.setdefault(target.get("Group") or "", []).append(target)
+            chunks = list(groups.values())
+        else:
+            chunks = [targets]
+        return [chunk[start:start + self.size] for chunk in chunks for start in range(0, len(chunk), self.size)]
+
+    def pause(self):
+        return self.delay + random.uniform(0, self.jitter)
+
+def run_rollout(targets, plan, run_wave, staggered=False):
+    """Run `run_wave(wave, offset)` wave by wave, yielding its log entries
+
+    Immediate operations sleep between waves. `staggered` operations (scheduled
+    shutdowns) are all sent right away, and instead each wave's `offset` (seconds)
+    grows by the pause, so the hosts power off wave by wave rather than all at the
+    same `shutdown -h +N`. Hosts left after a failed wave are reported as skipped.
+    """
+    waves = plan.waves(targets)
+    offset = 0.0
+    for number, wave in enumerate(waves):
+        if number:
+            if staggered:
+                offset += plan.pause()
+            else:
+                time.sleep(plan.pause())
+        attempted = failed = 0
+        for entry in run_wave(wave, offset):
+            if not entry.get("skipped"):
+                attempted += 1
+                failed += not entry["success"]
+            yield entry
+        if attempted and failed / attempted > plan.max_failure_rate and number + 1 < len(waves):
+            message = (f"Despliegue detenido: {failed}/{attempted} equipos fallaron en la oleada "
+                       f"{number + 1}/{len(waves)}")
+            for target in (target for rest in waves[number + 1:] for target in rest):
+                entry = log_entry(False, target["IP"].strip(), target["OS"], message)
+                entry["skipped"] = True
+                yield entry
+            return
+
+def fleet_operation(targets, task, operation, agent_action=None, agent_minutes=None, rollout=None,
+                    staggered=False, preflight=True, preflight_timeout=0.8, max_workers=32, total_timeout=None,
+                    retry=None):
+    """Yield the log entries of a whole fleet operation, in waves when a `rollout` plan is given
+
+    Each wave is a fleet_wave(). In `staggered` waves every target carries its wave
+    offset as "rollout_offset" and the agent gets the shifted minutes.
+    """
+    def run_wave(wave, offset=0.0):
+        if offset:
+            wave = [dict(target, rollout_offset=offset) for target in wave]
+        minutes = agent_minutes + int(offset // 60) if agent_minutes is not None else None
+        return fleet_wave(wave, task, operation, agent_action=agent_action, agent_minutes=minutes,
+                          preflight=preflight, preflight_timeout=preflight_timeout, max_workers=max_workers,
+                          total_timeout=total_timeout, retry=retry)
+    return run_rollout(targets, rollout, run_wave, staggered) if rollout else run_wave(targets)
+
+def shutdown_functions(backend=None):
+    """(schedule_shutdown, cancel_shutdown) of the SSH backend; coroutines for asyncssh"""
+    if ssh_backend(backend) == "asyncssh":
+        from . import aiossh
+        return aiossh.schedule_shutdown, aiossh.cancel_shutdown
+    return schedule_shutdown, cancel_shutdown
+
+def host_task(steps, backend=None):
+    """Per-host task of a fleet operation on the SSH backend, built from a step generator
+
+    steps(pc) yields ("schedule" | "cancel", keyword arguments) for the backend's
+    schedule_shutdown / cancel_shutdown, gets their (success, message) back and
+    returns the log entry; hosts without credentials fail before it starts. With the
+    asyncssh backend the task is a coroutine function.
+    """
+    schedule, cancel = shutdown_functions(backend)
+    functions = {"schedule": schedule, "cancel": cancel}
+
+    def call(name, arguments):
+        return functions[name](**arguments)
+
+    def missing(pc):
+        return log_entry(False, pc["IP"].strip(), pc["OS"], "No hay credenciales configuradas para este equipo")
+
+    if asyncio.iscoroutinefunction(schedule):
+        from .aiossh import drive as drive_async
+
+        async def task(pc):
+            return await drive_async(steps(pc), call) if has_credentials(pc) else missing(pc)
+        return task
+
+    def task(pc):
+        return drive(steps(pc), call) if has_credentials(pc) else missing(pc)
+    return task
+
+def host_arguments(pc, timeout, operation):
+    """Keyword arguments of schedule_shutdown / cancel_shutdown for one target"""
+    return dict(ip=pc["IP"].strip(), os_type=pc["OS"], username=pc['ssh_user'], password=pc['ssh_password'],
+                sudo_password=pc['sudo_pass'], key_path=pc.get('ssh_key', ""), timeout=timeout,
+                trace={"operation": operation})
+
+def scheduled_shutdown_steps(pc, shutdown_time, timeout, lean=True):
+    when = shutdown_time + timedelta(seconds=pc.get("rollout_offset", 0))
+    arguments, started = host_arguments(pc, timeout, "scheduled_shutdown"), time.perf_counter()
+    success, message = yield "schedule", dict(arguments, shutdown_time=when, lean=lean)
+    trace = arguments["trace"]
+    trace["total_ms"] = elapsed_ms(started)
+    return log_entry(success, arguments["ip"], arguments["os_type"],
+                     message if not success else f"Apagado programado: {when.strftime('%H:%M')}",
+                     timings=trace, identity=trace.pop("identity", None))
+
+def scheduled_shutdown_task(shutdown_time, timeout, lean=True, backend=None):
+    """Build the per-host task used by the scheduled shutdown fan-out
+
+    A target's "rollout_offset" (seconds, set by staggered rollouts) delays its own
+    shutdown time.
+    """
+    return host_task(lambda pc: scheduled_shutdown_steps(pc, shutdown_time, timeout, lean), backend)
+
+def cancel_shutdown_task(timeout, backend=None):
+    """Build the per-host task used by the bulk cancel"""
+    def steps(pc):
+        arguments, started = host_arguments(pc, timeout, "cancel"), time.perf_counter()
+        success, message = yield "cancel", arguments
+        arguments["trace"]["total_ms"] = elapsed_ms(started)
+        return log_entry(success, arguments["ip"], arguments["os_type"], message, timings=arguments["trace"])
+    return host_task(steps, backend)
+
+def reschedule_shutdown_task(shutdown_time, timeout, backend=None):
+    """Build the per-host task used by the bulk reschedule: cancel, then schedule again"""
+    def steps(pc):
+        # Windows rechaza un segundo /t mientras otro está pendiente, así que se cancela primero
+        arguments, started = host_arguments(pc, timeout, "reschedule"), time.perf_counter()
+        success, message = yield "cancel", arguments
+        if not success:
+            arguments["trace"]["total_ms"] = elapsed_ms(started)
+            return log_entry(False, arguments["ip"], arguments["os_type"], f"Reprogramación fallida: {message}",
+                             timings=arguments["trace"])
+        entry = yield from scheduled_shutdown_steps(pc, shutdown_time, timeout)
+        if "timings" in entry:
+            entry["timings"]["operation"] = "reschedule"
+            entry["timings"]["commands"] = arguments["trace"]["commands"] + entry["timings"]["commands"]
+            entry["timings"]["total_ms"] = elapsed_ms(started)
+        if entry["success"]:
+            when = shutdown_time + timedelta(seconds=pc.get("rollout_offset", 0))
+            entry["message"] = f"Apagado reprogramado: {when.strftime('%d/%m %H:%M')}"
+        return entry
+    return host_task(steps, backend)
+
+def immediate_shutdown_task(timeout, lean=True, backend=None):
+    """Build the per-host task used by the bulk immediate shutdown
+
+    Successful entries only mean the order was accepted; they are marked with
+    confirmation "sent" for turnoff.verify to confirm.
+    """
+    def steps(pc):
+        arguments, started = host_arguments(pc, timeout, "immediate_shutdown"), time.perf_counter()
+        success, message = yield "schedule", dict(arguments, immediate=True, lean=lean)
+        trace = arguments["trace"]
+        trace["total_ms"] = elapsed_ms(started)
+        entry = log_entry(success, arguments["ip"], arguments["os_type"], message, timings=trace,
+                          identity=trace.pop("identity", None))
+        if success:
+            entry["confirmation"] = "sent"
+        return entry
+    return host_task(steps, backend)
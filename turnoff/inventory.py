@@ -0,0 +1,631 @@
+"""Computer inventory in SQLite, CSV/JSON import and export, and target selectors"""
+import csv
+import fnmatch
+import io
+import ipaddress
+import json
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+
+from .config import DATA_DIR
+
+class InventoryStore:
+    """Persistent computer inventory backed by SQLite
+
+    Rows are returned as dicts with the same keys the UI always used ("IP", "OS",
+    "Description", "ssh_user", ...) plus "id", "Group" and "Tags". Tags are kept
+    comma-separated on the row and mirrored into an indexed table for lookups.
+    `version` increases on every write so callers can cache derived data. The
+    database holds the SSH and sudo passwords, so it is only readable by its owner.
+    """
+
+    COLUMNS = {
+        "IP": "ip",
+        "OS": "os",
+        "Description": "description",
+        "Group": "grp",
+        "Tags": "tags",
+        "ssh_user": "ssh_user",
+        "ssh_password": "ssh_password",
+        "sudo_pass": "sudo_pass",
+        "ssh_key": "ssh_key",
+        "MAC": "mac"
+    }
+
+    def __init__(self, path):
+        self.path = path
+        # Las credenciales se guardan en la base de datos: 0600, también en instalaciones anteriores
+        if os.path.exists(path):
+            for file_path in (path, path + "-wal", path + "-shm"):
+                if os.path.exists(file_path):
+                    os.chmod(file_path, 0o600)
+        else:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self.version = 0
+        self._index = None
+        self._index_version = None
+        self._selection_cache = {}
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS computers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ip TEXT NOT NULL UNIQUE,
+                    os TEXT NOT NULL DEFAULT 'Linux',
+                    description TEXT NOT NULL DEFAULT '',
+                    grp TEXT NOT NULL DEFAULT '',
+                    tags TEXT NOT NULL DEFAULT '',
+                    ssh_user TEXT NOT NULL DEFAULT '',
+                    ssh_password TEXT NOT NULL DEFAULT '',
+                    sudo_pass TEXT NOT NULL DEFAULT '',
+                    ssh_key TEXT NOT NULL DEFAULT '',
+                    mac TEXT NOT NULL DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS idx_computers_os ON computers(os);
+                CREATE INDEX IF NOT EXISTS idx_computers_grp ON computers(grp);
+                CREATE INDEX IF NOT EXISTS idx_computers_description ON computers(description);
+                CREATE TABLE IF NOT EXISTS computer_tags (
+                    computer_id INTEGER NOT NULL REFERENCES computers(id) ON DELETE CASCADE,
+                    tag TEXT NOT NULL,
+                    PRIMARY KEY (tag, computer_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_computer_tags_computer ON computer_tags(computer_id);
+            """)
+            # Columnas añadidas en versiones posteriores
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(computers)")}
+            if "ssh_key" not in columns:
+                self._db.execute("ALTER TABLE computers ADD COLUMN ssh_key TEXT NOT NULL DEFAULT ''")
+            if "mac" not in columns:
+                self._db.execute("ALTER TABLE computers ADD COLUMN mac TEXT NOT NULL DEFAULT ''")
+
+    @staticmethod
+    def split_tags(tags):
+        return sorted({tag.strip().lower() for tag in (tags or "").split(",") if tag.strip()})
+
+    def _row(self, row):
+        return {
+            "id": row["id"],
+            "IP": row["ip"],
+            "OS": row["os"],
+            "Description": row["description"],
+            "Group": row["grp"],
+            "Tags": row["tags"],
+            "ssh_user": row["ssh_user"],
+            "ssh_password": row["ssh_password"],
+            "sudo_pass": row["sudo_pass"],
+            "ssh_key": row["ssh_key"],
+            "MAC": row["mac"]
+        }
+
+    def _where(self, search="", os_type=None, group=None, tag=None):
+        clauses, params = [], []
+        if search:
+            clauses.append("(ip LIKE ? OR description LIKE ?)")
+            params += [f"%{search}%", f"%{search}%"]
+        if os_type:
+            clauses.append("os = ?")
+            params.append(os_type)
+        if group:
+            clauses.append("grp = ?")
+            params.append(group)
+        if tag:
+            clauses.append("id IN (SELECT computer_id FROM computer_tags WHERE tag = ?)")
+            params.append(tag.lower())
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _sync_tags(self, computer_id, tags):
+        self._db.execute("DELETE FROM computer_tags WHERE computer_id = ?", (computer_id,))
+        self._db.executemany("INSERT INTO computer_tags (computer_id, tag) VALUES (?, ?)",
+                             [(computer_id, tag) for tag in self.split_tags(tags)])
+
+    def count(self, search="", os_type=None, group=None, tag=None):
+        where, params = self._where(search, os_type, group, tag)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM computers{where}", params).fetchone()[0]
+
+    def query(self, search="", os_type=None, group=None, tag=None, offset=0, limit=50):
+        """Return one page of computers matching the filters, ordered by insertion"""
+        where, params = self._where(search, os_type, group, tag)
+        with self._lock:
+            rows = self._db.execute(f"SELECT * FROM computers{where} ORDER BY id LIMIT ? OFFSET ?",
+                                    params + [limit, offset]).fetchall()
+        return [self._row(row) for row in rows]
+
+    def all(self):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM computers ORDER BY id").fetchall()
+        return [self._row(row) for row in rows]
+
+    def get(self, computer_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM computers WHERE id = ?", (computer_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def get_by_ip(self, ip):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM computers WHERE ip = ?", (ip.strip(),)).fetchone()
+        return self._row(row) if row else None
+
+    def get_many(self, computer_ids):
+        """Return the computers with the given ids, in inventory order"""
+        computer_ids = list(computer_ids)
+        rows = []
+        with self._lock:
+            for start in range(0, len(computer_ids), 500):
+                chunk = computer_ids[start:start + 500]
+                rows += self._db.execute(
+                    f"SELECT * FROM computers WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+                ).fetchall()
+        return [self._row(row) for row in sorted(rows, key=lambda row: row["id"])]
+
+    def revision(self):
+        """Opaque value that changes whenever the inventory changes, in this or another process"""
+        with self._lock:
+            # data_version cambia cuando otra conexión modifica la base de datos
+            return self.version, self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _selector_index(self):
+        """Id sets per group, tag and OS, rebuilt only when the inventory changes"""
+        with self._lock:
+            version = self.revision()
+            if self._index_version == version and self._index is not None:
+                return self._index
+            index = {"all": set(), "group": {}, "tag": {}, "os": {}, "ip": {}}
+            for row in self._db.execute("SELECT id, ip, os, grp FROM computers"):
+                index["all"].add(row["id"])
+                index["ip"][row["ip"]] = row["id"]
+                index["os"].setdefault(row["os"].lower(), set()).add(row["id"])
+                if row["grp"]:
+                    index["group"].setdefault(row["grp"].lower(), set()).add(row["id"])
+            for row in self._db.execute("SELECT computer_id, tag FROM computer_tags"):
+                index["tag"].setdefault(row["tag"], set()).add(row["computer_id"])
+            self._index = index
+            self._index_version = version
+            self._selection_cache = {}
+            return index
+
+    def select_ids(self, expression):
+        """Resolve a target expression to a frozenset of computer ids (cached per inventory version)"""
+        key = " ".join(expression.split()).lower()
+        index = self._selector_index()
+        with self._lock:
+            cached = self._selection_cache.get(key)
+        if cached is None:
+            cached = frozenset(evaluate_selector(parse_selector(expression), index))
+            with self._lock:
+                self._selection_cache[key] = cached
+        return cached
+
+    def select(self, expression):
+        """Return the computers matching a target expression such as 'lab-3 AND linux AND NOT server'"""
+        return self.get_many(self.select_ids(expression))
+
+    def groups(self):
+        with self._lock:
+            rows = self._db.execute("SELECT DISTINCT grp FROM computers WHERE grp != '' ORDER BY grp").fetchall()
+        return [row[0] for row in rows]
+
+    def insert(self, computer):
+        """Insert a computer and return its id; raises sqlite3.IntegrityError on duplicate IP"""
+        values = {column: (computer.get(key) or "").strip() if key == "IP" else (computer.get(key) or "")
+                  for key, column in self.COLUMNS.items()}
+        values["os"] = values["os"] or "Linux"
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                f"INSERT INTO computers ({', '.join(values)}) VALUES ({', '.join('?' for _ in values)})",
+                list(values.values())
+            )
+            self._sync_tags(cursor.lastrowid, values["tags"])
+            self.version += 1
+            return cursor.lastrowid
+
+    def update(self, computer_id, changes):
+        """Update only the given fields (UI keys) of one computer"""
+        values = {self.COLUMNS[key]: (value or "") for key, value in changes.items() if key in self.COLUMNS}
+        if "ip" in values:
+            values["ip"] = values["ip"].strip()
+        if not values:
+            return
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE computers SET {', '.join(f'{column} = ?' for column in values)} WHERE id = ?",
+                             list(values.values()) + [computer_id])
+            if "tags" in values:
+                self._sync_tags(computer_id, values["tags"])
+            self.version += 1
+
+    def delete(self, computer_ids):
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM computers WHERE id = ?", [(computer_id,) for computer_id in computer_ids])
+            self.version += 1
+
+    def upsert_many(self, computers, replace=False, default_user=""):
+        """Insert or update computers by IP in a single transaction, consuming an iterable lazily
+
+        Existing credentials are kept, and so is a known MAC when the input has none.
+        With `replace`, computers whose IP is not in the input are deleted at the end;
+        an input without any computer raises ValueError and changes nothing.
+        Returns (inserted, updated).
+        """
+        inserted = updated = 0
+        with self._lock, self._db:
+            if replace:
+                self._db.execute("CREATE TEMP TABLE IF NOT EXISTS import_seen (ip TEXT PRIMARY KEY)")
+                self._db.execute("DELETE FROM import_seen")
+            for computer in computers:
+                ip = computer["IP"].strip()
+                values = (computer.get("OS") or "Linux", computer.get("Description") or "",
+                          computer.get("Group") or "", computer.get("Tags") or "", computer.get("MAC") or "")
+                row = self._db.execute("SELECT id FROM computers WHERE ip = ?", (ip,)).fetchone()
+                if row:
+                    computer_id = row[0]
+                    self._db.execute("UPDATE computers SET os = ?, description = ?, grp = ?, tags = ?, "
+                                     "mac = COALESCE(NULLIF(?, ''), mac) WHERE id = ?",
+                                     values + (computer_id,))
+                    updated += 1
+                else:
+                    computer_id = self._db.execute(
+                        "INSERT INTO computers (ip, os, description, grp, tags, mac, ssh_user) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (ip,) + values + (default_user,)
+                    ).lastrowid
+                    inserted += 1
+                self._sync_tags(computer_id, values[3])
+                if replace:
+                    self._db.execute("INSERT OR IGNORE INTO import_seen (ip) VALUES (?)", (ip,))
+            if replace:
+                # Un archivo sin equipos válidos vaciaría el inventario (y sus credenciales)
+                if not self._db.execute("SELECT 1 FROM import_seen LIMIT 1").fetchone():
+                    raise ValueError("El archivo no contiene ningún equipo válido: el inventario no se ha reemplazado")
+                self._db.execute("DELETE FROM computers WHERE ip NOT IN (SELECT ip FROM import_seen)")
+            self.version += 1
+        return inserted, updated
+
+    def iter_rows(self, batch_size=1000):
+        """Iterate over all computers without loading the whole table
+
+        Each batch is read under the lock, which is released before the rows are
+        yielded, so a slow consumer does not block other readers and writers.
+        """
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT * FROM computers WHERE id > ? ORDER BY id LIMIT ?",
+                                        (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1]["id"]
+            for row in rows:
+                yield self._row(row)
+
+    def set_default_credentials(self, ssh_user, ssh_password, sudo_pass, apply_to_all=False):
+        """Apply credentials to computers without a password (or to all); returns the number updated"""
+        where = "" if apply_to_all else " WHERE ssh_password = ''"
+        with self._lock, self._db:
+            cursor = self._db.execute(f"UPDATE computers SET ssh_user = ?, ssh_password = ?, sudo_pass = ?{where}",
+                                      (ssh_user, ssh_password, sudo_pass))
+            self.version += 1
+            return cursor.rowcount
+
+    def set_macs(self, macs):
+        """Store discovered MAC addresses ({ip: mac}); returns the number of computers changed"""
+        if not macs:
+            return 0
+        with self._lock, self._db:
+            changed = sum(self._db.execute("UPDATE computers SET mac = ? WHERE ip = ? AND mac != ?",
+                                           (mac, ip, mac)).rowcount for ip, mac in macs.items())
+            if changed:
+                self.version += 1
+        return changed
+
+    def without_credentials(self, limit=100):
+        """Return (total, first `limit` computers) that have neither an SSH password nor a key"""
+        with self._lock:
+            total = self._db.execute("SELECT COUNT(*) FROM computers WHERE ssh_password = '' AND ssh_key = ''"
+                                     ).fetchone()[0]
+            rows = self._db.execute("SELECT * FROM computers WHERE ssh_password = '' AND ssh_key = '' "
+                                    "ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return total, [self._row(row) for row in rows]
+
+INVENTORY_FIELDS = ["IP", "OS", "Description", "Group", "Tags", "MAC"]
+
+MAC_RE = re.compile(r"^[0-9a-f]{12}$")
+
+HOSTNAME_RE = re.compile(r"^(?=.{1,253}$)[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?(\.[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?)*$")
+
+def expand_address(value, max_hosts=65536):
+    """Expand an IP, hostname or CIDR range into a list of addresses; raises ValueError"""
+    value = value.strip()
+    if "/" in value:
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            raise ValueError(f"Rango CIDR no válido: {value}")
+        if network.num_addresses > max_hosts + 2:
+            raise ValueError(f"El rango {value} tiene demasiadas direcciones (máximo {max_hosts})")
+        hosts = list(network.hosts()) or [network.network_address]
+        return [str(host) for host in hosts]
+    try:
+        return [str(ipaddress.ip_address(value))]
+    except ValueError:
+        if HOSTNAME_RE.match(value) and not value.replace(".", "").isdigit():
+            return [value]
+        raise ValueError(f"Dirección IP no válida: {value}")
+
+def normalize_mac(value):
+    """Normalize a MAC address to aa:bb:cc:dd:ee:ff ("" stays ""); raises ValueError"""
+    digits = re.sub(r"[\s:.-]", "", (value or "").strip().lower())
+    if not digits:
+        return ""
+    if not MAC_RE.match(digits):
+        raise ValueError(f"Dirección MAC no válida: {value}")
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+def normalize_os(value):
+    """Map free-form OS names to the supported values; raises ValueError"""
+    normalized = (value or "").strip().lower()
+    if normalized in ("linux", "unix", "ubuntu", "debian", "fedora", "centos"):
+        return "Linux"
+    if normalized in ("windows", "win"):
+        return "Windows"
+    raise ValueError(f"Sistema operativo no soportado: {value}")
+
+def read_chunks(text, first_chunk="", chunk_size=65536):
+    """Yield an already-read chunk followed by the rest of a text stream in chunks"""
+    if first_chunk:
+        yield first_chunk
+    while True:
+        chunk = text.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def parse_json_line(line):
+    """Parse one JSON Lines record; errors are returned so they can be reported per line"""
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        return ValueError(f"JSON no válido: {e.msg}")
+
+def iter_json_records(text, chunk_size=65536):
+    """Yield (index, record) from a JSON array or JSON Lines text stream without loading it whole"""
+    head = ""
+    while not head.strip():
+        chunk = text.read(chunk_size)
+        if not chunk:
+            break
+        head += chunk
+    buffer = head.lstrip()
+    if not buffer.startswith("["):
+        # JSON Lines: un objeto por línea (las líneas en blanco iniciales también cuentan)
+        pending = ""
+        line_number = 0
+        for chunk in read_chunks(text, head, chunk_size):
+            pending += chunk
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    yield line_number, parse_json_line(line)
+        if pending.strip():
+            yield line_number + 1, parse_json_line(pending)
+        return
+
+    decoder = json.JSONDecoder()
+    separators = re.compile(r"[\s,]*")
+    position = 1
+    index = 0
+    eof = False
+    while True:
+        position = separators.match(buffer, position).end()
+        if buffer.startswith("]", position):
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+            # Un número al final del bloque puede continuar en el siguiente
+            complete = eof or end < len(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("JSON mal formado o incompleto")
+            complete = False
+        if not complete:
+            # Objeto incompleto: descartamos lo ya leído y añadimos otro bloque
+            chunk = text.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        index += 1
+        yield index, record
+        position = end
+
+def iter_csv_records(text):
+    """Yield (line_number, record) from CSV text; a header row is detected by an IP column"""
+    reader = csv.reader(text)
+    columns = INVENTORY_FIELDS
+    for row in reader:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if reader.line_num == 1 and row[0].strip().lower() in ("ip", "dirección ip"):
+            aliases = {"ip": "IP", "dirección ip": "IP", "os": "OS", "sistema operativo": "OS",
+                       "description": "Description", "descripción": "Description",
+                       "group": "Group", "grupo": "Group", "tags": "Tags", "etiquetas": "Tags",
+                       "mac": "MAC", "dirección mac": "MAC"}
+            columns = [aliases.get(cell.strip().lower(), cell.strip()) for cell in row]
+            continue
+        yield reader.line_num, dict(zip(columns, row))
+
+def validated_records(records, errors, max_errors=1000):
+    """Validate raw records, expanding CIDR ranges; bad rows are reported in `errors`"""
+    for line_number, record in records:
+        try:
+            if isinstance(record, ValueError):
+                raise record
+            if not isinstance(record, dict):
+                raise ValueError("Se esperaba un objeto con los campos del equipo")
+            os_type = normalize_os(record.get("OS"))
+            tags = record.get("Tags") or ""
+            if isinstance(tags, list):
+                tags = ", ".join(str(tag) for tag in tags)
+            mac = normalize_mac(str(record.get("MAC") or ""))
+            addresses = expand_address(str(record.get("IP") or ""))
+            if mac and len(addresses) > 1:
+                raise ValueError("Una dirección MAC no puede asignarse a un rango")
+            for address in addresses:
+                yield {
+                    "IP": address,
+                    "OS": os_type,
+                    "Description": str(record.get("Description") or "").strip(),
+                    "Group": str(record.get("Group") or "").strip(),
+                    "Tags": str(tags).strip(),
+                    "MAC": mac
+                }
+        except ValueError as e:
+            if len(errors) < max_errors:
+                errors.append({"Línea": line_number, "Error": str(e)})
+
+def import_inventory(store, fileobj, file_format, replace=False, default_user=""):
+    """Stream a CSV/JSON file into the inventory; returns (inserted, updated, errors)
+
+    With `replace`, any row with errors rolls the whole import back: nothing is
+    inserted, updated or deleted, and the errors are still returned.
+    """
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    records = iter_csv_records(text) if file_format == "csv" else iter_json_records(text)
+    errors = []
+    aborted = ValueError("Hay filas con errores: el inventario no se ha reemplazado")
+
+    def checked_records():
+        yield from validated_records(records, errors)
+        if replace and errors:
+            # Lanzado dentro de la transacción de upsert_many, que así se deshace
+            raise aborted
+
+    try:
+        inserted, updated = store.upsert_many(checked_records(), replace=replace, default_user=default_user)
+    except ValueError as e:
+        if e is not aborted:
+            raise
+        return 0, 0, errors
+    finally:
+        text.detach()
+    return inserted, updated, errors
+
+def export_inventory(store, file_format, batch_size=1000):
+    """Yield the inventory (without credentials) as CSV or JSON text, one chunk per batch of rows"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if file_format == "csv":
+        writer.writerow(INVENTORY_FIELDS)
+    else:
+        output.write("[")
+    for index, computer in enumerate(store.iter_rows(batch_size), 1):
+        if file_format == "csv":
+            writer.writerow([computer[field] for field in INVENTORY_FIELDS])
+        else:
+            output.write(",\n" if index > 1 else "\n")
+            output.write(json.dumps({field: computer[field] for field in INVENTORY_FIELDS}, ensure_ascii=False))
+        if index % batch_size == 0:
+            # Solo se guarda un bloque en memoria: se entrega y se vacía el búfer
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    if file_format != "csv":
+        output.write("\n]\n")
+    yield output.getvalue()
+
+SELECTOR_TOKEN_RE = re.compile(r"\(|\)|[^\s()]+")
+
+def parse_selector(expression):
+    """Parse a target expression into a tree of ("and"|"or"|"not"|"atom", ...) tuples
+
+    Grammar: OR binds loosest, then AND (also implicit between terms), then NOT;
+    parentheses group. Atoms are `group:x`, `tag:x`, `os:x`, `ip:<glob>`, `*`, or a
+    bare word matching a group, tag or OS. Raises ValueError on syntax errors.
+    """
+    tokens = SELECTOR_TOKEN_RE.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == "OR":
+            take()
+            node = ("or", node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() not in (None, "OR", ")"):
+            if peek() == "AND":
+                take()
+            node = ("and", node, parse_not())
+        return node
+
+    def parse_not():
+        if peek() == "NOT":
+            take()
+            return ("not", parse_not())
+        if peek() == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError("Falta cerrar un paréntesis")
+            take()
+            return node
+        if peek() in (None, "AND", "OR", ")"):
+            raise ValueError("Expresión incompleta" if peek() is None else f"Operador inesperado: {tokens[position]}")
+        return ("atom", take())
+
+    if not tokens:
+        raise ValueError("La expresión está vacía")
+    tree = parse_or()
+    if position < len(tokens):
+        raise ValueError(f"Símbolo inesperado: {tokens[position]}")
+    return tree
+
+def evaluate_selector(node, index):
+    """Evaluate a parsed target expression against an inventory selector index"""
+    kind = node[0]
+    if kind == "or":
+        return evaluate_selector(node[1], index) | evaluate_selector(node[2], index)
+    if kind == "and":
+        return evaluate_selector(node[1], index) & evaluate_selector(node[2], index)
+    if kind == "not":
+        return index["all"] - evaluate_selector(node[1], index)
+    term = node[1]
+    if term == "*":
+        return set(index["all"])
+    field, _, value = term.partition(":")
+    field = field.lower()
+    if value and field in ("group", "tag", "os"):
+        return set(index[field].get(value.lower(), ()))
+    if value and field == "ip":
+        return {computer_id for ip, computer_id in index["ip"].items() if fnmatch.fnmatch(ip, value)}
+    term = term.lower()
+    return set(index["group"].get(term, ())) | set(index["tag"].get(term, ())) | set(index["os"].get(term, ()))
+
+@lru_cache(maxsize=None)
+def get_inventory():
+    """Shared inventory store; seeded with the example computers on first use"""
+    store = InventoryStore(os.path.join(DATA_DIR, "inventory.db"))
+    if store.count() == 0:
+        for computer in [
+            {"IP": "192.168.1.100", "OS": "Linux", "Description": "Server 1", "ssh_user": "admin"},
+            {"IP": "192.168.1.101", "OS": "Linux", "Description": "Server 2", "ssh_user": "admin"}
+        ]:
+            store.insert(computer)
+    return store
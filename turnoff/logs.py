@@ -0,0 +1,265 @@
+"""Activity log entries and the rotating JSON Lines journal they are kept in"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos, solo entre hilos
+    fcntl = None
+
+from .config import DATA_DIR
+
+def log_entry(success, ip, os_type, message, timings=None, identity=None):
+    """Build an activity log entry, optionally carrying the remote user and the trace of the remote calls"""
+    now = datetime.now()
+    entry = {
+        "id": uuid.uuid4().hex,
+        "success": success,
+        "ip": ip,
+        "os": os_type,
+        "message": message,
+        "time": now.strftime("%H:%M:%S"),
+        "ts": now.timestamp()
+    }
+    if identity:
+        entry["user"] = identity
+    if timings:
+        entry["timings"] = timings
+    return entry
+
+def format_timings(timings):
+    """One-line summary of a log entry's trace, e.g. 'conexión 3 ms · auth 40 ms · total 95 ms'"""
+    parts = []
+    if timings.get("transport") == "agent":
+        parts.append("vía agente")
+    elif timings.get("transport") == "wol":
+        parts.append("Wake-on-LAN")
+    if timings.get("reused"):
+        parts.append("conexión reutilizada")
+    for key, label in (("dns_ms", "DNS"), ("connect_ms", "conexión"), ("handshake_ms", "handshake"),
+                       ("auth_ms", "auth"), ("agent_ms", "agente")):
+        if timings.get(key) is not None:
+            parts.append(f"{label} {timings[key]:.0f} ms")
+    if timings.get("auth_method"):
+        parts.append(f"método {timings['auth_method']}")
+    for command in timings.get("commands", []):
+        status = command.get("exit_status", "ok" if command.get("accepted") else "sin confirmar")
+        parts.append(f"`{command['command']}` {command.get('exec_ms', 0):.0f} ms ({status})")
+    if timings.get("attempts"):
+        parts.append(f"{timings['attempts']} intentos")
+    if timings.get("total_ms") is not None:
+        parts.append(f"total {timings['total_ms']:.0f} ms")
+    return " · ".join(parts)
+
+class ActivityLog:
+    """Bounded activity log shared by every session and background thread
+
+    The newest `capacity` entries live in an in-memory ring buffer; every entry is
+    also appended to a JSONL journal that rotates when it exceeds `max_bytes` or when
+    the day changes, keeping `backups` old files. On start the buffer is refilled
+    from the current journal, and queries pick up lines appended since
+    by other processes (the command line tool and the scheduler service write to the
+    same journal). Writes and rotations take an exclusive lock on activity.jsonl.lock,
+    so two processes never rotate at once.
+    The journal is append-only: update() writes a patch line for an entry id, applied
+    to the buffered entry now and whenever the journal is read again.
+    """
+
+    def __init__(self, directory, capacity=5000, max_bytes=5 * 1024 * 1024, backups=7):
+        self.path = os.path.join(directory, "activity.jsonl")
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._lock_file = open(self.path + ".lock", "a")
+        self._entries = deque(maxlen=capacity)
+        self._by_id = {}
+        partial = False
+        if os.path.exists(self.path):
+            # Se lee el diario entero: parches y líneas dañadas no deben ocupar huecos del búfer
+            with open(self.path, "rb") as file:
+                for line in file:
+                    try:
+                        self._load(json.loads(line))
+                    except ValueError:
+                        pass  # Línea truncada por una parada brusca
+                    partial = not line.endswith(b"\n")
+            self._day = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+        else:
+            self._day = datetime.now().date()
+        self._file = open(self.path, "a", encoding="utf-8")
+        if partial:
+            # La siguiente entrada empieza en su propia línea, no pegada a la truncada
+            self._file.write("\n")
+            self._file.flush()
+        self._position = self._file.tell()
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    @contextmanager
+    def _locked(self):
+        """Hold the journal lock shared with other processes (thread lock already held)"""
+        if fcntl:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _read_from(self, path, inode, position):
+        """Load the complete lines of the journal file `inode` past `position`; returns the new position"""
+        try:
+            with open(path, "rb") as file:
+                if os.fstat(file.fileno()).st_ino != inode:
+                    return position
+                file.seek(position)
+                data = file.read()
+        except OSError:
+            return position
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].splitlines():
+            try:
+                self._load(json.loads(line))
+            except ValueError:
+                pass
+        return position + complete
+
+    def _sync(self):
+        """Load journal lines written by other processes since our last read or write"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if stat.st_ino != self._inode:
+            # Otro proceso ha rotado el diario, quizá varias veces: se termina de leer el nuestro
+            # (ahora una copia .N) y después las copias más recientes, antes de seguir con el nuevo
+            newer = []
+            for index in range(1, self.backups + 1):
+                path = f"{self.path}.{index}"
+                try:
+                    inode = os.stat(path).st_ino
+                except OSError:
+                    break
+                if inode == self._inode:
+                    self._read_from(path, inode, self._position)
+                    for newer_path, newer_inode in reversed(newer):
+                        self._read_from(newer_path, newer_inode, 0)
+                    break
+                newer.append((path, inode))
+            self._file.close()
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._inode = os.fstat(self._file.fileno()).st_ino
+            self._position = 0
+            self._day = datetime.now().date()
+        if stat.st_size > self._position:
+            self._position = self._read_from(self.path, self._inode, self._position)
+
+    def _load(self, record):
+        """Buffer one journal record: a new entry or a patch to a buffered one"""
+        if "update" in record:
+            entry = self._by_id.get(record["update"])
+            if entry is not None:
+                entry.update(record.get("changes", {}))
+            return
+        if len(self._entries) == self._entries.maxlen:
+            self._by_id.pop(self._entries[0].get("id"), None)
+        self._entries.append(record)
+        if record.get("id"):
+            self._by_id[record["id"]] = record
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._position = 0
+
+    def _write(self, record):
+        """Append one line to the journal, rotating first if needed (lock held)"""
+        today = datetime.now().date()
+        size = os.fstat(self._file.fileno()).st_size
+        if self._day != today or (size and size >= self.max_bytes):
+            self._rotate()
+            self._day = today
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._position = self._file.tell()
+
+    def append(self, entry):
+        entry = dict(entry)
+        entry.setdefault("ts", time.time())
+        with self._lock, self._locked():
+            self._sync()
+            self._write(entry)
+            self._load(entry)
+
+    def update(self, entry_id, **changes):
+        """Change fields of a logged entry; returns False if it is no longer buffered"""
+        with self._lock, self._locked():
+            self._sync()
+            self._write({"update": entry_id, "changes": changes, "ts": time.time()})
+            entry = self._by_id.get(entry_id)
+            if entry is None:
+                return False
+            entry.update(changes)
+            return True
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def clear(self):
+        """Empty the in-memory buffer; the journal on disk is kept"""
+        with self._lock:
+            self._entries.clear()
+            self._by_id.clear()
+
+    def query(self, host="", status=None, since=None, until=None, offset=0, limit=50):
+        """Return (total, page) of buffered entries matching the filters, newest first
+
+        `status` is one of "success", "error", "skipped", "verified" (shutdowns with a
+        confirmation state) or "still_up"; `since`/`until` are timestamps.
+        """
+        with self._lock, self._locked():
+            self._sync()
+            entries = list(self._entries)
+        matches = []
+        for entry in reversed(entries):
+            if host and host not in str(entry.get("ip", "")):
+                continue
+            if status == "success" and not entry.get("success"):
+                continue
+            if status == "error" and (entry.get("success") or entry.get("skipped")):
+                continue
+            if status == "skipped" and not entry.get("skipped"):
+                continue
+            if status == "verified" and not entry.get("confirmation"):
+                continue
+            if status == "still_up" and entry.get("confirmation") != "up":
+                continue
+            ts = entry.get("ts", 0)
+            if (since and ts < since) or (until and ts >= until):
+                continue
+            matches.append(entry)
+        return len(matches), matches[offset:offset + limit]
+
+    def journal_files(self):
+        """Paths of the current journal and its rotated backups, newest first"""
+        paths = [self.path] + [f"{self.path}.{index}" for index in range(1, self.backups + 1)]
+        return [path for path in paths if os.path.exists(path)]
+
+@lru_cache(maxsize=None)
+def get_activity_log():
+    """Shared activity log, one per server process"""
+    return ActivityLog(DATA_DIR)
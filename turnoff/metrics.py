@@ -0,0 +1,195 @@
+"""Latency histograms per operation and phase, exported in the Prometheus format"""
+import math
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .config import DATA_DIR
+
+def elapsed_ms(started):
+    """Milliseconds since a time.perf_counter() reading, rounded for the log"""
+    return round((time.perf_counter() - started) * 1000, 1)
+
+# Límites de los histogramas (ms), al estilo de los buckets de Prometheus
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+
+def command_phase(label):
+    """Map a logged command label to its latency phase"""
+    if label == "whoami":
+        return "whoami"
+    if "shutdown -c" in label or "shutdown /a" in label:
+        return "cancel"
+    return "shutdown"
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, math.ceil(fraction * len(samples)) - 1))]
+
+class LatencyMetrics:
+    """Per-phase latency histograms per operation and per host
+
+    Each (operation, phase) pair keeps cumulative Prometheus-style buckets plus the
+    last `window` samples for exact p50/p95/p99. Per-host data is a short window of
+    total durations, enough to rank slow hosts without unbounded label cardinality;
+    for that reason hosts are not exported to Prometheus. With a `path`, flush()
+    rewrites that file for node_exporter's textfile collector after every batch.
+    """
+
+    def __init__(self, window=2048, host_window=32, max_hosts=20000, batches=50, path=None):
+        self.path = path
+        self.window = window
+        self.host_window = host_window
+        self.max_hosts = max_hosts
+        self._lock = threading.Lock()
+        self._series = {}  # (operation, phase) -> {"buckets", "count", "sum", "samples"}
+        self._hosts = OrderedDict()  # ip -> deque of total_ms
+        self._batches = deque(maxlen=batches)
+
+    def _observe(self, operation, phase, value):
+        series = self._series.get((operation, phase))
+        if series is None:
+            series = {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0,
+                      "samples": deque(maxlen=self.window)}
+            self._series[(operation, phase)] = series
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                series["buckets"][i] += 1
+        series["count"] += 1
+        series["sum"] += value
+        series["samples"].append(value)
+
+    def observe(self, operation, phase, value):
+        with self._lock:
+            self._observe(operation, phase, value)
+
+    def observe_entry(self, entry):
+        """Record every phase found in the trace of a log entry"""
+        timings = entry.get("timings")
+        if not timings or not timings.get("operation"):
+            return
+        operation = timings["operation"]
+        with self._lock:
+            for phase in ("dns", "connect", "handshake", "auth", "agent"):
+                if timings.get(f"{phase}_ms") is not None:
+                    self._observe(operation, phase, timings[f"{phase}_ms"])
+            for command in timings.get("commands", []):
+                if command.get("exec_ms") is not None:
+                    self._observe(operation, command_phase(command["command"]), command["exec_ms"])
+            if timings.get("total_ms") is not None:
+                self._observe(operation, "total", timings["total_ms"])
+                samples = self._hosts.pop(entry["ip"], None) or deque(maxlen=self.host_window)
+                samples.append(timings["total_ms"])
+                self._hosts[entry["ip"]] = samples
+                while len(self._hosts) > self.max_hosts:
+                    self._hosts.popitem(last=False)
+
+    def observe_batch(self, operation, hosts, succeeded, wall_ms):
+        """Record the wall-clock duration of a whole fan-out"""
+        with self._lock:
+            self._observe(operation, "batch", wall_ms)
+            self._batches.append({"operation": operation, "hosts": hosts, "succeeded": succeeded,
+                                  "wall_ms": wall_ms, "ts": time.time()})
+
+    def summary(self):
+        """Rows of count and p50/p95/p99/max per (operation, phase)"""
+        with self._lock:
+            series = {key: (value["count"], sorted(value["samples"])) for key, value in self._series.items()}
+        rows = []
+        for (operation, phase), (count, samples) in sorted(series.items()):
+            rows.append({"Operación": operation, "Fase": phase, "Muestras": count,
+                         "p50 (ms)": percentile(samples, 0.5), "p95 (ms)": percentile(samples, 0.95),
+                         "p99 (ms)": percentile(samples, 0.99), "Máx (ms)": samples[-1]})
+        return rows
+
+    def slowest_hosts(self, limit=20):
+        with self._lock:
+            hosts = {ip: sorted(samples) for ip, samples in self._hosts.items()}
+        rows = [{"Equipo": ip, "Operaciones": len(samples), "p50 (ms)": percentile(samples, 0.5),
+                 "p95 (ms)": percentile(samples, 0.95), "Máx (ms)": samples[-1]} for ip, samples in hosts.items()]
+        rows.sort(key=lambda row: row["p95 (ms)"], reverse=True)
+        return rows[:limit]
+
+    def batches(self):
+        with self._lock:
+            return list(reversed(self._batches))
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._hosts.clear()
+            self._batches.clear()
+
+    def prometheus(self):
+        """Render the histograms in the Prometheus text exposition format (seconds)"""
+        with self._lock:
+            series = {key: (list(value["buckets"]), value["count"], value["sum"])
+                      for key, value in self._series.items()}
+            last_batch = {batch["operation"]: batch for batch in self._batches}
+        lines = ["# HELP turnoff_phase_duration_seconds Duration of each phase of a fleet operation",
+                 "# TYPE turnoff_phase_duration_seconds histogram"]
+        for (operation, phase), (buckets, count, total) in sorted(series.items()):
+            labels = f'operation="{operation}",phase="{phase}"'
+            for bound, cumulative in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f'turnoff_phase_duration_seconds_bucket{{{labels},le="{bound / 1000:g}"}} {cumulative}')
+            lines.append(f'turnoff_phase_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"turnoff_phase_duration_seconds_sum{{{labels}}} {total / 1000:.6f}")
+            lines.append(f"turnoff_phase_duration_seconds_count{{{labels}}} {count}")
+        lines += ["# HELP turnoff_last_batch_seconds Wall-clock duration of the last fan-out per operation",
+                  "# TYPE turnoff_last_batch_seconds gauge"]
+        for operation, batch in sorted(last_batch.items()):
+            lines.append(f'turnoff_last_batch_seconds{{operation="{operation}"}} {batch["wall_ms"] / 1000:.3f}')
+        lines += ["# HELP turnoff_last_batch_failed_hosts Hosts that failed in the last fan-out per operation",
+                  "# TYPE turnoff_last_batch_failed_hosts gauge"]
+        for operation, batch in sorted(last_batch.items()):
+            lines.append(f'turnoff_last_batch_failed_hosts{{operation="{operation}"}} '
+                         f'{batch["hosts"] - batch["succeeded"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the metrics atomically, for node_exporter's textfile collector"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.prometheus())
+        os.replace(temp_path, path)
+
+    def flush(self):
+        if self.path:
+            try:
+                self.write_prometheus(self.path)
+            except OSError:
+                pass
+
+    def serve(self, port, host="0.0.0.0"):
+        """Expose /metrics over HTTP from a daemon thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+METRICS_FILE = os.path.join(DATA_DIR, "metrics.prom")
+
+@lru_cache(maxsize=None)
+def get_metrics():
+    """Shared latency metrics of this process"""
+    return LatencyMetrics(path=METRICS_FILE)
@@ -0,0 +1,121 @@
+"""Fast reachability checks: non-blocking port scans, ping and the local ARP cache"""
+import errno
+import os
+import selectors
+import socket
+import subprocess
+import time
+from collections import deque
+
+from .config import SSH_PORT
+from .logs import log_entry
+
+def scan_hosts(hosts, port=22, timeout=1.0, concurrency=256):
+    """Probe a TCP port on many hosts concurrently using non-blocking sockets
+
+    Yields (host, reachable, latency_ms, error) as each probe finishes. At most
+    `concurrency` connections are in flight at once and each one is abandoned after
+    `timeout` seconds, so a blackholed address never blocks the scan.
+    """
+    selector = selectors.DefaultSelector()
+    pending = deque(hosts)
+    in_flight = {}  # socket -> (host, started)
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < concurrency:
+                host = pending.popleft()
+                try:
+                    family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+                    sock = socket.socket(family, socket.SOCK_STREAM)
+                    sock.setblocking(False)
+                    started = time.monotonic()
+                    code = sock.connect_ex(address)
+                except OSError as e:
+                    yield host, False, None, str(e)
+                    continue
+                if code == 0:
+                    sock.close()
+                    yield host, True, round((time.monotonic() - started) * 1000, 1), None
+                elif code in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, getattr(errno, "WSAEWOULDBLOCK", -1)):
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    in_flight[sock] = (host, started)
+                else:
+                    sock.close()
+                    yield host, False, None, os.strerror(code)
+
+            if not in_flight:
+                continue
+            next_deadline = min(started for _, started in in_flight.values()) + timeout
+            for key, _ in selector.select(timeout=max(0, next_deadline - time.monotonic())):
+                sock = key.fileobj
+                host, started = in_flight.pop(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                selector.unregister(sock)
+                sock.close()
+                if error == 0:
+                    yield host, True, round((time.monotonic() - started) * 1000, 1), None
+                else:
+                    yield host, False, None, os.strerror(error)
+
+            now = time.monotonic()
+            for sock, (host, started) in list(in_flight.items()):
+                if now - started >= timeout:
+                    del in_flight[sock]
+                    selector.unregister(sock)
+                    sock.close()
+                    yield host, False, None, "Sin respuesta (tiempo agotado)"
+    finally:
+        for sock in in_flight:
+            sock.close()
+        selector.close()
+
+def ping_host(host, timeout=1.0):
+    """Send a single ICMP echo using the system ping; returns (reachable, latency_ms)"""
+    if os.name == 'nt':
+        command = ['ping', '-n', '1', '-w', str(int(timeout * 1000)), host]
+    else:
+        command = ['ping', '-c', '1', '-W', str(max(1, int(round(timeout)))), host]
+    started = time.monotonic()
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout + 1)
+    except (subprocess.TimeoutExpired, OSError):
+        return False, None
+    if result.returncode != 0:
+        return False, None
+    return True, round((time.monotonic() - started) * 1000, 1)
+
+def preflight_filter(targets, timeout=0.8, concurrency=256):
+    """Split targets into (live_targets, skipped_entries) with a fast parallel SSH port probe
+
+    Offline hosts get an "omitido" log entry right away instead of costing a full
+    SSH connect timeout each.
+    """
+    probes = {}
+    for host, reachable, latency, error in scan_hosts({t["IP"].strip() for t in targets}, SSH_PORT, timeout, concurrency):
+        probes[host] = (reachable, error)
+    live, skipped = [], []
+    for target in targets:
+        ip = target["IP"].strip()
+        reachable, error = probes.get(ip, (False, "Sin respuesta"))
+        if reachable:
+            live.append(target)
+        else:
+            entry = log_entry(False, ip, target["OS"], f"Equipo apagado o inaccesible, omitido ({error})")
+            entry["skipped"] = True
+            skipped.append(entry)
+    return live, skipped
+
+def read_arp_table(path="/proc/net/arp"):
+    """Resolved {ip: mac} entries of the local ARP cache (Linux); empty elsewhere"""
+    table = {}
+    try:
+        with open(path) as f:
+            next(f, None)  # Cabecera
+            for line in f:
+                fields = line.split()
+                # Flags 0x2: entrada completa; 00:00:... son entradas sin resolver
+                if len(fields) >= 4 and int(fields[2], 16) & 0x2 and fields[3] != "00:00:00:00:00:00":
+                    table[fields[0]] = fields[3].lower()
+    except (OSError, ValueError):
+        pass
+    return table
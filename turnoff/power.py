@@ -0,0 +1,348 @@
+"""Shutdown, scheduled shutdown and cancellation on a single host over SSH
+
+The sequences themselves (validation, whoami, the Linux sudo fallback chain, the
+Windows commands and every message) are generators shared by both SSH backends:
+they yield the I/O steps ("connect", "run", "shutdown") and a session performs
+them, PooledSession here with blocking paramiko calls and turnoff.aiossh.AsyncSession
+as coroutines.
+"""
+import time
+from datetime import datetime
+
+from .metrics import elapsed_ms
+from .ssh import (MAX_OUTPUT, connect_failure, get_connection_pool, get_ssh_auth, run_remote, start_remote,
+                  sudo_attempts)
+
+UNCONFIRMED = "sin confirmación del equipo"
+
+def wait_for_shutdown_ack(channel, grace=2.0):
+    """Wait until a remote shutdown command is accepted or the host drops the connection
+
+    Returns (accepted, detail) as soon as the outcome is known instead of sleeping blindly;
+    `grace` is only the upper bound.
+    """
+    deadline = time.monotonic() + grace
+    while True:
+        # Se comprueba una vez más al vencer el plazo: con la CPU saturada el hilo puede
+        # despertar tarde, con la respuesta ya recibida
+        expired = time.monotonic() >= deadline
+        if channel.exit_status_ready():
+            # -1 significa que el canal se cerró sin código de salida (el equipo se está apagando)
+            exit_status = channel.recv_exit_status()
+            if exit_status in (0, -1):
+                return True, "comando aceptado" if exit_status == 0 else "conexión cerrada por el equipo"
+            error = b""
+            while channel.recv_stderr_ready():
+                error += channel.recv_stderr(4096)
+            return False, f"código de salida {exit_status}: {error.decode(errors='replace').strip()}"
+        transport = channel.get_transport()
+        if transport is None or not transport.is_active():
+            return True, "conexión cerrada por el equipo"
+        if expired:
+            return False, UNCONFIRMED
+        time.sleep(0.05)
+
+def minutes_until(shutdown_time):
+    """Whole minutes from now until `shutdown_time`, at least 1 (the unit of `shutdown -h +N`)"""
+    return max(1, int((shutdown_time - datetime.now()).total_seconds() // 60))
+
+def run_shutdown_command(transport, command, timeout, grace, label):
+    """Start a shutdown command and wait for its acknowledgement
+
+    Returns (accepted, attempt, output) where `output` is whatever stdout had
+    already arrived when the outcome was known.
+    """
+    started = time.perf_counter()
+    output = ""
+    try:
+        channel = start_remote(transport, command, timeout=timeout)
+        # El apagado puede cerrar la conexión antes de devolver un código de salida
+        accepted, detail = wait_for_shutdown_ack(channel, grace)
+        if channel.recv_ready():
+            output = channel.recv(MAX_OUTPUT).decode(errors="replace")
+    except Exception as e:
+        accepted, detail = False, str(e)
+    attempt = {"command": label, "accepted": accepted, "exec_ms": elapsed_ms(started), "detail": detail}
+    return accepted, attempt, output
+
+def first_line(output):
+    lines = output.strip().splitlines()
+    return lines[0].strip() if lines else None
+
+
+def error_text(error):
+    """Message of an exception, or its type for those without one (timeouts)"""
+    return str(error) or type(error).__name__
+
+def without_sudo_prompt(stderr):
+    """stderr without the password prompt sudo writes there, which is not part of the error"""
+    return "\n".join(line for line in stderr.splitlines() if "password for" not in line.lower())
+
+def drive(steps, perform):
+    """Run a step generator to completion, doing each yielded step with perform(*step)
+
+    The step's result is sent back into the generator and its exception thrown into
+    it, so the sequences read like blocking code. Returns the generator's value.
+    turnoff.aiossh.drive is the same loop for coroutine `perform` functions.
+    """
+    reply, error = None, None
+    while True:
+        try:
+            step = steps.throw(error) if error is not None else steps.send(reply)
+        except StopIteration as done:
+            return done.value
+        reply, error = None, None
+        try:
+            reply = perform(*step)
+        except Exception as e:
+            error = e
+
+def has_parameters(session, os_type):
+    return bool(session.ip and os_type and session.username
+                and (session.password or session.key_path or get_ssh_auth().has_keys()))
+
+def schedule_steps(session, os_type, sudo_password=None, shutdown_time=None, immediate=False, lean=True,
+                   identity_max_age=300):
+    """Steps of schedule_shutdown() on `session`; returns (success, message)"""
+    trace = session.trace
+    commands = trace.setdefault("commands", [])
+    connected = False
+    try:
+        # Input validation
+        if not has_parameters(session, os_type):
+            return False, "Missing required parameters"
+
+        try:
+            # Reutilizamos una conexión del pool si ya existe una viva
+            yield ("connect",)
+        except Exception as e:
+            trace["failure"] = session.connect_failure(e)
+            return False, f"SSH connection error: {error_text(e)}"
+        connected = True
+
+        # Get sudo password if provided, otherwise use SSH password
+        sudo_pwd = sudo_password if sudo_password else session.password
+
+        identity = session.identity(identity_max_age) if lean else None
+        if not lean:
+            # Verificación previa con una ida y vuelta propia
+            try:
+                result = yield ("run", "whoami", "whoami")
+                commands.append(result.as_dict())
+                identity = result.stdout
+            except Exception as e:
+                trace["failure"] = "command"
+                return False, f"Error ejecutando comando básico: {error_text(e)}"
+        # Sin identidad reciente, whoami viaja en el mismo comando que el apagado
+        prefix = "" if identity else ("whoami & " if os_type == "Windows" else "whoami; ")
+        trace["identity"] = identity or session.username
+
+        def learn_identity(output):
+            nonlocal prefix
+            if prefix and first_line(output):
+                trace["identity"] = first_line(output)
+                session.remember_identity(trace["identity"])
+            prefix = ""
+
+        # Para Linux, intentamos diferentes enfoques para el apagado
+        if os_type == "Linux":
+            if immediate:
+                shutdown_args = "now"
+            else:
+                # Scheduled shutdown
+                if not shutdown_time:
+                    return False, "No shutdown time provided for scheduled shutdown"
+                shutdown_args = f"-h +{minutes_until(shutdown_time)}"
+
+            # Cadena de alternativas: se pasa a la siguiente solo si la anterior falla de verdad
+            # (código de salida distinto de cero, error o sin confirmación), nunca a ciegas
+            attempts = sudo_attempts(f"shutdown {shutdown_args}", sudo_pwd) + \
+                sudo_attempts(f'bash -c "shutdown {shutdown_args}"', sudo_pwd)
+            last_error = ""
+            for label, command in attempts:
+                command = prefix + command
+                if immediate:
+                    accepted, attempt, output = yield ("shutdown", command, label)
+                    commands.append(attempt)
+                    learn_identity(output)
+                    if accepted:
+                        # El equipo se apaga: la conexión del pool ya no sirve
+                        session.discard()
+                        return True, f"Comando de apagado enviado con éxito ({attempt['detail']})"
+                    last_error = attempt["detail"]
+                    continue
+                try:
+                    result = yield ("run", command, label)
+                except Exception as e:
+                    commands.append({"command": label, "exit_status": None, "detail": error_text(e)})
+                    last_error = error_text(e)
+                    continue
+                commands.append(result.as_dict())
+                learn_identity(result.stdout)
+                if result.ok:
+                    return True, f"Apagado programado para {shutdown_time.strftime('%H:%M')}"
+                last_error = f"código de salida {result.exit_status}: {without_sudo_prompt(result.stderr)}".strip()
+
+            # Un apagado inmediato sin confirmación puede haberse producido: no se reintenta a ciegas
+            trace["failure"] = "unconfirmed" if immediate and last_error == UNCONFIRMED else "command"
+            if immediate:
+                return False, f"Fallaron todos los intentos de apagado: {last_error}"
+            return False, f"Error programando apagado: {last_error}"
+
+        elif os_type == "Windows":
+            # Windows shutdown
+            if immediate:
+                accepted, attempt, output = yield ("shutdown", prefix + "shutdown /s /f /t 0", "shutdown /s /f /t 0")
+                commands.append(attempt)
+                learn_identity(output)
+                if not accepted:
+                    trace["failure"] = "unconfirmed" if attempt["detail"] == UNCONFIRMED else "command"
+                    return False, f"Command failed: {attempt['detail']}"
+                session.discard()
+                return True, f"Shutdown command executed successfully ({attempt['detail']})"
+
+            if not shutdown_time:
+                return False, "No shutdown time provided for scheduled shutdown"
+            seconds = int((shutdown_time - datetime.now()).total_seconds())
+            if seconds <= 0:
+                return False, "Scheduled time must be in the future"
+            result = yield ("run", prefix + f"shutdown /s /f /t {seconds}", f"shutdown /s /f /t {seconds}")
+            commands.append(result.as_dict())
+            learn_identity(result.stdout)
+
+            if not result.ok:
+                trace["failure"] = "command"
+                return False, f"Command failed (código {result.exit_status}): {result.stderr}"
+
+            return True, "Shutdown command executed successfully"
+        else:
+            return False, f"Unsupported OS type: {os_type}"
+
+    except Exception as e:
+        # La conexión ya estaba establecida: falló la ejecución remota
+        trace["failure"] = "command"
+        return False, f"Error general: {error_text(e)}"
+    finally:
+        if connected:
+            session.release()
+
+def cancel_steps(session, os_type, sudo_password=None):
+    """Steps of cancel_shutdown() on `session`; returns (success, message)"""
+    trace = session.trace
+    commands = trace.setdefault("commands", [])
+    connected = False
+    try:
+        if not has_parameters(session, os_type):
+            return False, "Missing required parameters"
+        try:
+            yield ("connect",)
+        except Exception as e:
+            trace["failure"] = session.connect_failure(e)
+            return False, f"SSH connection error: {error_text(e)}"
+        connected = True
+
+        if os_type == "Linux":
+            sudo_pwd = sudo_password if sudo_password else session.password
+            error = ""
+            for label, command in sudo_attempts("shutdown -c", sudo_pwd):
+                result = yield ("run", command, label)
+                commands.append(result.as_dict())
+                if result.ok:
+                    return True, "Apagado pendiente cancelado"
+                # Ignorar mensajes comunes de sudo que no son errores
+                error = without_sudo_prompt(result.stderr) or f"código {result.exit_status}"
+            trace["failure"] = "command"
+            return False, f"Error cancelando apagado: {error}"
+        elif os_type == "Windows":
+            result = yield ("run", "shutdown /a", "shutdown /a")
+            commands.append(result.as_dict())
+            # 1116: no había ningún apagado en curso
+            if result.exit_status == 1116:
+                return True, "No había apagado pendiente"
+            if not result.ok:
+                trace["failure"] = "command"
+                return False, f"Error cancelando apagado: {result.stderr or f'código {result.exit_status}'}"
+            return True, "Apagado pendiente cancelado"
+        else:
+            return False, f"Unsupported OS type: {os_type}"
+    except Exception as e:
+        # La conexión ya estaba establecida: falló la ejecución remota
+        trace["failure"] = "command"
+        return False, f"Error general: {error_text(e)}"
+    finally:
+        if connected:
+            session.release()
+
+class PooledSession:
+    """One host's steps on a transport leased from the shared paramiko connection pool
+
+    connect(), run() and shutdown() are the I/O steps the sequences yield; the rest
+    are called directly. The remote identity is cached on the pooled connection.
+    """
+
+    def __init__(self, ip, username, password, key_path="", timeout=10, grace=2.0, trace=None):
+        self.ip = ip
+        self.username = username
+        self.password = password
+        self.key_path = key_path
+        self.timeout = timeout
+        self.grace = grace
+        self.trace = {} if trace is None else trace
+        self.transport = None
+
+    def perform(self, step, *args):
+        return getattr(self, step)(*args)
+
+    def connect(self):
+        self.transport = get_connection_pool().acquire(self.ip, self.username, self.password, timeout=self.timeout,
+                                                       trace=self.trace, key_path=self.key_path)
+
+    def run(self, command, label):
+        return run_remote(self.transport, command, timeout=self.timeout, label=label)
+
+    def shutdown(self, command, label):
+        # El apagado puede cerrar la conexión antes de devolver un código de salida
+        return run_shutdown_command(self.transport, command, self.timeout, self.grace, label)
+
+    @staticmethod
+    def connect_failure(error):
+        return connect_failure(error)
+
+    def identity(self, max_age):
+        return get_connection_pool().identity(self.ip, self.username, max_age)
+
+    def remember_identity(self, identity):
+        get_connection_pool().remember_identity(self.ip, self.username, identity)
+
+    def discard(self):
+        get_connection_pool().discard(self.ip, self.username)
+
+    def release(self):
+        get_connection_pool().release(self.ip, self.username, self.transport)
+
+def schedule_shutdown(ip, os_type, username, password, sudo_password=None, shutdown_time=None, immediate=False,
+                      timeout=10, grace=2.0, trace=None, lean=True, identity_max_age=300, key_path=""):
+    """Schedule or execute immediate shutdown on remote machine
+
+    `timeout` bounds the connection and every remote command, `grace` bounds the wait for
+    an immediate shutdown to be acknowledged. A `trace` dict, when given, receives the
+    connection latencies from the pool, one record per remote command under "commands",
+    the remote user under "identity" and, on failure, its class under "failure"
+    ("connect", "auth", "hostkey", "command" or "unconfirmed", see turnoff.retry).
+
+    In `lean` mode the remote identity is reused from the pooled connection if it was
+    verified in the last `identity_max_age` seconds, otherwise `whoami` is folded into
+    the first shutdown command; without it a separate `whoami` round-trip runs first.
+    """
+    session = PooledSession(ip, username, password, key_path, timeout, grace, trace)
+    return drive(schedule_steps(session, os_type, sudo_password, shutdown_time, immediate, lean, identity_max_age),
+                 session.perform)
+
+def cancel_shutdown(ip, os_type, username, password, sudo_password=None, timeout=10, trace=None, key_path=""):
+    """Cancel a pending scheduled shutdown (`shutdown -c` / `shutdown /a`)
+
+    A host without a pending shutdown counts as success, so the same call can be
+    used to clear any previous schedule before setting a new one.
+    """
+    session = PooledSession(ip, username, password, key_path, timeout, trace=trace)
+    return drive(cancel_steps(session, os_type, sudo_password), session.perform)
@@ -0,0 +1,174 @@
+"""Retries with exponential backoff and a per-host circuit breaker for fleet operations"""
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+
+from .config import DATA_DIR
+from .logs import log_entry
+
+FAILURE_CLASSES = ("connect", "auth", "command")
+
+class RetryPolicy:
+    """Which failed hosts of a fleet operation are tried again, and when
+
+    The SSH layer tags every failure in the trace ("failure"): "connect" (refused,
+    timed out, no SSH banner), "auth" (credentials rejected) or "command" (the
+    shutdown command failed). Each class has its own number of retries and base
+    delay; retry n waits base * 2**(n-1) seconds, capped at `max_delay` and shortened
+    by a random fraction up to `jitter`, so a lab that failed together does not
+    retry in lockstep. Host key mismatches, unconfirmed immediate shutdowns and
+    missing parameters are never retried.
+
+    After `breaker_threshold` consecutive connect failures a host's circuit opens:
+    fleet operations skip it for `breaker_cooldown` seconds, then let one trial
+    attempt through. Settings live in data/retry.json; keyword arguments override
+    them (RetryPolicy(connect_retries=5) for a one-off run from the API).
+    """
+
+    DEFAULTS = {"enabled": True, "connect_retries": 2, "connect_delay": 2.0, "auth_retries": 1,
+                "auth_delay": 10.0, "command_retries": 1, "command_delay": 5.0, "max_delay": 60.0,
+                "jitter": 0.5, "breaker_threshold": 3, "breaker_cooldown": 600}
+
+    def __init__(self, directory=None, **settings):
+        self.settings_path = os.path.join(directory, "retry.json") if directory else None
+        self.settings = dict(self.DEFAULTS)
+        if self.settings_path and os.path.exists(self.settings_path):
+            with open(self.settings_path) as f:
+                self.settings.update(json.load(f))
+        self.settings.update(settings)
+
+    def save(self, **changes):
+        self.settings.update(changes)
+        if self.settings_path:
+            with open(self.settings_path, "w") as f:
+                json.dump(self.settings, f, indent=2)
+
+    def delay(self, failure, retry):
+        """Seconds to wait before retry number `retry` (1-based) of a `failure`, None for no retry"""
+        if failure not in FAILURE_CLASSES or retry > self.settings[f"{failure}_retries"]:
+            return None
+        delay = min(self.settings[f"{failure}_delay"] * 2 ** (retry - 1), self.settings["max_delay"])
+        return delay * (1 - random.uniform(0, self.settings["jitter"]))
+
+class CircuitBreaker:
+    """Consecutive connect failures per host, shared by every fleet operation of the process
+
+    A circuit is open from the moment a host reaches the threshold until the
+    cooldown has passed; the next allow() then closes the window to one trial
+    (half-open) and a failed trial opens the circuit again. Any answer from the
+    host, even a rejected password, closes it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}  # ip -> {"failures": n, "opened": timestamp o None}
+
+    def allow(self, ip, cooldown):
+        """(allowed, state) for a host about to be contacted"""
+        with self._lock:
+            state = self._hosts.get(ip)
+            if not state or state["opened"] is None:
+                return True, state
+            if time.time() - state["opened"] < cooldown:
+                return False, dict(state)
+            # Semiabierto: una sola prueba; el siguiente intento espera otro periodo completo
+            state["opened"] = time.time()
+            return True, dict(state)
+
+    def record(self, ip, failure, threshold):
+        """Count an outcome (`failure` None for success); returns True if the circuit is open"""
+        with self._lock:
+            if failure != "connect":
+                # Un fallo de autenticación o de comando demuestra que el equipo responde
+                self._hosts.pop(ip, None)
+                return False
+            state = self._hosts.setdefault(ip, {"failures": 0, "opened": None})
+            state["failures"] += 1
+            if state["failures"] >= threshold:
+                state["opened"] = time.time()
+            return state["opened"] is not None
+
+    def reset(self, ip=None):
+        with self._lock:
+            if ip is None:
+                self._hosts.clear()
+            else:
+                self._hosts.pop(ip, None)
+
+    def open_circuits(self, cooldown):
+        """[(ip, failures, reopens_at timestamp)] of the hosts currently skipped"""
+        now = time.time()
+        with self._lock:
+            return sorted((ip, state["failures"], state["opened"] + cooldown) for ip, state in self._hosts.items()
+                          if state["opened"] is not None and now - state["opened"] < cooldown)
+
+class RetryRun:
+    """Retry bookkeeping of one run_fleet() call
+
+    admit() drops the hosts with an open circuit; after() is called with every
+    entry a task returns and gives the seconds to wait before trying the host
+    again, or None when the entry is final. No retry is planned past the run's
+    global deadline.
+    """
+
+    def __init__(self, policy, breaker, total_timeout=None):
+        self.policy = policy
+        self.breaker = breaker
+        self.deadline = time.monotonic() + total_timeout if total_timeout else None
+        self._attempts = {}
+
+    def admit(self, targets):
+        """Split targets into (allowed, skipped_entries) by the state of their circuit"""
+        allowed, skipped = [], []
+        for target in targets:
+            ip = target["IP"].strip()
+            ok, state = self.breaker.allow(ip, self.policy.settings["breaker_cooldown"])
+            if ok:
+                allowed.append(target)
+                continue
+            until = datetime.fromtimestamp(state["opened"] + self.policy.settings["breaker_cooldown"])
+            entry = log_entry(False, ip, target["OS"],
+                              f"Omitido: {state['failures']} fallos de conexión seguidos, "
+                              f"no se reintenta hasta las {until.strftime('%H:%M:%S')}")
+            entry["skipped"] = True
+            skipped.append(entry)
+        return allowed, skipped
+
+    def after(self, target, entry):
+        ip = target["IP"].strip()
+        failure = None if entry["success"] else (entry.get("timings") or {}).get("failure")
+        attempt = self._attempts[ip] = self._attempts.get(ip, 0) + 1
+        opened = False
+        if entry["success"] or failure:
+            opened = self.breaker.record(ip, failure, self.policy.settings["breaker_threshold"])
+        delay = None if entry["success"] or opened else self.policy.delay(failure, attempt)
+        if delay is not None and self.deadline is not None and time.monotonic() + delay >= self.deadline:
+            delay = None
+        if delay is None and attempt > 1:
+            entry.setdefault("timings", {})["attempts"] = attempt
+            if not entry["success"]:
+                entry["message"] = f"{entry['message']} ({attempt} intentos)"
+        return delay
+
+@lru_cache(maxsize=None)
+def get_retry_policy():
+    """Shared retry settings"""
+    return RetryPolicy(DATA_DIR)
+
+@lru_cache(maxsize=None)
+def get_circuit_breaker():
+    """Shared per-host circuit breaker, one per process"""
+    return CircuitBreaker()
+
+def retry_run(retry=None, total_timeout=None):
+    """Retry state for one fan-out: `retry` None uses the configured policy, False disables it"""
+    if retry is False:
+        return None
+    policy = retry or get_retry_policy()
+    if not policy.settings["enabled"]:
+        return None
+    return RetryRun(policy, get_circuit_breaker(), total_timeout)
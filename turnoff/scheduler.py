@@ -0,0 +1,340 @@
+"""Persistent shutdown and Wake-on-LAN jobs, run by the `turnoff scheduler` service
+
+The web interface only reads and writes the job store; the jobs fire in the
+service, which keeps running when no browser is open and starts with the system
+(turnoff-scheduler.service).
+"""
+import heapq
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos, solo entre hilos
+    fcntl = None
+
+from .agent import get_agent_client
+from .config import DATA_DIR
+from .fleet import RolloutPlan, fleet_operation, immediate_shutdown_task
+from .logs import get_activity_log, log_entry
+from .retry import get_retry_policy
+from .ssh import get_ssh_auth
+from .verify import get_shutdown_verifier
+from .wol import get_wake_on_lan
+
+WEEKDAYS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+def next_occurrence(at_time, days, after):
+    """Next datetime strictly after `after` at `at_time` on one of the weekdays `days` (0 = Monday)"""
+    for offset in range(8):
+        day = after.date() + timedelta(days=offset)
+        candidate = datetime.combine(day, at_time)
+        if candidate > after and day.weekday() in days:
+            return candidate
+    return None
+
+class JobStore:
+    """Shutdown and Wake-on-LAN jobs persisted to a JSON file
+
+    Jobs are plain dicts. The web interface and the scheduler service share the
+    file: every change is a read-modify-write under an exclusive lock on a
+    sibling .lock file, and the file is replaced atomically, so neither process
+    overwrites the other's changes. "Run now" only flags the job; the service
+    picks the flag up on its next poll. The service also writes a heartbeat
+    file, so the interface can tell whether anything will actually run the jobs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.heartbeat_path = os.path.splitext(path)[0] + ".heartbeat"
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(self.path + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # Se libera al cerrar el archivo
+            yield
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as file:
+                return {job["id"]: job for job in json.load(file)}
+        except FileNotFoundError:
+            return {}
+
+    @contextmanager
+    def change(self):
+        """Lock the store and yield its jobs by id; they are saved when the block ends"""
+        with self._locked():
+            jobs = self._read()
+            yield jobs
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(list(jobs.values()), file, indent=1)
+            os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Current jobs by id (the file is always replaced whole, so no lock is needed)"""
+        return self._read()
+
+    def revision(self):
+        """Changes whenever the job file does"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def add_job(self, name, targets, at_time, days=None, run_date=None, selector=None, options=None,
+                action="shutdown"):
+        """Create a job; recurring on `days` (weekday numbers) or once on `run_date`
+
+        With `selector`, targets are re-resolved from the inventory each time the job fires.
+        `action` is "shutdown" or "wake" (Wake-on-LAN).
+        """
+        days = sorted(days or [])
+        if days:
+            next_run = next_occurrence(at_time, days, datetime.now())
+        else:
+            next_run = datetime.combine(run_date, at_time)
+            if next_run <= datetime.now():
+                raise ValueError("La hora seleccionada está en el pasado")
+        job = {
+            "id": uuid.uuid4().hex,
+            "name": name,
+            "action": action,
+            "targets": [] if selector else targets,
+            "selector": selector,
+            "time": at_time.strftime("%H:%M"),
+            "days": days,
+            "next_run": next_run.isoformat(),
+            "enabled": True,
+            "options": options or {},
+            "last_run": None,
+            "last_result": None
+        }
+        with self.change() as jobs:
+            jobs[job["id"]] = job
+        return job
+
+    def remove_job(self, job_id):
+        with self.change() as jobs:
+            jobs.pop(job_id, None)
+
+    def run_now(self, job_id):
+        """Ask the service to dispatch a job immediately, without changing its schedule"""
+        with self.change() as jobs:
+            if job_id in jobs:
+                jobs[job_id]["run_requested"] = datetime.now().isoformat(timespec="seconds")
+
+    def jobs(self):
+        return sorted(self.load().values(), key=lambda job: job["next_run"] or "9999")
+
+    def beat(self):
+        """Record that the scheduler service is alive"""
+        tmp_path = self.heartbeat_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"pid": os.getpid(), "host": socket.gethostname(), "ts": time.time()}, file)
+        os.replace(tmp_path, self.heartbeat_path)
+
+    def service_status(self, max_age=90):
+        """The last heartbeat of the service, or None if it has not been seen for `max_age` seconds"""
+        try:
+            with open(self.heartbeat_path) as file:
+                heartbeat = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return heartbeat if time.time() - heartbeat.get("ts", 0) <= max_age else None
+
+def refresh_settings():
+    """Re-read the settings files the web interface may have changed since the service started"""
+    for shared in (get_ssh_auth(), get_retry_policy(), get_shutdown_verifier(), get_wake_on_lan(),
+                   get_agent_client()):
+        try:
+            with open(shared.settings_path) as file:
+                shared.settings.update(json.load(file))
+        except (OSError, ValueError):
+            pass
+    agent_client = get_agent_client()
+    try:
+        with open(agent_client.key_path) as file:
+            agent_client.key = file.read().strip()
+    except OSError:
+        pass
+
+class ShutdownScheduler:
+    """Runs the jobs of a JobStore when they are due; the `turnoff scheduler` service
+
+    Pending runs are kept in a min-heap of (timestamp, job_id, next_run) and the
+    loop sleeps until the earliest one is due, waking every `poll_interval`
+    seconds to reload the store if its file changed, so thousands of jobs cost
+    nothing while idle. Removed or rescheduled jobs leave stale heap entries that
+    are discarded lazily when popped. Before a job is dispatched its next run is
+    moved forward under the store lock, so a second service never runs it twice.
+    A run missed by more than `misfire_grace` seconds (the service was stopped)
+    is skipped: recurring jobs move to their next day, one-off jobs are disabled.
+    """
+
+    def __init__(self, store, inventory, misfire_grace=600, poll_interval=2, heartbeat_interval=30):
+        self.store = store
+        self.inventory = inventory
+        self.misfire_grace = misfire_grace  # Segundos de retraso tolerados tras un reinicio
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._stop = threading.Event()
+        self._jobs = {}
+        self._heap = []
+        self._revision = None
+        self._last_beat = 0
+
+    @staticmethod
+    def _job_time(job):
+        return datetime.strptime(job["time"], "%H:%M").time()
+
+    def _reload(self):
+        """Reload the jobs and rebuild the heap when the store changed"""
+        revision = self.store.revision()
+        if revision == self._revision:
+            return
+        self._revision = revision
+        self._jobs = self.store.load()
+        self._heap = [(datetime.fromisoformat(job["next_run"]).timestamp(), job["id"], job["next_run"])
+                      for job in self._jobs.values() if job.get("enabled") and job.get("next_run")]
+        heapq.heapify(self._heap)
+
+    def _claim(self, job_id, next_run):
+        """Advance a due job in the store; returns it if it should run now, None if stale or missed"""
+        now = datetime.now()
+        with self.store.change() as jobs:
+            job = jobs.get(job_id)
+            # Borrada, desactivada o ya reprogramada (por la interfaz o por otro servicio)
+            if not job or not job.get("enabled") or job.get("next_run") != next_run:
+                return None
+            missed = (now - datetime.fromisoformat(next_run)).total_seconds() > self.misfire_grace
+            if job["days"]:
+                job["next_run"] = next_occurrence(self._job_time(job), job["days"], now).isoformat()
+            else:
+                job["enabled"] = False
+                job["next_run"] = None
+            if missed:
+                # Se perdió la ejecución mientras el servicio estaba detenido
+                job["last_result"] = "No ejecutada (planificador detenido)"
+                return None
+            return dict(job)
+
+    def _claim_requests(self):
+        """Take the jobs flagged by run_now() in the store"""
+        if not any(job.get("run_requested") for job in self._jobs.values()):
+            return []
+        with self.store.change() as jobs:
+            requested = [job for job in jobs.values() if job.pop("run_requested", None)]
+        return [dict(job) for job in requested]
+
+    def _dispatch(self, job):
+        threading.Thread(target=self._execute, args=(job,), name=f"job-{job['id'][:8]}", daemon=True).start()
+
+    def run_pending(self):
+        """Dispatch the due and requested jobs; returns seconds until the next due run"""
+        self._reload()
+        due = self._claim_requests()
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, job_id, next_run = heapq.heappop(self._heap)
+            job = self._claim(job_id, next_run)
+            if job:
+                due.append(job)
+        if due:
+            refresh_settings()
+        for job in due:
+            self._dispatch(job)
+        return self._heap[0][0] - now if self._heap else None
+
+    def serve(self):
+        """Run jobs until stop() is called"""
+        while not self._stop.is_set():
+            if time.time() - self._last_beat >= self.heartbeat_interval:
+                self.store.beat()
+                self._last_beat = time.time()
+            wait = self.run_pending()
+            # Sondear el archivo también detecta tareas nuevas y cambios del reloj del sistema
+            self._stop.wait(self.poll_interval if wait is None else max(0, min(wait, self.poll_interval)))
+
+    def stop(self):
+        self._stop.set()
+
+    def _execute(self, job):
+        options = job.get("options", {})
+        # Las credenciales se toman del inventario en el momento de la ejecución
+        if job.get("selector"):
+            try:
+                targets = self.inventory.select(job["selector"])
+            except ValueError as e:
+                targets = []
+                get_activity_log().append(log_entry(False, "-", "-", f"Tarea '{job['name']}': expresión no válida ({str(e)})"))
+        else:
+            targets = []
+            for target in job["targets"]:
+                if target["IP"].strip():
+                    targets.append(self.inventory.get_by_ip(target["IP"]) or target)
+        total = len(targets)
+        if job.get("action") == "wake":
+            get_activity_log().append(log_entry(True, "-", "-", f"Tarea '{job['name']}': iniciando encendido de {total} equipos"))
+            success_count = 0
+            try:
+                for entry in get_wake_on_lan().wake(targets, "scheduled_wake"):
+                    success_count += entry["success"]
+                    get_activity_log().append(entry)
+                result = f"{success_count}/{total} equipos despertados"
+            except Exception as e:
+                result = f"Error: {str(e)}"
+                get_activity_log().append(log_entry(False, "-", "-", f"Tarea '{job['name']}': {result}"))
+            self._finish(job, result)
+            return
+        get_activity_log().append(log_entry(True, "-", "-", f"Tarea '{job['name']}': iniciando apagado de {total} equipos"))
+        success_count = 0
+        try:
+            rollout = options.get("rollout")
+            entries = fleet_operation(
+                targets,
+                immediate_shutdown_task(options.get("host_timeout", 10), options.get("lean", True)),
+                "scheduled_job",
+                agent_action="shutdown",
+                rollout=RolloutPlan(**rollout) if rollout else None,
+                preflight=options.get("preflight", True),
+                preflight_timeout=options.get("preflight_timeout", 0.8),
+                max_workers=options.get("workers", 32),
+                total_timeout=options.get("total_timeout", 600)
+            )
+            sent = []
+            for entry in entries:
+                if entry["success"]:
+                    success_count += 1
+                get_activity_log().append(entry)
+                sent.append(entry)
+            # La confirmación de cada apagado llega después al registro, sin retener al planificador
+            get_shutdown_verifier().watch(sent)
+            result = f"{success_count}/{total} equipos apagados"
+        except Exception as e:
+            result = f"Error: {str(e)}"
+            get_activity_log().append(log_entry(False, "-", "-", f"Tarea '{job['name']}': {result}"))
+        self._finish(job, result)
+
+    def _finish(self, job, result):
+        with self.store.change() as jobs:
+            if job["id"] in jobs:
+                jobs[job["id"]]["last_run"] = datetime.now().isoformat(timespec="seconds")
+                jobs[job["id"]]["last_result"] = result
+
+@lru_cache(maxsize=None)
+def get_job_store():
+    """Shared job store, read and written by the web interface and the scheduler service"""
+    return JobStore(os.path.join(DATA_DIR, "scheduled_jobs.json"))
+
@@ -0,0 +1,444 @@
+"""SSH authentication, pooled connections and bounded remote command execution"""
+import hashlib
+import importlib.util
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from .config import DATA_DIR, SSH_PORT
+from .metrics import elapsed_ms
+
+# paramiko tarda unos 250 ms en importarse: se carga en cada función que lo usa,
+# así las órdenes que no abren sesiones SSH (agente, Wake-on-LAN, listados) arrancan al instante
+
+class SSHAuth:
+    """Key-based authentication and host key checking shared by every connection
+
+    Private keys are decrypted once and cached in-process (keyed by path and
+    modification time); ssh-agent keys are listed at most every `agent_ttl`
+    seconds. Host keys follow trust-on-first-use: the first key seen for a host is
+    appended to data/known_hosts and a different key later is rejected.
+    Settings (default key, passphrase, agent, NOPASSWD sudo, execution backend) are
+    stored in data/ssh_auth.json, readable only by its owner, so background jobs use
+    them too.
+    """
+
+    DEFAULTS = {"default_key": "", "passphrase": "", "use_agent": True, "sudo_nopasswd": False,
+                "backend": "paramiko"}
+
+    def __init__(self, directory, agent_ttl=60):
+        import paramiko
+        self.settings_path = os.path.join(directory, "ssh_auth.json")
+        self.known_hosts_path = os.path.join(directory, "known_hosts")
+        self.agent_ttl = agent_ttl
+        self._lock = threading.Lock()
+        self._keys = {}  # (path, mtime, passphrase hash) -> PKey
+        self._agent = None
+        self._agent_keys = []
+        self._agent_checked = 0
+        self.settings = dict(self.DEFAULTS)
+        if os.path.exists(self.settings_path):
+            os.chmod(self.settings_path, 0o600)
+            with open(self.settings_path) as f:
+                self.settings.update(json.load(f))
+        self._host_keys = paramiko.HostKeys()
+        if os.path.exists(self.known_hosts_path):
+            self._host_keys.load(self.known_hosts_path)
+
+    def save(self, **changes):
+        with self._lock:
+            self.settings.update(changes)
+            # Guarda la frase de paso de la clave: solo legible por el usuario del servicio
+            with open(os.open(self.settings_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+                json.dump(self.settings, f, indent=2)
+            self._keys.clear()
+
+    def load_key(self, path, passphrase=None):
+        """Return the decrypted private key at `path`, reading the file only once"""
+        import paramiko
+        path = os.path.expanduser(path)
+        passphrase = passphrase if passphrase is not None else self.settings["passphrase"]
+        cache_key = (path, os.path.getmtime(path), hashlib.sha256((passphrase or "").encode()).hexdigest())
+        with self._lock:
+            key = self._keys.get(cache_key)
+        if key is None:
+            key = paramiko.PKey.from_path(path, password=passphrase.encode() if passphrase else None)
+            with self._lock:
+                self._keys[cache_key] = key
+        return key
+
+    def agent_keys(self):
+        import paramiko
+        if not self.settings["use_agent"] or not os.environ.get("SSH_AUTH_SOCK"):
+            return []
+        with self._lock:
+            if time.monotonic() - self._agent_checked > self.agent_ttl:
+                try:
+                    if self._agent is None:
+                        self._agent = paramiko.Agent()
+                    self._agent_keys = list(self._agent.get_keys())
+                except Exception:
+                    self._agent, self._agent_keys = None, []
+                self._agent_checked = time.monotonic()
+            return list(self._agent_keys)
+
+    def keys_for(self, key_path=""):
+        """Keys to offer for a host: its own key (or the default one), then the agent's"""
+        keys = []
+        path = key_path or self.settings["default_key"]
+        if path:
+            keys.append(self.load_key(path))
+        return keys + self.agent_keys()
+
+    def has_keys(self):
+        """Whether hosts without a password can still authenticate (default key or agent)"""
+        return bool(self.settings["default_key"]) or bool(self.agent_keys())
+
+    def check_host_key(self, ip, key):
+        """Trust-on-first-use check of a server host key; raises BadHostKeyException on change"""
+        import paramiko
+        with self._lock:
+            known = self._host_keys.lookup(ip)
+            if known is not None and key.get_name() in known:
+                if known[key.get_name()] != key:
+                    raise paramiko.BadHostKeyException(ip, key, known[key.get_name()])
+                return
+            self._host_keys.add(ip, key.get_name(), key)
+            # Se añade al final del archivo en lugar de reescribirlo entero
+            with open(self.known_hosts_path, "a") as f:
+                f.write(f"{ip} {key.get_name()} {key.get_base64()}\n")
+
+    def forget_host(self, ip):
+        """Drop the stored host key of `ip` (e.g. after reinstalling it)"""
+        with self._lock:
+            if ip not in self._host_keys:
+                return False
+            del self._host_keys[ip]
+            self._host_keys.save(self.known_hosts_path)
+            return True
+
+    def known_host_count(self):
+        with self._lock:
+            return len(self._host_keys.keys())
+
+@lru_cache(maxsize=None)
+def get_ssh_auth():
+    """Shared key cache and known hosts"""
+    return SSHAuth(DATA_DIR)
+
+SSH_BACKENDS = ("paramiko", "asyncssh")
+
+def asyncssh_available():
+    return importlib.util.find_spec("asyncssh") is not None
+
+def ssh_backend(backend=None):
+    """Execution backend for fleet tasks: `backend`, else the configured one
+
+    "paramiko" runs one blocking session per worker thread; "asyncssh" multiplexes
+    all sessions on one event loop (see turnoff.aiossh). Falls back to paramiko when
+    asyncssh is not installed.
+    """
+    backend = backend or get_ssh_auth().settings["backend"]
+    if backend not in SSH_BACKENDS or (backend == "asyncssh" and not asyncssh_available()):
+        return "paramiko"
+    return backend
+
+def has_credentials(computer):
+    """Whether the computer can authenticate: own password or key, or a default key/agent"""
+    return bool(computer.get("ssh_password") or computer.get("ssh_key") or get_ssh_auth().has_keys())
+
+def connect_failure(error):
+    """Retry class of an error raised by acquire(): "auth", "hostkey" or "connect" (see turnoff.retry)"""
+    import paramiko
+    if isinstance(error, paramiko.BadHostKeyException):
+        return "hostkey"
+    if isinstance(error, paramiko.AuthenticationException):
+        return "auth"
+    return "connect"
+
+def sudo_attempts(command, sudo_pwd):
+    """(label, command line) pairs that run `command` as root, cheapest first
+
+    `sudo -n` relies on the NOPASSWD rule installed by setup-remote.sh and avoids
+    sending the password; the piped password is the fallback when one is known.
+    """
+    attempts = []
+    if get_ssh_auth().settings["sudo_nopasswd"] or not sudo_pwd:
+        attempts.append((f"sudo -n {command}", f"sudo -n {command}"))
+    if sudo_pwd:
+        attempts.append((f"sudo {command}", f'echo "{sudo_pwd}" | sudo -S {command}'))
+    return attempts
+
+class SSHConnectionPool:
+    """Process-wide pool of authenticated SSH transports keyed by (ip, user)
+
+    Connections are kept alive with SSH keepalives, evicted after `idle_timeout`
+    seconds without use and capped at `max_size` (least recently used first).
+    acquire() leases a connection until release(); leased connections are never
+    evicted for capacity, so during a fan-out wider than `max_size` the pool grows
+    past the cap and is trimmed as leases are returned.
+    A pooled transport idle for more than `check_after` seconds is health-checked
+    with a session round-trip before being handed out again.
+    """
+
+    def __init__(self, max_size=256, idle_timeout=300, keepalive=30, check_after=15):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.check_after = check_after
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (ip, user) -> {"transport", "secret", "last_used", "identity"...}
+        self._host_locks = {}
+        reaper = threading.Thread(target=self._reap_forever, name="ssh-pool-reaper", daemon=True)
+        reaper.start()
+
+    @staticmethod
+    def _secret(password, key_path):
+        return hashlib.sha256(f"{password}\0{key_path}".encode()).hexdigest()
+
+    def _authenticate(self, transport, username, password, key_path):
+        """Try the host's keys and the agent's, then the password; returns the method used"""
+        import paramiko
+        errors = []
+        try:
+            keys = get_ssh_auth().keys_for(key_path)
+        except Exception as e:
+            # Una clave ilegible no impide probar el agente y la contraseña
+            errors.append(f"clave {key_path or get_ssh_auth().settings['default_key']}: {str(e)}")
+            keys = get_ssh_auth().agent_keys()
+        for key in keys:
+            try:
+                transport.auth_publickey(username, key)
+                if transport.is_authenticated():
+                    return "agent" if isinstance(key, paramiko.AgentKey) else "publickey"
+            except paramiko.AuthenticationException as e:
+                errors.append(str(e))
+        if password:
+            transport.auth_password(username, password)
+            if transport.is_authenticated():
+                return "password"
+        raise paramiko.AuthenticationException(errors[-1] if errors else "Authentication failed.")
+
+    def _connect(self, ip, username, password, timeout, trace, key_path=""):
+        import paramiko
+        started = time.perf_counter()
+        family, socktype, proto, _, address = socket.getaddrinfo(ip, SSH_PORT, type=socket.SOCK_STREAM)[0]
+        trace["dns_ms"] = elapsed_ms(started)
+        started = time.perf_counter()
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except Exception:
+            sock.close()
+            raise
+        trace["connect_ms"] = elapsed_ms(started)
+        transport = paramiko.Transport(sock)
+        transport.banner_timeout = timeout
+        transport.handshake_timeout = timeout
+        transport.auth_timeout = timeout
+        try:
+            started = time.perf_counter()
+            transport.start_client(timeout=timeout)
+            get_ssh_auth().check_host_key(ip, transport.get_remote_server_key())
+            trace["handshake_ms"] = elapsed_ms(started)
+            started = time.perf_counter()
+            trace["auth_method"] = self._authenticate(transport, username, password, key_path)
+            trace["auth_ms"] = elapsed_ms(started)
+        except Exception:
+            transport.close()
+            raise
+        transport.set_keepalive(self.keepalive)
+        return transport
+
+    def _healthy(self, entry):
+        transport = entry["transport"]
+        if not transport.is_active() or not transport.is_authenticated():
+            return False
+        if time.monotonic() - entry["last_used"] < self.check_after:
+            return True
+        try:
+            channel = transport.open_session(timeout=5)
+            channel.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, ip, username, password, timeout=10, trace=None, key_path=""):
+        """Return a live authenticated transport, reusing a pooled one when possible
+
+        Authentication tries `key_path` (or the default key), the ssh-agent and then
+        `password`. When a `trace` dict is given it receives `reused` and, for new
+        connections, the TCP connect, SSH handshake and authentication latencies in
+        milliseconds plus the authentication method. The caller holds a lease on the
+        transport until release(ip, username, transport).
+        """
+        trace = {} if trace is None else trace
+        key = (ip, username)
+        secret = self._secret(password, key_path)
+        with self._lock:
+            host_lock = self._host_locks.setdefault(key, threading.Lock())
+        with host_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry and entry["secret"] == secret and self._healthy(entry):
+                with self._lock:
+                    entry["last_used"] = time.monotonic()
+                    entry["leases"] += 1
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                trace["reused"] = True
+                return entry["transport"]
+            if entry:
+                self.discard(ip, username)
+
+            trace["reused"] = False
+            transport = self._connect(ip, username, password, timeout, trace, key_path)
+            with self._lock:
+                self._entries[key] = {"transport": transport, "secret": secret, "last_used": time.monotonic(),
+                                      "leases": 1}
+                evicted = self._over_capacity()
+            for old in evicted:
+                old["transport"].close()
+            return transport
+
+    def release(self, ip, username, transport):
+        """Return the lease taken by acquire(); the connection stays pooled"""
+        with self._lock:
+            entry = self._entries.get((ip, username))
+            if entry and entry["transport"] is transport and entry["leases"]:
+                entry["leases"] -= 1
+                evicted = self._over_capacity()
+            else:
+                evicted = []
+        for old in evicted:
+            old["transport"].close()
+
+    def _over_capacity(self):
+        """Pop the least recently used entries beyond `max_size` that nobody holds (lock held)"""
+        excess = len(self._entries) - self.max_size
+        if excess <= 0:
+            return []
+        victims = [key for key, entry in self._entries.items() if not entry["leases"]][:excess]
+        return [self._entries.pop(key) for key in victims]
+
+    def identity(self, ip, username, max_age=300):
+        """Remote identity (whoami) verified on the pooled connection within `max_age` seconds"""
+        with self._lock:
+            entry = self._entries.get((ip, username))
+            if entry and entry.get("identity") and time.monotonic() - entry["identity_at"] <= max_age:
+                return entry["identity"]
+        return None
+
+    def remember_identity(self, ip, username, identity):
+        with self._lock:
+            entry = self._entries.get((ip, username))
+            if entry:
+                entry["identity"] = identity
+                entry["identity_at"] = time.monotonic()
+
+    def discard(self, ip, username):
+        """Close and forget the pooled connection for (ip, username), if any"""
+        with self._lock:
+            entry = self._entries.pop((ip, username), None)
+        if entry:
+            try:
+                entry["transport"].close()
+            except Exception:
+                pass
+
+    def evict_idle(self):
+        """Close connections that are dead or have been idle for too long"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if now - entry["last_used"] > self.idle_timeout or not entry["transport"].is_active()]
+            entries = [self._entries.pop(key) for key in stale] + self._over_capacity()
+        for entry in entries:
+            try:
+                entry["transport"].close()
+            except Exception:
+                pass
+        return len(entries)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            try:
+                entry["transport"].close()
+            except Exception:
+                pass
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(max(5, self.idle_timeout / 5))
+            try:
+                self.evict_idle()
+            except Exception:
+                pass
+
+@lru_cache(maxsize=None)
+def get_connection_pool():
+    """Shared SSH connection pool, survives Streamlit reruns and sessions"""
+    return SSHConnectionPool()
+
+MAX_OUTPUT = 4096  # Bytes de stdout/stderr que se conservan por comando
+
+class CommandResult:
+    """Outcome of one remote command: exit status, bounded output and latency
+
+    `label` is what gets logged in place of the command line, so commands that
+    embed a sudo password are never written to the activity log.
+    """
+
+    def __init__(self, label, exit_status, stdout="", stderr="", exec_ms=0.0):
+        self.label = label
+        self.exit_status = exit_status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exec_ms = exec_ms
+
+    @property
+    def ok(self):
+        return self.exit_status == 0
+
+    def as_dict(self):
+        return {"command": self.label, "exit_status": self.exit_status, "exec_ms": self.exec_ms,
+                "stderr": self.stderr[:200]}
+
+def read_bounded(stream, limit=MAX_OUTPUT):
+    """Read at most `limit` bytes from a channel file and discard the rest"""
+    data = stream.read(limit)
+    while stream.read(65536):
+        pass
+    return data.decode(errors="replace").strip()
+
+def run_remote(transport, command, timeout=10, label=None):
+    """Run a command on a new channel of `transport` and return a CommandResult"""
+    started = time.perf_counter()
+    channel = transport.open_session(timeout=timeout)
+    try:
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+        stdout = read_bounded(channel.makefile("rb"))
+        stderr = read_bounded(channel.makefile_stderr("rb"))
+        return CommandResult(label or command, channel.recv_exit_status(), stdout, stderr, elapsed_ms(started))
+    finally:
+        channel.close()
+
+def start_remote(transport, command, timeout=10):
+    """Start a command on a new channel of `transport` and return the channel without waiting"""
+    channel = transport.open_session(timeout=timeout)
+    channel.settimeout(timeout)
+    channel.exec_command(command)
+    return channel
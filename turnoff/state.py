@@ -0,0 +1,190 @@
+"""Cached per-host power state, refreshed in the background"""
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from functools import lru_cache
+
+from .agent import get_agent_client
+from .config import SSH_PORT
+from .inventory import get_inventory, normalize_mac
+from .network import read_arp_table, scan_hosts
+from .ssh import get_connection_pool, has_credentials, run_remote
+
+HOST_STATUS_COMMAND = (
+    "cat /proc/uptime; echo ---; cat /proc/loadavg; echo ---; "
+    "cat /run/systemd/shutdown/scheduled 2>/dev/null; echo ---; "
+    "shutdown --show 2>&1 </dev/null || true; echo ---; "
+    "cat /sys/class/net/$(ip route show default 2>/dev/null | awk '{print $5; exit}')/address 2>/dev/null"
+)
+
+def parse_host_status(output):
+    """Parse the output of HOST_STATUS_COMMAND into uptime, load, pending shutdown and MAC"""
+    sections = (output.split("---") + [""] * 5)[:5]
+    status = {"uptime": None, "load": None, "pending_shutdown": None, "mac": None}
+    try:
+        status["uptime"] = float(sections[0].split()[0])
+    except (IndexError, ValueError):
+        pass
+    status["load"] = " ".join(sections[1].split()[:3]) or None
+    scheduled = dict(line.split("=", 1) for line in sections[2].split() if "=" in line)
+    if scheduled.get("USEC"):
+        when = datetime.fromtimestamp(int(scheduled["USEC"]) / 1_000_000)
+        status["pending_shutdown"] = f"{when.strftime('%d/%m %H:%M')} ({scheduled.get('MODE', 'poweroff')})"
+    elif sections[3].strip().lower().startswith(("shutdown scheduled", "poweroff scheduled")):
+        status["pending_shutdown"] = sections[3].strip().split(",")[0]
+    try:
+        status["mac"] = normalize_mac(sections[4]) or None
+    except ValueError:
+        pass
+    return status
+
+class HostStateCache:
+    """Per-host power state (reachability, uptime, load, pending shutdown) with TTLs
+
+    A background worker wakes every `interval` seconds and refreshes only the entries
+    older than `ttl`: an SSH port probe for every stale host, then one combined SSH
+    command on the reachable Linux hosts that have credentials. Hosts running the
+    remote agent answer one status datagram instead. The dashboard reads from here
+    instead of opening SSH sessions while rendering. MAC addresses reported by the
+    hosts, or found in the local ARP cache, are saved to the inventory for Wake-on-LAN.
+    """
+
+    def __init__(self, inventory, interval=60, ttl=120, workers=32, probe_timeout=1.0, ssh_timeout=5):
+        self.inventory = inventory
+        self.interval = interval
+        self.ttl = ttl
+        self.workers = workers
+        self.probe_timeout = probe_timeout
+        self.ssh_timeout = ssh_timeout
+        self.enabled = True
+        self.last_cycle = None
+        self._lock = threading.Lock()
+        self._states = {}
+        self._wake = threading.Event()
+        worker = threading.Thread(target=self._run_forever, name="host-state-refresh", daemon=True)
+        worker.start()
+
+    def get(self, ip):
+        with self._lock:
+            return self._states.get(ip)
+
+    def invalidate(self, ips):
+        """Mark hosts as stale so the next cycle refreshes them"""
+        with self._lock:
+            for ip in ips:
+                if ip in self._states:
+                    self._states[ip]["checked_at"] = 0
+
+    def refresh_now(self):
+        self._wake.set()
+
+    def summary(self):
+        with self._lock:
+            states = list(self._states.values())
+        return {
+            "up": sum(1 for state in states if state["reachable"]),
+            "down": sum(1 for state in states if not state["reachable"]),
+            "pending": sum(1 for state in states if state.get("pending_shutdown"))
+        }
+
+    def _run_forever(self):
+        while True:
+            if self.enabled:
+                try:
+                    self.refresh_stale()
+                except Exception:
+                    pass  # Un fallo puntual no debe detener el monitoreo
+            self._wake.wait(timeout=self.interval)
+            self._wake.clear()
+
+    def _details(self, computer):
+        ip, user = computer["IP"].strip(), computer["ssh_user"]
+        transport = get_connection_pool().acquire(ip, user, computer["ssh_password"], timeout=self.ssh_timeout,
+                                                  key_path=computer["ssh_key"])
+        try:
+            return parse_host_status(run_remote(transport, HOST_STATUS_COMMAND, timeout=self.ssh_timeout).stdout)
+        finally:
+            get_connection_pool().release(ip, user, transport)
+
+    def refresh_stale(self):
+        """Refresh every entry older than the TTL; returns the number of hosts checked"""
+        now = time.time()
+        computers = {}
+        for computer in self.inventory.iter_rows():
+            if computer["IP"].strip():
+                computers[computer["IP"].strip()] = computer
+        with self._lock:
+            for ip in [ip for ip in self._states if ip not in computers]:
+                del self._states[ip]  # Equipo eliminado del inventario
+            stale = [ip for ip in computers
+                     if ip not in self._states or now - self._states[ip]["checked_at"] >= self.ttl]
+        if not stale:
+            return 0
+
+        if get_agent_client().enabled:
+            # Los equipos con agente responden su estado en un solo datagrama
+            replies = get_agent_client().send([ip for ip in stale if computers[ip]["OS"] == "Linux"], "status")
+            for ip, reply in replies.items():
+                with self._lock:
+                    self._states[ip] = {"reachable": True, "latency_ms": reply["rtt_ms"], "error": None,
+                                        "checked_at": time.time(), "uptime": reply.get("uptime"),
+                                        "load": reply.get("load"), "pending_shutdown": reply.get("pending"),
+                                        "mac": reply.get("mac")}
+            stale = [ip for ip in stale if ip not in replies]
+
+        reachable = []
+        for ip, up, latency, error in scan_hosts(stale, SSH_PORT, self.probe_timeout):
+            state = {"reachable": up, "latency_ms": latency, "error": error, "checked_at": time.time(),
+                     "uptime": None, "load": None, "pending_shutdown": None, "mac": None}
+            with self._lock:
+                self._states[ip] = state
+            if up and computers[ip]["OS"] == "Linux" and has_credentials(computers[ip]):
+                reachable.append(computers[ip])
+
+        if reachable:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(reachable))) as executor:
+                futures = {executor.submit(self._details, computer): computer["IP"].strip() for computer in reachable}
+                for future in as_completed(futures):
+                    ip = futures[future]
+                    try:
+                        details = future.result()
+                        error = None
+                    except Exception as e:
+                        details, error = {}, str(e)
+                    with self._lock:
+                        self._states[ip].update(details)
+                        if error:
+                            self._states[ip]["error"] = error
+        self._save_macs(computers)
+        self.last_cycle = time.time()
+        return len(stale)
+
+    def _save_macs(self, computers):
+        """Store new or changed MACs; hosts that did not report one are looked up in the ARP cache"""
+        arp = read_arp_table()
+        macs = {}
+        with self._lock:
+            for ip, state in self._states.items():
+                mac = state.get("mac") or (arp.get(ip) if state["reachable"] else None)
+                if mac and computers.get(ip, {}).get("MAC") != mac:
+                    macs[ip] = mac
+        try:
+            self.inventory.set_macs(macs)
+        except sqlite3.Error:
+            pass  # Se reintentará en el próximo ciclo
+
+@lru_cache(maxsize=None)
+def get_host_states():
+    """Shared host state cache, refreshed in the background"""
+    return HostStateCache(get_inventory())
+
+def format_uptime(seconds):
+    """Human friendly uptime such as '3d 4h' or '25m'"""
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}d {hours}h"
+    return f"{hours}h {minutes}m" if hours else f"{minutes}m"
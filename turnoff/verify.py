@@ -0,0 +1,128 @@
+"""Shutdown confirmation: hosts told to power off must stop answering on the SSH port"""
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+from .config import DATA_DIR, SSH_PORT
+from .logs import get_activity_log
+from .metrics import get_metrics
+from .network import scan_hosts
+
+CONFIRMATION_LABELS = {"sent": "⏳ apagado sin confirmar", "off": "🔌 apagado confirmado",
+                       "up": "⚠️ sigue encendido"}
+
+class ShutdownVerifier:
+    """Confirms that the hosts of an immediate shutdown really powered off
+
+    Entries marked with confirmation "sent" (the order was accepted) are verified
+    together: after `grace` seconds their SSH port is probed every `interval`
+    seconds, a host that misses `misses` probes in a row is confirmed off, and the
+    hosts still answering after `deadline` seconds are reported as still up and
+    marked as failed. Each entry goes from "sent" to "off" or "up" in place and in
+    the activity log, with the seconds it took under "confirmation_s". Settings live
+    in data/verify.json; keyword arguments override them.
+    """
+
+    DEFAULTS = {"enabled": True, "grace": 5, "interval": 5, "deadline": 180, "misses": 2, "probe_timeout": 1.0}
+
+    def __init__(self, directory=None, activity_log=None, **settings):
+        self.settings_path = os.path.join(directory, "verify.json") if directory else None
+        self.activity_log = activity_log
+        self.settings = dict(self.DEFAULTS)
+        if self.settings_path and os.path.exists(self.settings_path):
+            with open(self.settings_path) as f:
+                self.settings.update(json.load(f))
+        self.settings.update(settings)
+        self._lock = threading.Lock()
+        self._pending = {}  # ip -> número de verificaciones en curso
+
+    def save(self, **changes):
+        self.settings.update(changes)
+        if self.settings_path:
+            with open(self.settings_path, "w") as f:
+                json.dump(self.settings, f, indent=2)
+
+    def probe_until_off(self, ips, concurrency=256):
+        """Yield (ip, off, seconds) for every ip as soon as its outcome is known"""
+        started = time.monotonic()
+        time.sleep(self.settings["grace"])
+        misses = dict.fromkeys(ips, 0)
+        while misses:
+            for host, reachable, _, _ in scan_hosts(list(misses), SSH_PORT, self.settings["probe_timeout"],
+                                                    concurrency):
+                misses[host] = 0 if reachable else misses[host] + 1
+                if misses[host] >= self.settings["misses"]:
+                    del misses[host]
+                    yield host, True, time.monotonic() - started
+            if misses and time.monotonic() - started + self.settings["interval"] > self.settings["deadline"]:
+                for host in misses:
+                    yield host, False, time.monotonic() - started
+                return
+            if misses:
+                time.sleep(self.settings["interval"])
+
+    def confirm(self, entries, log=True):
+        """Verify the "sent" entries now, blocking until each one is "off" or "up"; returns them
+
+        With `log` the entries are also updated in the activity log.
+        """
+        watched = {}
+        for entry in entries:
+            if entry.get("confirmation") == "sent":
+                watched.setdefault(entry["ip"], []).append(entry)
+        if not watched:
+            return []
+        with self._lock:
+            for ip in watched:
+                self._pending[ip] = self._pending.get(ip, 0) + 1
+        try:
+            for ip, off, seconds in self.probe_until_off(list(watched)):
+                if off:
+                    get_metrics().observe("immediate_shutdown", "power_off", seconds * 1000)
+                for entry in watched[ip]:
+                    if off:
+                        changes = {"confirmation": "off", "confirmation_s": round(seconds, 1),
+                                   "message": f"{entry['message']} · apagado confirmado a los {seconds:.0f} s"}
+                    else:
+                        changes = {"confirmation": "up", "confirmation_s": round(seconds, 1), "success": False,
+                                   "message": f"{entry['message']} · sigue encendido tras {seconds:.0f} s"}
+                    entry.update(changes)
+                    if log and self.activity_log is not None and entry.get("id"):
+                        self.activity_log.update(entry["id"], **changes)
+        finally:
+            with self._lock:
+                for ip in watched:
+                    self._pending[ip] -= 1
+                    if not self._pending[ip]:
+                        del self._pending[ip]
+        return [entry for group in watched.values() for entry in group]
+
+    def watch(self, entries):
+        """Verify the "sent" entries in a background thread; returns how many hosts are watched"""
+        entries = [entry for entry in entries if entry.get("confirmation") == "sent"]
+        if not entries or not self.settings["enabled"]:
+            return 0
+        threading.Thread(target=self.confirm, args=(entries,), name="shutdown-verifier", daemon=True).start()
+        return len({entry["ip"] for entry in entries})
+
+    def pending(self):
+        """Hosts whose shutdown is being verified right now"""
+        with self._lock:
+            return sorted(self._pending)
+
+    def stragglers(self, since):
+        """IPs whose latest verified shutdown since `since` left them still up"""
+        if self.activity_log is None:
+            return []
+        _, entries = self.activity_log.query(status="verified", since=since, limit=self.activity_log.capacity)
+        latest = {}
+        for entry in entries:  # Las más recientes primero
+            latest.setdefault(entry["ip"], entry["confirmation"])
+        return [ip for ip, confirmation in latest.items() if confirmation == "up"]
+
+@lru_cache(maxsize=None)
+def get_shutdown_verifier():
+    """Shared verifier writing to the shared activity log"""
+    return ShutdownVerifier(DATA_DIR, get_activity_log())
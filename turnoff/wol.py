@@ -0,0 +1,119 @@
+"""Wake-on-LAN magic packets, rate limited and sent in waves"""
+import ipaddress
+import json
+import os
+import socket
+import time
+from functools import lru_cache
+
+from .config import DATA_DIR
+from .inventory import normalize_mac
+from .logs import log_entry
+from .metrics import elapsed_ms, get_metrics
+
+class WakeOnLan:
+    """Wake-on-LAN sender: magic packets in rate-limited, staggered waves
+
+    Each target with a known MAC gets `repeats` magic packets on the UDP `port`,
+    sent to the limited broadcast address and, with `directed`, also to the subnet
+    broadcast of its IP (using `prefix`) so routers configured for directed
+    broadcast can forward it to other VLANs. Packets are paced to `rate` per second
+    and targets are woken `wave_size` at a time with `wave_delay` seconds between
+    waves, so a whole lab does not power on at once. Settings live in data/wol.json.
+    """
+
+    DEFAULTS = {"port": 9, "broadcast": "255.255.255.255", "directed": False, "prefix": 24,
+                "rate": 200, "repeats": 3, "wave_size": 50, "wave_delay": 30}
+
+    def __init__(self, directory):
+        self.settings_path = os.path.join(directory, "wol.json")
+        self.settings = dict(self.DEFAULTS)
+        if os.path.exists(self.settings_path):
+            with open(self.settings_path) as f:
+                self.settings.update(json.load(f))
+
+    def save(self, **changes):
+        self.settings.update(changes)
+        with open(self.settings_path, "w") as f:
+            json.dump(self.settings, f, indent=2)
+
+    @staticmethod
+    def magic_packet(mac):
+        """Six 0xFF bytes followed by the MAC repeated sixteen times; raises ValueError"""
+        normalized = normalize_mac(mac)
+        if not normalized:
+            raise ValueError("Sin dirección MAC")
+        return b"\xff" * 6 + bytes.fromhex(normalized.replace(":", "")) * 16
+
+    def destinations(self, ip):
+        addresses = [self.settings["broadcast"]]
+        if self.settings["directed"]:
+            try:
+                network = ipaddress.ip_network(f"{ip}/{self.settings['prefix']}", strict=False)
+                if network.version == 4 and str(network.broadcast_address) not in addresses:
+                    addresses.append(str(network.broadcast_address))
+            except ValueError:
+                pass  # Nombre de equipo: solo difusión general
+        return addresses
+
+    def waves(self, targets):
+        size = max(1, int(self.settings["wave_size"]))
+        return [targets[start:start + size] for start in range(0, len(targets), size)]
+
+    def wake(self, targets, operation="wake"):
+        """Send magic packets to every target, yielding one log entry per host
+
+        Hosts without a MAC are reported as failures. Delivery cannot be confirmed at
+        this point: the host state cache shows when each host comes back up.
+        """
+        interval = 1.0 / max(1, self.settings["rate"])
+        port = self.settings["port"]
+        started = time.perf_counter()
+        succeeded = 0
+        for target in targets:
+            if not target.get("MAC"):
+                yield log_entry(False, target["IP"].strip(), target["OS"],
+                                "Sin dirección MAC: no se puede encender (se obtiene al consultar el estado)")
+        waves = self.waves([target for target in targets if target.get("MAC")])
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        next_send = time.monotonic()
+        try:
+            for number, wave in enumerate(waves):
+                if number:
+                    time.sleep(self.settings["wave_delay"])
+                for target in wave:
+                    ip = target["IP"].strip()
+                    host_started = time.perf_counter()
+                    try:
+                        packet = self.magic_packet(target["MAC"])
+                        destinations = self.destinations(ip)
+                        for _ in range(self.settings["repeats"]):
+                            for destination in destinations:
+                                delay = next_send - time.monotonic()
+                                if delay > 0:
+                                    time.sleep(delay)
+                                next_send = max(next_send, time.monotonic()) + interval
+                                sock.sendto(packet, (destination, port))
+                    except (OSError, ValueError) as e:
+                        yield log_entry(False, ip, target["OS"], f"Error al enviar el paquete mágico: {str(e)}")
+                        continue
+                    succeeded += 1
+                    timings = {"operation": operation, "transport": "wol",
+                               "total_ms": elapsed_ms(host_started)}
+                    entry = log_entry(True, ip, target["OS"],
+                                      f"Paquete mágico enviado a {target['MAC']} "
+                                      f"(oleada {number + 1}/{len(waves)}, {', '.join(destinations)})",
+                                      timings=timings)
+                    get_metrics().observe_entry(entry)
+                    yield entry
+        finally:
+            sock.close()
+            metrics = get_metrics()
+            metrics.observe_batch(operation, len(targets), succeeded, elapsed_ms(started))
+            metrics.flush()
+
+@lru_cache(maxsize=None)
+def get_wake_on_lan():
+    """Shared Wake-on-LAN sender"""
+    return WakeOnLan(DATA_DIR)